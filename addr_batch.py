@@ -0,0 +1,461 @@
+#!/usr/bin/python3
+""" addr_batch - Runs the address programs for many counties or cities.
+
+Rather than running addr_split, addr_prep, addr_qc and split_osm_addr_by_street
+by hand (or in a shell loop) for each county of Virginia, or co_addr_prep,
+addr_qc and split_osm_addr_by_street for each city of Colorado, addr_batch
+plans a job for each step of each jurisdiction, each depending on the jobs
+whose output it reads:
+
+    Virginia: split -> prep -> qc
+                           -> streets
+    Colorado: prep -> qc
+                   -> streets
+
+and runs the jobs whose dependencies are done, several at a time (--jobs),
+each as a separate process.  The output files are written to the current
+directory, named after the jurisdiction (e.g. augusta_raw.csv,
+augusta_prep.csv, augusta.sqlite, augusta_qc.txt and augusta_streets/ for
+Augusta County).
+
+The jobs are kept in a queue, an SQLite file (batch.sqlite by default), so
+that addr_batch work, run on other hosts sharing the directory, can take
+jobs from the same queue.  Each job records the hash of its program, its
+arguments and its input and configuration files (see job_digest()) when it is
+done, and when the batch is run again the jobs whose hash, and so whose
+input and configuration, is unchanged are skipped.
+
+A worker renews the heartbeat of each job it is running every
+HEARTBEAT_SECONDS.  A job whose heartbeat is older than LEASE_SECONDS (e.g.
+one whose worker, or host, died) is made pending again, and so run by
+another worker.
+
+Each job is run with --stats json, and addr_batch report prints the time
+taken by each job, and the time of each stage of the programs summed over
+the jobs of each step.
+
+Usage:
+$ python3 addr_batch.py va statewide.csv "Augusta County" "Staunton city" --jobs 4
+$ python3 addr_batch.py co CO.gdb/Addresses "Castle Pines" Parker --existing co.osm.pbf
+$ python3 addr_batch.py work --jobs 4    (on another host)
+$ python3 addr_batch.py report
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import addr_cache
+import addr_io
+
+# The default queue file
+QUEUE_FILE = 'batch.sqlite'
+# The configuration files read by the programs, whose contents are hashed
+PREP_CONF = 'addr_prep.conf'
+ZIP_DATABASE = 'zip_code_database.csv'
+# The seconds to wait for jobs running on other hosts before looking again
+POLL_SECONDS = 1.0
+# The seconds between the heartbeats of a running job, and the seconds after
+# its last heartbeat after which the job is taken to be abandoned by its worker
+# (well above the heartbeat, and any difference between the clocks of hosts)
+HEARTBEAT_SECONDS = 10.0
+LEASE_SECONDS = 120.0
+# The states of a job
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def va_slug(county):
+    """ Returns the start of the names of the files of a Virginia county, as
+    addr_split names its output.
+    """
+    return county.lower().replace(' county', '')
+
+def co_slug(city):
+    """ Returns the start of the names of the files of a Colorado city """
+    return '_'.join(city.lower().split())
+
+def job(name, step, jurisdiction, program, args, inputs, outputs, deps=(), configs=(),
+        stdout=None, dirs=()):
+    """ Returns the description of a job, as a dictionary.
+
+    Parameters:
+        name - (in) The name of the job, unique within the queue.
+        step - (in) The step of the workflow, e.g. 'prep'.
+        jurisdiction - (in) The county or city.
+        program - (in) The program run, e.g. 'addr_prep.py'.
+        args - (in) The arguments of the program.
+        inputs - (in) The files read by the program.
+        outputs - (in) The files and directories written by the program.
+        deps - (in) The names of the jobs which must be done first.
+        configs - (in) The configuration files read by the program.
+        stdout - (in) Optional file to which the output of the program is written.
+        dirs - (in) The directories to create, if need be, before the program is run.
+    """
+    # pylint: disable=R0913
+    return {'name': name, 'step': step, 'jurisdiction': jurisdiction, 'program': program,
+            'args': list(args), 'inputs': list(inputs), 'outputs': list(outputs),
+            'deps': list(deps), 'configs': list(configs), 'stdout': stdout,
+            'dirs': list(dirs)}
+
+def va_jobs(input_file, counties):
+    """ Returns the jobs of the Virginia workflow for each county """
+    jobs = []
+    for county in counties:
+        slug = va_slug(county)
+        raw = f'{slug}_raw.csv'
+        store = f'{slug}.sqlite'
+        jobs += [job(f'{slug}:split', 'split', county, 'addr_split.py', [input_file, county],
+                     [input_file], [raw]),
+                 job(f'{slug}:prep', 'prep', county, 'addr_prep.py', [raw, '--store', store],
+                     [raw], [f'{slug}_prep.csv', store], [f'{slug}:split'], [PREP_CONF]),
+                 job(f'{slug}:qc', 'qc', county, 'addr_qc.py', [store], [store],
+                     [f'{slug}_qc.txt'], [f'{slug}:prep'], [ZIP_DATABASE],
+                     stdout=f'{slug}_qc.txt'),
+                 job(f'{slug}:streets', 'streets', county, 'split_osm_addr_by_street.py',
+                     [store, f'{slug}_streets'], [store], [f'{slug}_streets'],
+                     [f'{slug}:prep'], dirs=[f'{slug}_streets'])]
+    return jobs
+
+def co_jobs(fgdb_and_layer, cities, existing=None):
+    """ Returns the jobs of the Colorado workflow for each city """
+    jobs = []
+    for city in cities:
+        slug = co_slug(city)
+        osm = f'{slug}.osm'
+        args = [fgdb_and_layer, osm, '--city', city]
+        # The file geodatabase directory, whose files are stamped
+        inputs = [fgdb_and_layer.rsplit('/', 1)[0]]
+        if existing:
+            args += ['--existing', existing]
+            inputs.append(existing)
+        jobs += [job(f'{slug}:prep', 'prep', city, 'co_addr_prep.py', args, inputs, [osm],
+                     configs=[PREP_CONF]),
+                 job(f'{slug}:qc', 'qc', city, 'addr_qc.py', [osm], [osm], [f'{slug}_qc.txt'],
+                     [f'{slug}:prep'], [ZIP_DATABASE], stdout=f'{slug}_qc.txt'),
+                 job(f'{slug}:streets', 'streets', city, 'split_osm_addr_by_street.py',
+                     [osm, f'{slug}_streets'], [osm], [f'{slug}_streets'], [f'{slug}:prep'],
+                     dirs=[f'{slug}_streets'])]
+    return jobs
+
+def file_hash(file_name):
+    """ Returns the SHA-256 hash of the contents of a file, or None if there is
+    no such file.
+    """
+    if not os.path.isfile(file_name):
+        return None
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file_in:
+        for block in iter(lambda: file_in.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def input_stamps(file_name):
+    """ Returns the stamps (see addr_cache.file_stamp()) of an input file, or of
+    the files in an input directory, such as a file geodatabase, as the stamp
+    of a directory does not change when the files in it are rewritten.
+    """
+    if os.path.isdir(file_name):
+        return [addr_cache.file_stamp(os.path.join(file_name, name))
+                for name in sorted(os.listdir(file_name))]
+    return [addr_cache.file_stamp(file_name)]
+
+def job_digest(description, cwd):
+    """ Returns the hash of a job: of its program and arguments, the stamps of
+    each of its inputs (see input_stamps()), which may be large, and the
+    contents of its configuration files.  The files are relative to cwd, the
+    configuration files found as addr_io.data_file() finds them.
+    """
+    stamps = [input_stamps(os.path.join(cwd, name)) for name in description['inputs']]
+    configs = [file_hash(addr_io.data_file(name, cwd)) for name in description['configs']]
+    content = (description['program'], description['args'], stamps, configs)
+    return hashlib.sha256(repr(content).encode('utf-8')).hexdigest()
+
+class Queue():
+    """ The queue of jobs, an SQLite file which may be shared by several hosts.
+    Each job is claimed within a transaction which locks the file, so that no
+    two workers run the same job.
+    """
+    def __init__(self, file_name):
+        self.connection = sqlite3.connect(file_name, timeout=60, isolation_level=None)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, description TEXT NOT NULL,
+                cwd TEXT NOT NULL, state TEXT NOT NULL, digest TEXT, host TEXT,
+                started REAL, heartbeat REAL, seconds REAL, stats TEXT, error TEXT)''')
+
+    def close(self):
+        """ Closes the queue file """
+        self.connection.close()
+
+    def plan(self, descriptions, cwd):
+        """ Adds the jobs to the queue, or replaces those of the same name,
+        making them all pending.  The hash of the last run of each job is kept,
+        so that it can be skipped if unchanged.
+        """
+        with self.transaction():
+            for description in descriptions:
+                self.connection.execute(
+                    'INSERT INTO jobs (name, description, cwd, state) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (name) DO UPDATE SET description = excluded.description, '
+                    'cwd = excluded.cwd, state = excluded.state, error = NULL',
+                    (description['name'], json.dumps(description), cwd, PENDING))
+
+    def transaction(self):
+        """ Returns a context manager holding the write lock of the file """
+        return _Transaction(self.connection)
+
+    def claim(self, host):
+        """ Marks the first pending job whose dependencies are all done as
+        running on host, and returns its (description, cwd, digest of its
+        last run), or None if there is none.  Also returns whether any job
+        is running, or pending on a job which may still be done.  The jobs
+        which depend, directly or not, on a failed job are left pending.  The
+        running jobs whose heartbeat is older than LEASE_SECONDS are first made
+        pending again.
+        """
+        now = time.time()
+        with self.transaction():
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, host = NULL WHERE state = ? AND heartbeat < ?',
+                (PENDING, RUNNING, now - LEASE_SECONDS))
+            states = dict(self.connection.execute('SELECT name, state FROM jobs'))
+            waiting = RUNNING in states.values()
+            # The jobs are planned after the jobs they depend on
+            for name, description, cwd, digest in self.connection.execute(
+                    'SELECT name, description, cwd, digest FROM jobs WHERE state = ? '
+                    'ORDER BY seq', (PENDING,)).fetchall():
+                description = json.loads(description)
+                dep_states = [states.get(dep) for dep in description['deps']]
+                if all(state in (DONE, SKIPPED) for state in dep_states):
+                    self.connection.execute(
+                        'UPDATE jobs SET state = ?, host = ?, started = ?, heartbeat = ? '
+                        'WHERE name = ?', (RUNNING, host, now, now, name))
+                    return (description, cwd, digest), True
+                if FAILED in dep_states:
+                    states[name] = FAILED
+                else:
+                    waiting = True
+        return None, waiting
+
+    def beat(self, names):
+        """ Renews the heartbeat of the running jobs of the given names """
+        with self.transaction():
+            self.connection.executemany(
+                'UPDATE jobs SET heartbeat = ? WHERE name = ? AND state = ?',
+                [(time.time(), name, RUNNING) for name in names])
+
+    def finish(self, name, state, digest=None, seconds=None, stats=None, error=None):
+        """ Records the end of a job """
+        # pylint: disable=R0913
+        with self.transaction():
+            if state == SKIPPED:
+                self.connection.execute('UPDATE jobs SET state = ? WHERE name = ?',
+                                        (state, name))
+            else:
+                self.connection.execute(
+                    'UPDATE jobs SET state = ?, digest = ?, seconds = ?, stats = ?, error = ? '
+                    'WHERE name = ?', (state, digest, seconds, stats, error, name))
+
+    def jobs(self):
+        """ Returns a list of the (description, state, host, seconds, stats,
+        error) of each job, in the order planned.
+        """
+        return [(json.loads(row[0]),) + tuple(row[1:]) for row in self.connection.execute(
+            'SELECT description, state, host, seconds, stats, error FROM jobs ORDER BY seq')]
+
+class _Transaction():
+    """ A context manager which holds the write lock of an SQLite file (BEGIN
+    IMMEDIATE) until it commits, or on an exception rolls back.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+def parse_stats(text):
+    """ Returns the JSON printed by --stats json at the end of the stderr of a
+    program, or None if there is none.
+    """
+    start = text.rfind('\n{\n')
+    start = start + 1 if start >= 0 else (0 if text.startswith('{\n') else -1)
+    if start < 0:
+        return None
+    try:
+        return json.loads(text[start:])
+    except ValueError:
+        return None
+
+def run_job(description, cwd):
+    """ Runs the program of a job in cwd, returning its (exit status, seconds,
+    stats JSON, stderr).
+    """
+    command = [sys.executable, os.path.join(REPO_DIR, description['program'])] + \
+        description['args'] + ['--stats', 'json']
+    for directory in description['dirs']:
+        os.makedirs(os.path.join(cwd, directory), exist_ok=True)
+    start = time.perf_counter()
+    if description['stdout']:
+        with open(os.path.join(cwd, description['stdout']), 'w', encoding='utf-8') as stdout:
+            result = subprocess.run(command, cwd=cwd, stdout=stdout, stderr=subprocess.PIPE,
+                                    text=True, encoding='utf-8', check=False)
+    else:
+        result = subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, text=True, encoding='utf-8',
+                                check=False)
+    seconds = time.perf_counter() - start
+    stats = parse_stats(result.stderr)
+    return result.returncode, seconds, json.dumps(stats) if stats else None, result.stderr
+
+def work(queue_file, jobs=1):
+    """ Takes jobs from the queue and runs them, up to jobs at a time, until
+    there are none left which can be run.  Jobs whose hash is that of their
+    last run, and whose outputs exist, are skipped.  The heartbeat of the jobs
+    running is renewed every HEARTBEAT_SECONDS.
+    """
+    host = socket.gethostname()
+    queue = Queue(queue_file)
+    running = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            while True:
+                waiting = False
+                while len(running) < jobs:
+                    claimed, waiting = queue.claim(host)
+                    if claimed is None:
+                        break
+                    description, cwd, last_digest = claimed
+                    digest = job_digest(description, cwd)
+                    outputs = [os.path.join(cwd, name) for name in description['outputs']]
+                    if digest == last_digest and all(os.path.exists(name) for name in outputs):
+                        print(f'skipped {description["name"]}', flush=True)
+                        queue.finish(description['name'], SKIPPED)
+                        continue
+                    print(f'running {description["name"]}', flush=True)
+                    future = executor.submit(run_job, description, cwd)
+                    running[future] = (description, digest)
+                if not running:
+                    if not waiting:
+                        break
+                    # Jobs running on other hosts
+                    time.sleep(POLL_SECONDS)
+                    continue
+                done, _ = concurrent.futures.wait(
+                    running, timeout=HEARTBEAT_SECONDS,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                queue.beat(description['name'] for future, (description, _) in running.items()
+                           if future not in done)
+                for future in done:
+                    description, digest = running.pop(future)
+                    status, seconds, stats, stderr = future.result()
+                    if status == 0:
+                        queue.finish(description['name'], DONE, digest, seconds, stats)
+                    else:
+                        print(f'failed {description["name"]}', flush=True)
+                        queue.finish(description['name'], FAILED, None, seconds, stats,
+                                     stderr[-2000:])
+    finally:
+        queue.close()
+
+def print_report(queue_file, file=None):
+    """ Prints the state and time of each job of the queue, the total time of
+    each step, and the time of each stage of the programs (see addr_stats)
+    summed over the jobs of each step.
+    """
+    file = file or sys.stdout
+    queue = Queue(queue_file)
+    try:
+        jobs = queue.jobs()
+    finally:
+        queue.close()
+    print('Jobs', file=file)
+    steps = {}
+    for description, state, host, seconds, stats, error in jobs:
+        time_text = f'{seconds:>10.3f} s' if seconds is not None and state == DONE else ''
+        print(f'    {description["name"]:.<40}{state:.>10}{time_text:>13}  {host or ""}',
+              file=file)
+        if error:
+            for line in error.strip().splitlines()[-3:]:
+                print(f'        {line}', file=file)
+        step = steps.setdefault(description['step'], {'seconds': 0.0, 'stages': {}})
+        if state == DONE:
+            step['seconds'] += seconds or 0.0
+            for stage, stage_summary in (json.loads(stats)['stages'] if stats else {}).items():
+                totals = step['stages'].setdefault(stage, [0.0, 0])
+                totals[0] += stage_summary['seconds']
+                totals[1] += stage_summary['rows']
+    print('Timing by step', file=file)
+    for step_name, step in steps.items():
+        print(f'    {step_name:.<40}{step["seconds"]:>10.3f} s', file=file)
+        for stage, (seconds, rows) in step['stages'].items():
+            print(f'        {stage:.<36}{seconds:>10.3f} s{rows:>10} rows', file=file)
+    print(f'    {"total":.<40}{sum(step["seconds"] for step in steps.values()):>10.3f} s',
+          file=file)
+
+def get_args():
+    """ Gets the command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='addr_batch',
+        description='Runs the address programs for many counties or cities.')
+    parser.add_argument('--queue', default=QUEUE_FILE,
+                        help=f'the queue file (default {QUEUE_FILE})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    va_parser = subparsers.add_parser('va', help='addr_split -> addr_prep -> addr_qc, '
+                                      'split_osm_addr_by_street for each county')
+    va_parser.add_argument('input_file', help='Virginia statewide address file (.csv)')
+    va_parser.add_argument('counties', nargs='+', metavar='county',
+                           help='a county (or city), e.g. "Augusta County"')
+    co_parser = subparsers.add_parser('co', help='co_addr_prep -> addr_qc, '
+                                      'split_osm_addr_by_street for each city')
+    co_parser.add_argument('input_fgdb_and_layer', help='file geodatabase containing address '
+                           'info, including the layer e.g. /path/to/fgdb/layer')
+    co_parser.add_argument('cities', nargs='+', metavar='city', help='a city')
+    co_parser.add_argument('--existing', help='file of existing OSM addresses which are not '
+                           'to be placed in the output (.osm, possibly compressed, or .osm.pbf).')
+    for sub_parser in (va_parser, co_parser):
+        sub_parser.add_argument('--plan-only', action='store_true',
+                                help='only add the jobs to the queue, for addr_batch work')
+    work_parser = subparsers.add_parser('work', help='run jobs from the queue')
+    for sub_parser in (va_parser, co_parser, work_parser):
+        sub_parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                                help='the number of jobs run at once (default the number of '
+                                'CPUs)')
+    subparsers.add_parser('report', help='print the jobs of the queue and their timing')
+    return parser.parse_args()
+
+def main():
+    """ Main function
+    """
+    args = get_args()
+    if args.command in ('va', 'co'):
+        if args.command == 'va':
+            descriptions = va_jobs(args.input_file, args.counties)
+        else:
+            descriptions = co_jobs(args.input_fgdb_and_layer, args.cities, args.existing)
+        queue = Queue(args.queue)
+        try:
+            queue.plan(descriptions, os.getcwd())
+        finally:
+            queue.close()
+        if args.plan_only:
+            return
+    if args.command != 'report':
+        work(args.queue, args.jobs)
+    print_report(args.queue)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_batch module.
+
+Usage:
+$ python3 addr_batch_test.py
+
+"""
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+import addr_batch
+import golden_test
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory() # pylint: disable=R1732
+        golden_test.copy_fixtures(self.work_dir.name,
+                                  os.path.join(golden_test.TEST_DATA_DIR, 'va_sample.csv'),
+                                  os.path.join(golden_test.TEST_DATA_DIR,
+                                               'zip_code_database.csv'))
+        self.queue = os.path.join(self.work_dir.name, addr_batch.QUEUE_FILE)
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def run_batch(self):
+        """ Plans and runs the Virginia jobs for Augusta County, returning the
+        state of each job.
+        """
+        queue = addr_batch.Queue(self.queue)
+        queue.plan(addr_batch.va_jobs('va_sample.csv', ['Augusta County']), self.work_dir.name)
+        queue.close()
+        with contextlib.redirect_stdout(io.StringIO()):
+            addr_batch.work(self.queue, 2)
+        queue = addr_batch.Queue(self.queue)
+        states = {description['name']: state for description, state, *_ in queue.jobs()}
+        queue.close()
+        return states
+
+    def test_va(self):
+        names = ['augusta:split', 'augusta:prep', 'augusta:qc', 'augusta:streets']
+        self.assertEqual(self.run_batch(), dict.fromkeys(names, addr_batch.DONE))
+        for file_name in ['augusta_raw.csv', 'augusta_prep.csv', 'augusta.sqlite',
+                          'augusta_qc.txt', 'augusta_streets']:
+            self.assertTrue(os.path.exists(os.path.join(self.work_dir.name, file_name)))
+        with open(os.path.join(self.work_dir.name, 'augusta_qc.txt'), encoding='utf-8') as qc:
+            self.assertIn('List of cities found in data', qc.read())
+        report = io.StringIO()
+        addr_batch.print_report(self.queue, report)
+        self.assertIn('Timing by step', report.getvalue())
+        self.assertIn('read', report.getvalue())
+        # Nothing has changed
+        self.assertEqual(self.run_batch(), dict.fromkeys(names, addr_batch.SKIPPED))
+        # addr_split does not read the configuration, and so is not run again, but
+        # the others are, as addr_qc reads the store written again by addr_prep
+        with open(os.path.join(self.work_dir.name, 'addr_prep.conf'), 'a',
+                  encoding='utf-8') as conf:
+            conf.write('\n')
+        self.assertEqual(self.run_batch(), {'augusta:split': addr_batch.SKIPPED,
+                                            'augusta:prep': addr_batch.DONE,
+                                            'augusta:qc': addr_batch.DONE,
+                                            'augusta:streets': addr_batch.DONE})
+
+    def test_failure(self):
+        queue = addr_batch.Queue(self.queue)
+        queue.plan(addr_batch.va_jobs('missing.csv', ['Augusta County']), self.work_dir.name)
+        queue.close()
+        with contextlib.redirect_stdout(io.StringIO()):
+            addr_batch.work(self.queue, 2)
+        queue = addr_batch.Queue(self.queue)
+        states = [state for _, state, *_ in queue.jobs()]
+        queue.close()
+        # The jobs depending on the failed one are left pending
+        self.assertEqual(states, [addr_batch.FAILED] + [addr_batch.PENDING] * 3)
+
+    def test_stale(self):
+        queue = addr_batch.Queue(self.queue)
+        queue.plan(addr_batch.va_jobs('va_sample.csv', ['Augusta County']), self.work_dir.name)
+        # A worker which died while running the split job
+        claimed, _ = queue.claim('dead')
+        self.assertEqual(claimed[0]['name'], 'augusta:split')
+        self.assertEqual(queue.claim('other'), (None, True))
+        with queue.transaction():
+            queue.connection.execute('UPDATE jobs SET heartbeat = ? WHERE name = ?',
+                                     (time.time() - addr_batch.LEASE_SECONDS - 1,
+                                      'augusta:split'))
+        queue.close()
+        with contextlib.redirect_stdout(io.StringIO()):
+            addr_batch.work(self.queue, 2)
+        queue = addr_batch.Queue(self.queue)
+        jobs = queue.jobs()
+        queue.close()
+        self.assertEqual([state for _, state, *_ in jobs], [addr_batch.DONE] * 4)
+        self.assertNotIn('dead', [host for _, _, host, *_ in jobs])
+
+    def test_directory_input(self):
+        # A file geodatabase is a directory, whose own stamp is unchanged when
+        # one of its tables is rewritten in place
+        fgdb = os.path.join(self.work_dir.name, 'CO.gdb')
+        os.mkdir(fgdb)
+        table = os.path.join(fgdb, 'a00000009.gdbtable')
+        with open(table, 'wb') as table_out:
+            table_out.write(b'one')
+        description = addr_batch.co_jobs('CO.gdb/Addresses', ['Castle Pines'])[0]
+        digest = addr_batch.job_digest(description, self.work_dir.name)
+        stamp = os.stat(fgdb).st_mtime_ns
+        with open(table, 'r+b') as table_out:
+            table_out.write(b'two, longer')
+        os.utime(fgdb, ns=(stamp, stamp))
+        self.assertNotEqual(addr_batch.job_digest(description, self.work_dir.name), digest)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,332 @@
+#!/usr/bin/python3
+""" addr_boundary - Boundary polygons, and point in polygon tests for many points
+at once.
+
+A Boundary is read from the Polygon and MultiPolygon features of a GeoJSON file
+(e.g. a county boundary exported from OSM or the Census TIGER files), and
+tests which of a batch of locations lie within it.  Rather than testing each
+point against every edge of the boundary, which for a detailed county boundary
+has tens of thousands of edges, the edges are placed into horizontal bands,
+and each point is only tested (by counting the crossings of a ray from the
+point) against the few edges of its band.
+
+When numpy is installed, the points of each band are tested against its edges
+all at once, as arrays, otherwise one at a time.  The result is the same.
+
+A BoundaryIndex holds many named areas, e.g. the municipal boundaries or the
+ZIP Code Tabulation Areas (ZCTAs) of a state, and finds the area holding each
+of a batch of locations.  With shapely 2 installed (pip install shapely) the
+areas are held in an STRtree of prepared geometries, which is queried with the
+whole batch at once.  Otherwise the bounding boxes of the areas are placed in
+a grid, and each location is only tested against the few areas whose boxes
+cover its cell of the grid, each a Boundary.
+
+assign_jurisdictions() is a pipeline stage (see addr_pipeline) which uses them
+to fill in a missing addr:city or addr:postcode from the location, and addr_qc
+uses them to report addresses whose city or postcode does not match the area
+the address lies in.
+
+Usage:
+    boundary = Boundary.from_file('augusta_county.geojson')
+    inside = boundary.contains(lats, lons)
+    cities = BoundaryIndex.from_file('va_places.geojson', CITY_KEYS)
+    names = cities.lookup(locations)
+"""
+import math
+import addr_pipeline
+from addr_stats import STATS
+
+# The average number of edges in each band
+BAND_EDGES = 8
+# The maximum number of bands
+MAX_BANDS = 4096
+# The number of cells across the grid of a BoundaryIndex without shapely
+GRID_CELLS = 256
+# The properties holding the name of each area, the first found being used:
+# those of the Census TIGER places and ZCTAs, and of OSM boundaries.
+CITY_KEYS = ('NAME', 'name', 'NAME20', 'CITY', 'city')
+POSTCODE_KEYS = ('ZCTA5CE20', 'ZCTA5CE10', 'GEOID20', 'postal_code', 'ZIP', 'zip')
+
+def numpy_module():
+    """ Returns the numpy module, or None if it is not installed """
+    try:
+        import numpy # pylint: disable=C0415
+    except ImportError:
+        return None
+    return numpy
+
+def geojson_polygons(file_name):
+    """ Returns a list of the (properties, polygons) of each Polygon or
+    MultiPolygon feature in a GeoJSON file, where polygons is a list of the
+    polygons, each a list of rings, each a list of (lon, lat) coordinates.
+    """
+    features = []
+    for collection in addr_pipeline.geojson_collections(file_name):
+        if collection.get('type') == 'Feature':
+            collection = {'features': [collection]}
+        elif collection.get('type') in ('Polygon', 'MultiPolygon'):
+            collection = {'features': [{'geometry': collection}]}
+        for feature in collection.get('features', []):
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+            polygons = [[[(float(point[0]), float(point[1])) for point in ring]
+                         for ring in polygon] for polygon in polygons]
+            features.append((feature.get('properties') or {}, polygons))
+    return features
+
+class Boundary():
+    """ An area bounded by one or more polygons (with holes).  The polygons are
+    expected not to overlap each other, as a point is within the area if a ray
+    from it crosses the rings an odd number of times.
+
+    Parameters:
+        polygons - (in) A list of polygons, each a list of rings, each a list of
+            (lon, lat) coordinates.
+    """
+    def __init__(self, polygons):
+        edges = []
+        for polygon in polygons:
+            for ring in polygon:
+                for (lon1, lat1), (lon2, lat2) in zip(ring, ring[1:] + ring[:1]):
+                    # Horizontal edges are never crossed by a horizontal ray
+                    if lat1 != lat2:
+                        edges.append((lon1, lat1, lon2, lat2))
+        lons = [edge[0] for edge in edges] + [edge[2] for edge in edges]
+        lats = [edge[1] for edge in edges] + [edge[3] for edge in edges]
+        self.bbox = ((min(lats), min(lons), max(lats), max(lons)) if edges
+                     else (0.0, 0.0, -1.0, -1.0))
+        self.band_count = max(1, min(MAX_BANDS, len(edges) // BAND_EDGES))
+        self.band_height = (self.bbox[2] - self.bbox[0]) / self.band_count or 1.0
+        self.bands = [[] for _ in range(self.band_count)]
+        for edge in edges:
+            low, high = sorted((edge[1], edge[3]))
+            for band in range(self.band_of(low), self.band_of(high) + 1):
+                self.bands[band].append(edge)
+        self.numpy = numpy_module()
+        if self.numpy is not None:
+            # Each band as arrays of x1, y1, x2, y2, and x2 - x1 over y2 - y1
+            self.band_arrays = []
+            for band in self.bands:
+                x1, y1, x2, y2 = (self.numpy.array(column, dtype=float)
+                                  for column in (list(zip(*band)) or [()] * 4))
+                self.band_arrays.append((x1, y1, y2, (x2 - x1) / (y2 - y1)))
+
+    @classmethod
+    def from_file(cls, file_name):
+        """ Returns the Boundary made of all of the polygons in a GeoJSON file """
+        return cls([polygon for _, polygons in geojson_polygons(file_name)
+                    for polygon in polygons])
+
+    def band_of(self, lat):
+        """ Returns the band holding a latitude within the bbox """
+        return min(int((lat - self.bbox[0]) / self.band_height), self.band_count - 1)
+
+    def contains_point(self, lat, lon):
+        """ Returns True if the location is within the boundary """
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+            return False
+        inside = False
+        for x1, y1, x2, y2 in self.bands[self.band_of(lat)]:
+            if (y1 > lat) != (y2 > lat) and lon < (x2 - x1) * (lat - y1) / (y2 - y1) + x1:
+                inside = not inside
+        return inside
+
+    def contains(self, lats, lons):
+        """ Returns which of the locations are within the boundary, as a list of
+        booleans, or with numpy as an array of booleans.  lats and lons are
+        sequences (or with numpy, arrays) of floats, in which NaN is never within
+        the boundary.
+        """
+        numpy = self.numpy
+        if numpy is None:
+            return [not (math.isnan(lat) or math.isnan(lon)) and self.contains_point(lat, lon)
+                    for lat, lon in zip(lats, lons)]
+        lats = numpy.asarray(lats, dtype=float)
+        lons = numpy.asarray(lons, dtype=float)
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        inside = numpy.zeros(len(lats), dtype=bool)
+        with numpy.errstate(invalid='ignore'):
+            candidates = numpy.flatnonzero((lats >= min_lat) & (lats <= max_lat) &
+                                           (lons >= min_lon) & (lons <= max_lon))
+        if not len(candidates): # pylint: disable=C1802
+            return inside
+        bands = numpy.minimum(((lats[candidates] - min_lat) / self.band_height).astype(int),
+                              self.band_count - 1)
+        order = numpy.argsort(bands, kind='stable')
+        candidates = candidates[order]
+        bands = bands[order]
+        starts = numpy.flatnonzero(numpy.r_[True, bands[1:] != bands[:-1]])
+        ends = numpy.r_[starts[1:], len(bands)]
+        for start, end in zip(starts, ends):
+            x1, y1, y2, slope = self.band_arrays[bands[start]]
+            if not len(x1): # pylint: disable=C1802
+                continue
+            points = candidates[start:end]
+            lat = lats[points][:, None]
+            lon = lons[points][:, None]
+            crossings = ((y1 > lat) != (y2 > lat)) & (lon < slope * (lat - y1) + x1)
+            inside[points] = crossings.sum(axis=1) % 2 == 1
+        return inside
+
+def shapely_module():
+    """ Returns the shapely module if shapely 2 (which has STRtree queries of
+    many geometries at once) is installed, otherwise None.
+    """
+    try:
+        import shapely # pylint: disable=C0415
+    except ImportError:
+        return None
+    return shapely if hasattr(shapely, 'prepare') else None
+
+def feature_name(properties, keys):
+    """ Returns the value of the first of keys found in properties, or None """
+    for key in keys:
+        if properties.get(key) not in (None, ''):
+            return str(properties[key])
+    return None
+
+class BoundaryIndex():
+    """ A spatial index of named areas, which finds the area holding each of many
+    locations.  Where areas overlap, the first is used.
+
+    Parameters:
+        areas - (in) A list of the (name, polygons) of each area, where polygons
+            is as for Boundary.
+    """
+    def __init__(self, areas):
+        self.names = [name for name, _ in areas]
+        self.shapely = shapely_module()
+        if self.shapely is not None:
+            shapely = self.shapely
+            geometries = [shapely.MultiPolygon([shapely.Polygon(polygon[0], polygon[1:])
+                                                for polygon in polygons])
+                          for _, polygons in areas]
+            shapely.prepare(geometries)
+            self.tree = shapely.STRtree(geometries)
+            return
+        self.boundaries = [Boundary(polygons) for _, polygons in areas]
+        boxes = [boundary.bbox for boundary in self.boundaries
+                 if boundary.bbox[0] <= boundary.bbox[2]]
+        if not boxes:
+            self.grid = {}
+            return
+        self.origin = (min(box[0] for box in boxes), min(box[1] for box in boxes))
+        self.cell_size = max(max(box[2] for box in boxes) - self.origin[0],
+                             max(box[3] for box in boxes) - self.origin[1]) / GRID_CELLS or 1.0
+        self.grid = {}
+        for index, boundary in enumerate(self.boundaries):
+            min_lat, min_lon, max_lat, max_lon = boundary.bbox
+            if min_lat > max_lat:
+                continue
+            low = self.cell(min_lat, min_lon)
+            high = self.cell(max_lat, max_lon)
+            for row in range(low[0], high[0] + 1):
+                for column in range(low[1], high[1] + 1):
+                    self.grid.setdefault((row, column), []).append(index)
+
+    @classmethod
+    def from_file(cls, file_name, keys):
+        """ Returns the BoundaryIndex of the Polygon and MultiPolygon features of a
+        GeoJSON file, each named by the first of the properties keys that it has.
+        Features with none of them are skipped.
+        """
+        with STATS.timer('read boundaries'):
+            areas = [(feature_name(properties, keys), polygons)
+                     for properties, polygons in geojson_polygons(file_name)]
+            return cls([(name, polygons) for name, polygons in areas if name is not None])
+
+    def cell(self, lat, lon):
+        """ Returns the (row, column) of the cell of the grid holding a location """
+        return (int((lat - self.origin[0]) / self.cell_size),
+                int((lon - self.origin[1]) / self.cell_size))
+
+    def lookup(self, locations):
+        """ Returns a list of the name of the area holding each of the locations,
+        a list of (lat, lon), or None for those not in any area or with a lat
+        or lon of None.
+        """
+        found = [None] * len(locations)
+        known = [index for index, (lat, lon) in enumerate(locations)
+                 if lat is not None and lon is not None]
+        if self.shapely is not None:
+            if not known:
+                return found
+            shapely = self.shapely
+            points = shapely.points([locations[index][1] for index in known],
+                                    [locations[index][0] for index in known])
+            point_indexes, area_indexes = self.tree.query(points, predicate='intersects')
+            # The pairs are not in any particular order, and the first area wins
+            first = {}
+            for point_index, area_index in zip(point_indexes.tolist(), area_indexes.tolist()):
+                if first.get(point_index, area_index) >= area_index:
+                    first[point_index] = area_index
+            for point_index, area_index in first.items():
+                found[known[point_index]] = self.names[area_index]
+            return found
+        for index in known:
+            lat, lon = locations[index]
+            for area in self.grid.get(self.cell(lat, lon), ()):
+                if self.boundaries[area].contains_point(lat, lon):
+                    found[index] = self.names[area]
+                    break
+        return found
+
+def add_args(parser):
+    """ Adds the --city-boundaries and --postcode-boundaries options to an
+    argparse.ArgumentParser
+    """
+    parser.add_argument('--city-boundaries', metavar='GEOJSON_FILE',
+                        help='GeoJSON file of the municipal boundaries (e.g. Census TIGER '
+                        'places), named by their NAME or name property')
+    parser.add_argument('--postcode-boundaries', metavar='GEOJSON_FILE',
+                        help='GeoJSON file of the ZIP Code Tabulation Areas, named by their '
+                        'ZCTA5CE20 (or ZCTA5CE10, GEOID20, postal_code or ZIP) property')
+
+def load_indexes(city_boundaries=None, postcode_boundaries=None):
+    """ Returns the BoundaryIndex of the cities and of the postcodes read from the
+    given GeoJSON files (the --city-boundaries and --postcode-boundaries
+    options), None for those not given.
+    """
+    return (city_boundaries and BoundaryIndex.from_file(city_boundaries, CITY_KEYS),
+            postcode_boundaries and BoundaryIndex.from_file(postcode_boundaries, POSTCODE_KEYS))
+
+def assign_jurisdictions(batches, city_index=None, postcode_index=None):
+    """ Pipeline stage which sets the addr:city and addr:postcode of each record
+    which has none from the area of city_index and postcode_index (each a
+    BoundaryIndex, or None) holding its location.  Existing values are kept, as
+    the postal city of an address often differs from the municipality it lies
+    in, see addr_qc for reporting those which differ.
+    """
+    if city_index is None and postcode_index is None:
+        yield from batches
+        return
+    for batch in batches:
+        with STATS.timer('assign jurisdictions', len(batch)):
+            locations = []
+            for record in batch:
+                lat = record.get('@lat')
+                lon = record.get('@lon')
+                locations.append((None, None) if lat in (None, '') or lon in (None, '')
+                                 else (float(lat), float(lon)))
+            for key, index in (('addr:city', city_index), ('addr:postcode', postcode_index)):
+                if index is None:
+                    continue
+                missing = [position for position, record in enumerate(batch)
+                           if not record.get(key)]
+                if not missing:
+                    continue
+                names = index.lookup([locations[position] for position in missing])
+                assigned = 0
+                for position, name in zip(missing, names):
+                    if name is not None:
+                        batch[position][key] = name
+                        assigned += 1
+                if assigned:
+                    STATS.count(f'{key} assigned from boundaries', assigned)
+        yield batch
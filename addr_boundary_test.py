@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_boundary module, and the coordinate checks of addr_qc
+which use it.
+
+Usage:
+$ python3 addr_boundary_test.py
+
+"""
+import contextlib
+import importlib.util
+import io
+import math
+import os
+import random
+import unittest
+from unittest import mock
+import addr_boundary
+import addr_qc
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+QC_BOUNDARY = os.path.join(REPO_DIR, 'test_data', 'qc_boundary.geojson')
+
+def star(center_lon, center_lat, points=40):
+    """ Returns a ring in the shape of a star, which is far from convex """
+    ring = []
+    for index in range(points):
+        radius = 1.0 if index % 2 else 0.4
+        angle = 2 * math.pi * index / points
+        ring.append((center_lon + radius * math.cos(angle),
+                     center_lat + radius * math.sin(angle)))
+    return ring + ring[:1]
+
+def brute_force(polygons, lat, lon):
+    """ Tests a point against every edge of every ring """
+    inside = False
+    for polygon in polygons:
+        for ring in polygon:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+                if (y1 > lat) != (y2 > lat) and lon < (x2 - x1) * (lat - y1) / (y2 - y1) + x1:
+                    inside = not inside
+    return inside
+
+class BoundaryTestCase(unittest.TestCase):
+    def setUp(self):
+        hole = list(reversed(star(-79.0, 38.0, 20)))
+        self.polygons = [[star(-79.0, 38.0, 400), [(lon / 4 - 59.25, lat / 4 + 28.5)
+                                                   for lon, lat in hole]],
+                         [star(-76.5, 38.0)]]
+        rand = random.Random(3)
+        self.lats = [rand.uniform(36.5, 39.5) for _ in range(3000)] + [float('nan')]
+        self.lons = [rand.uniform(-80.5, -75.0) for _ in range(3000)] + [-79.0]
+
+    def check(self, boundary):
+        expected = [not math.isnan(lat) and brute_force(self.polygons, lat, lon)
+                    for lat, lon in zip(self.lats, self.lons)]
+        self.assertEqual([bool(inside) for inside in boundary.contains(self.lats, self.lons)],
+                         expected)
+        self.assertGreater(sum(expected), 300)
+
+    def test_contains(self):
+        with mock.patch('addr_boundary.numpy_module', return_value=None):
+            self.check(addr_boundary.Boundary(self.polygons))
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy is not installed')
+    def test_contains_numpy(self):
+        self.check(addr_boundary.Boundary(self.polygons))
+
+    def test_from_file(self):
+        boundary = addr_boundary.Boundary.from_file(QC_BOUNDARY)
+        self.assertEqual(boundary.bbox, (38.1, -79.1, 38.2, -79.0))
+        self.assertTrue(boundary.contains_point(38.15, -79.07))
+        # In the hole
+        self.assertFalse(boundary.contains_point(38.151, -79.071))
+
+def square(min_lon, min_lat, size):
+    """ Returns a polygon which is a square """
+    return [[(min_lon, min_lat), (min_lon + size, min_lat), (min_lon + size, min_lat + size),
+             (min_lon, min_lat + size), (min_lon, min_lat)]]
+
+# Staunton with a hole holding Enclave, and Waynesboro (of two parts) beside it
+AREAS = [('Staunton', [square(-79.1, 38.1, 0.1) + square(-79.06, 38.14, 0.02)]),
+         ('Enclave', [square(-79.06, 38.14, 0.02)]),
+         ('Waynesboro', [square(-79.0, 38.1, 0.1), square(-78.8, 38.1, 0.05)])]
+
+class BoundaryIndexTestCase(unittest.TestCase):
+    LOCATIONS = [(38.15, -79.09), (38.15, -79.05), (38.15, -78.95), (38.12, -78.77),
+                 (38.0, -79.0), (None, -79.0)]
+    EXPECTED = ['Staunton', 'Enclave', 'Waynesboro', 'Waynesboro', None, None]
+
+    def test_lookup(self):
+        with mock.patch('addr_boundary.shapely_module', return_value=None):
+            index = addr_boundary.BoundaryIndex(AREAS)
+        self.assertEqual(index.lookup(self.LOCATIONS), self.EXPECTED)
+        rand = random.Random(4)
+        locations = [(rand.uniform(38.0, 38.3), rand.uniform(-79.2, -78.7)) for _ in range(500)]
+        expected = [next((name for name, polygons in AREAS
+                          if brute_force(polygons, lat, lon)), None) for lat, lon in locations]
+        self.assertEqual(index.lookup(locations), expected)
+
+    @unittest.skipUnless(addr_boundary.shapely_module(), 'shapely 2 is not installed')
+    def test_lookup_shapely(self):
+        self.assertEqual(addr_boundary.BoundaryIndex(AREAS).lookup(self.LOCATIONS),
+                         self.EXPECTED)
+
+    def test_assign_and_check(self):
+        with mock.patch('addr_boundary.shapely_module', return_value=None):
+            index = addr_boundary.BoundaryIndex(AREAS)
+        batch = [{'@lat': '38.15', '@lon': '-79.09', 'addr:city': 'Staunton'},
+                 {'@lat': '38.15', '@lon': '-78.95'},
+                 {'@lat': '38.15', '@lon': '-78.95', 'addr:city': 'Staunton'}]
+        batches = list(addr_boundary.assign_jurisdictions([batch], index))
+        self.assertEqual([record.get('addr:city') for record in batches[0]],
+                         ['Staunton', 'Waynesboro', 'Staunton'])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            addr_qc.QcSink({}, indexes=(index, None)).write(batch)
+        self.assertEqual(output.getvalue().count(
+            'City, does not match the municipal boundary at the location'), 1)
+
+class CoordinateTestCase(unittest.TestCase):
+    BATCH = [{'@lat': '38.15', '@lon': '-79.07'}, {'@lat': '38.151', '@lon': '-79.071'},
+             {'@lat': 38.0612, '@lon': -78.9012}, {'@lon': '-79.0'}, {'@lat': '90', '@lon': '1'},
+             {'@lat': '95.0', '@lon': '-79.0'}, {'@lat': '38.2', '@lon': '180'},
+             {'@lat': '0', '@lon': '0.0'}, {'@lat': '', '@lon': ''}]
+    EXPECTED = ([(38.15, -79.07), (38.151, -79.071), (38.0612, -78.9012), (None, -79.0),
+                 (90.0, 1.0), (95.0, -79.0), (38.2, 180.0), (0.0, 0.0), (None, None)],
+                [[], [addr_qc.OUTSIDE_BOUNDARY], [addr_qc.OUTSIDE_BBOX]] +
+                [[error] for error in addr_qc.COORDINATE_ERRORS] +
+                [[addr_qc.COORDINATE_ERRORS[0]]])
+
+    def check(self):
+        boundary = addr_boundary.Boundary.from_file(QC_BOUNDARY)
+        self.assertEqual(addr_qc.check_coordinates(self.BATCH, (38.0, -79.2, 38.3, -78.95),
+                                                   boundary), self.EXPECTED)
+
+    def test_check_coordinates(self):
+        with mock.patch('addr_boundary.numpy_module', return_value=None):
+            self.check()
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy is not installed')
+    def test_check_coordinates_numpy(self):
+        self.check()
+
+if __name__ == '__main__':
+    unittest.main()
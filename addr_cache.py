@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+""" addr_cache - A cache of the results of the addr_qc checks of each street.
+
+When addr_qc is run again and again on the same file while a few streets are
+fixed, the checks of the other streets give the same results each time.  With
+--cache, the results of the checks of the nodes of each street (the errors
+found in each node, and what it adds to the lists of cities, streets and so
+on) are kept in an SQLite file, keyed by a hash (see street_digest()) of the
+tags and locations of the nodes of the street, and of the options and files
+the checks depend on.  Only the streets whose hash is not in the cache are
+checked again, and the results of all of the streets are then merged, in the
+order of the nodes in the file, so that the report is the same as without the
+cache.
+
+Usage:
+    cache = QcCache('qc_cache.sqlite')
+    found = cache.get(digests)
+    cache.put({digest: results, ...})
+    cache.close()
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+
+# Changed whenever the checks or the results kept change, so that results
+# cached by an earlier version are not used
+CACHE_VERSION = 1
+# The keys of the nodes from which the hash of a street is made
+DIGEST_KEYS = ['@id', '@lat', '@lon', 'addr:city', 'addr:street', 'addr:postcode',
+               'addr:housenumber', 'addr:unit']
+# The most digests in each query of the cache
+QUERY_SIZE = 500
+
+def file_stamp(file_name):
+    """ Returns the (path, size, modification time) of a file, which changes
+    when the file does, or None if there is no file.
+    """
+    if not file_name or not os.path.exists(file_name):
+        return None
+    stat = os.stat(file_name)
+    return os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns
+
+def context(options, file_names):
+    """ Returns the context of the checks, from which street_digest() makes each
+    hash along with the nodes: the version of the cache, the options given
+    (e.g. the bounding box) and the stamps of the files (e.g. the ZIP code
+    database and boundary files) read by the checks.
+    """
+    return CACHE_VERSION, tuple(options), tuple(file_stamp(name) for name in file_names)
+
+def street_digest(records, check_context):
+    """ Returns the hash of the records of the nodes of a street, in the order in
+    which they are found in the file, in the given context (see context()).
+    """
+    content = [tuple(record.get(key) for key in DIGEST_KEYS) for record in records]
+    return hashlib.sha256(repr((check_context, content)).encode('utf-8')).hexdigest()
+
+class QcCache():
+    """ The cache of the results of the checks of each street, an SQLite file
+    holding the pickled results of each street keyed by its hash.
+    """
+    def __init__(self, file_name):
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS streets ('
+                                'digest TEXT PRIMARY KEY, results BLOB NOT NULL)')
+
+    def get(self, digests):
+        """ Returns a dictionary of the results of those of the digests which
+        are in the cache.
+        """
+        digests = list(digests)
+        found = {}
+        for start in range(0, len(digests), QUERY_SIZE):
+            chunk = digests[start:start + QUERY_SIZE]
+            for digest, results in self.connection.execute(
+                    'SELECT digest, results FROM streets WHERE digest IN '
+                    f'({", ".join("?" * len(chunk))})', chunk):
+                found[digest] = pickle.loads(results)
+        return found
+
+    def put(self, results):
+        """ Adds the results of each digest of a dictionary to the cache """
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO streets (digest, results) VALUES (?, ?)',
+            [(digest, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+             for digest, value in results.items()])
+        self.connection.commit()
+
+    def keep_only(self, digests):
+        """ Deletes the results of all but the given digests from the cache,
+        whose freed pages are then reused rather than the file growing.
+        """
+        self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS kept (digest TEXT PRIMARY KEY)')
+        self.connection.execute('DELETE FROM kept')
+        self.connection.executemany('INSERT OR IGNORE INTO kept (digest) VALUES (?)',
+                                    [(digest,) for digest in digests])
+        self.connection.execute('DELETE FROM streets WHERE digest NOT IN '
+                                '(SELECT digest FROM kept)')
+        self.connection.execute('DELETE FROM kept')
+        self.connection.commit()
+
+    def close(self):
+        """ Closes the cache file """
+        self.connection.close()
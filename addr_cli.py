@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+""" addr_cli - A single command, osm-addr, for all of the address programs.
+
+Each program is a subcommand, taking the same arguments as the program:
+
+    osm-addr split        addr_split.py
+    osm-addr prep-va      addr_prep.py
+    osm-addr prep-co      co_addr_prep.py
+    osm-addr qc           addr_qc.py
+    osm-addr split-street split_osm_addr_by_street.py
+    osm-addr pipeline     addr_pipeline.py
+    osm-addr batch        addr_batch.py
+    osm-addr daemon       addr_daemon.py
+
+The program of a subcommand is only imported when it is run, so that
+osm-addr --help, and each subcommand, starts without importing the others.
+The optional packages (GDAL, NumPy, PyYAML, pyarrow and so on) are in turn
+only imported by the programs when they are needed.
+
+The configuration file, addr_prep.conf, and the ZIP code database,
+zip_code_database.csv, are read from the current directory if they are there,
+else from the directory named by $OSM_ADDR_DATA, else from beside the programs
+(see addr_io.data_file()).
+
+Usage:
+$ pip install .
+$ osm-addr qc addresses.osm
+$ python3 addr_cli.py prep-va augusta_raw.csv
+"""
+import argparse
+import importlib
+import sys
+
+# The subcommands, and the module and description of each
+COMMANDS = {'split': ('addr_split', 'extract a county from the Virginia statewide file'),
+            'prep-va': ('addr_prep', 'prepare a Virginia county for import to OSM'),
+            'prep-co': ('co_addr_prep', 'prepare a Colorado file geodatabase for import to OSM'),
+            'qc': ('addr_qc', 'check the addresses of an .osm file'),
+            'split-street': ('split_osm_addr_by_street', 'split an .osm file by street'),
+            'pipeline': ('addr_pipeline', 'run a whole workflow in a single pass'),
+            'batch': ('addr_batch', 'run the workflow for many counties or cities'),
+            'daemon': ('addr_daemon', 'run the programs in a resident server')}
+
+def get_parser():
+    """ Returns the parser of the command line, used only for --help and to
+    report an unknown subcommand, as the arguments of each subcommand are
+    parsed by its program.
+    """
+    parser = argparse.ArgumentParser(
+        prog='osm-addr', description='Prepares and checks address data for import to OSM.')
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='command')
+    for command, (_, help_text) in COMMANDS.items():
+        subparsers.add_parser(command, help=help_text, add_help=False)
+    return parser
+
+def run_command(command, args):
+    """ Imports the program of a subcommand and runs its main() with the
+    given arguments.
+    """
+    module_name = COMMANDS[command][0]
+    module = importlib.import_module(module_name)
+    sys.argv = [f'osm-addr {command}'] + list(args)
+    module.main()
+
+def main(argv=None):
+    """ Main function
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        run_command(argv[0], argv[1:])
+    else:
+        get_parser().parse_args(argv)
+
+if __name__ == '__main__':
+    main()
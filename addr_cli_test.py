@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_cli module.  The command is run as a separate
+process, to see what it imports, and that it runs from any directory.
+
+Usage:
+$ python3 addr_cli_test.py
+
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import addr_cli
+import golden_test
+
+CLI = os.path.join(golden_test.REPO_DIR, 'addr_cli.py')
+# The most milliseconds which the help of a command may take, from the import
+# of addr_cli, beyond the startup of Python itself
+HELP_MS = 50
+
+class CliTestCase(unittest.TestCase):
+    def test_help(self):
+        result = subprocess.run([sys.executable, CLI, '--help'], capture_output=True,
+                                text=True, check=True)
+        for command in addr_cli.COMMANDS:
+            self.assertIn(command, result.stdout)
+        result = subprocess.run([sys.executable, CLI, 'no-such-command'], capture_output=True,
+                                text=True, check=False)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn('invalid choice', result.stderr)
+        result = subprocess.run([sys.executable, CLI, 'qc', '--help'], capture_output=True,
+                                text=True, check=True)
+        self.assertIn('usage: osm-addr qc', result.stdout)
+
+    def test_lazy_imports(self):
+        # The programs, and the optional packages, are only imported when needed
+        script = ('import sys, addr_cli\n'
+                  'try:\n'
+                  '    addr_cli.main(sys.argv[1:])\n'
+                  'except SystemExit:\n'
+                  '    pass\n'
+                  'print(sorted(name for name in sys.modules if name in '
+                  '("addr_qc", "addr_prep", "co_addr_prep", "yaml", "osgeo", "numpy", '
+                  '"sqlite3", "osm_pbf")))\n')
+        def imported(*args):
+            result = subprocess.run([sys.executable, '-c', script] + list(args),
+                                    cwd=golden_test.REPO_DIR, capture_output=True, text=True,
+                                    check=True)
+            return result.stdout.splitlines()[-1]
+        self.assertEqual(imported('--help'), '[]')
+        self.assertEqual(imported('qc', '--help'), "['addr_qc']")
+        self.assertEqual(imported('prep-co', '--help'), "['co_addr_prep']")
+
+    def test_help_time(self):
+        # The time taken by the command itself, beyond the startup of Python,
+        # with the modules compiled as when installed, the fastest of a few runs
+        script = ('import contextlib, io, sys, time\n'
+                  'start = time.perf_counter()\n'
+                  'import addr_cli\n'
+                  'try:\n'
+                  '    with contextlib.redirect_stdout(io.StringIO()):\n'
+                  '        addr_cli.main(sys.argv[1:])\n'
+                  'except SystemExit:\n'
+                  '    pass\n'
+                  'print((time.perf_counter() - start) * 1000)\n')
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = {name: value for name, value in os.environ.items()
+                   if name != 'PYTHONDONTWRITEBYTECODE'}
+            env['PYTHONPYCACHEPREFIX'] = cache_dir
+            for command in ([], ['prep-va'], ['prep-co'], ['qc']):
+                times = [float(subprocess.run([sys.executable, '-c', script, *command, '--help'],
+                                              cwd=golden_test.REPO_DIR, env=env,
+                                              capture_output=True, text=True,
+                                              check=True).stdout)
+                         for _ in range(5)]
+                self.assertLess(min(times), HELP_MS, command)
+
+    def test_qc_elsewhere(self):
+        # Run from a directory without the ZIP code database, which is found
+        # through $OSM_ADDR_DATA
+        with tempfile.TemporaryDirectory() as work_dir:
+            shutil.copy(os.path.join(golden_test.TEST_DATA_DIR, 'qc_sample.osm'), work_dir)
+            result = subprocess.run([sys.executable, CLI, 'qc', 'qc_sample.osm'], cwd=work_dir,
+                                    env=dict(os.environ, OSM_ADDR_DATA=golden_test.TEST_DATA_DIR),
+                                    capture_output=True, text=True, check=True)
+        with open(os.path.join(golden_test.GOLDEN_DIR, 'qc_sample.txt'),
+                  encoding='utf-8') as golden_in:
+            self.assertEqual(golden_test.canonical_text(result.stdout), golden_in.read())
+
+if __name__ == '__main__':
+    unittest.main()
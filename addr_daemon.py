@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+""" addr_daemon - A resident server which runs the address programs without
+the cost of starting them each time.
+
+Each run of addr_prep, co_addr_prep or addr_qc starts Python, imports GDAL and
+PyYAML, reads addr_prep.conf and the ZIP code database, and reads the
+--existing addresses, before it does any work.  The server does these once:
+the programs are imported when it starts and stay imported, and the results
+of the functions listed in WARM are kept, and only computed again when the
+files they read change (see warm()).  The street names already fixed by
+fix_street_name() are kept with the configuration.
+
+The client sends each job, the name of a program and its arguments, to the
+server over a Unix socket.  The server runs the program's main() in the
+client's working directory, and sends back what it wrote to stdout and
+stderr, and its exit status, which the client passes on as its own.  The jobs
+are run one at a time, as the programs share module level state (e.g.
+STATS).
+
+Usage:
+$ python3 addr_daemon.py serve &
+$ python3 addr_daemon.py run addr_qc addresses.osm
+$ python3 addr_daemon.py run co_addr_prep CastlePines.gdb/Addresses out.osm --existing co.osm.pbf
+$ python3 addr_daemon.py stop
+"""
+import argparse
+import contextlib
+import functools
+import importlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import traceback
+import addr_cache
+import addr_io
+
+# The programs which may be run
+PROGRAMS = ('addr_split', 'addr_prep', 'co_addr_prep', 'addr_qc', 'split_osm_addr_by_street',
+            'addr_pipeline')
+# The optional modules, if installed, and the modules which the programs only
+# import where they are used, which are imported when the server starts
+PRELOAD = ('osgeo.ogr', 'numpy', 'pyarrow', 'shapely', 'zstandard', 'sqlite3', 'addr_boundary',
+           'addr_cache', 'addr_housenumbers', 'addr_store', 'addr_streets', 'osm_pbf',
+           'xml.etree.ElementTree')
+# The functions whose results are kept, as (module, function, files, wrapper),
+# where files is a function of the arguments returning the files the result
+# depends on, and wrapper is warm, or warm_globals for a function which sets
+# module level variables
+WARM = [('addr_prep', 'get_conf', lambda: [addr_io.data_file(addr_io.CONF_FILE)],
+         'warm_globals'),
+        ('co_addr_prep', 'get_conf', lambda: [addr_io.data_file(addr_io.CONF_FILE)],
+         'warm_globals'),
+        ('addr_qc', 'get_zips', lambda: [addr_io.data_file('zip_code_database.csv')], 'warm'),
+        ('co_addr_prep', 'get_existing_addrs',
+         lambda existing_fname, target_city: [existing_fname], 'warm')]
+
+def default_socket():
+    """ Returns the path of the socket used unless --socket is given """
+    return os.environ.get('ADDR_DAEMON_SOCKET') or os.path.join(
+        tempfile.gettempdir(), f'addr_daemon-{os.getuid()}.sock')
+
+def warm(function, files):
+    """ Returns a function which calls function, and keeps the result for each
+    set of arguments (in the current directory) until one of the files
+    returned by files(*args) changes, calling function again only then.
+    """
+    results = {}
+    @functools.wraps(function)
+    def wrapper(*args):
+        key = (os.getcwd(), args)
+        stamps = [addr_cache.file_stamp(file_name) for file_name in files(*args)]
+        if key in results and results[key][0] == stamps:
+            return results[key][1]
+        result = function(*args)
+        results[key] = (stamps, result)
+        return result
+    return wrapper
+
+def warm_globals(function, files):
+    """ Returns a function which calls function, such as get_conf(), which sets
+    module level variables rather than returning anything, only if the files
+    returned by files(*args) (their paths, and their stamps) are not those of
+    the last call, in whichever directory it was made.  Running jobs in one
+    directory, then another with a different addr_prep.conf, then the first
+    again thereby reads the configuration of the first again.
+    """
+    applied = {}
+    @functools.wraps(function)
+    def wrapper(*args):
+        stamps = [addr_cache.file_stamp(file_name) for file_name in files(*args)]
+        if applied.get('key') == (args, stamps):
+            return None
+        result = function(*args)
+        applied['key'] = (args, stamps)
+        return result
+    return wrapper
+
+def preload():
+    """ Imports the programs and the optional modules, and makes the functions of
+    WARM keep their results.
+    """
+    for name in PRELOAD:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    for name in PROGRAMS:
+        importlib.import_module(name)
+    wrappers = {'warm': warm, 'warm_globals': warm_globals}
+    for module_name, function_name, files, wrapper in WARM:
+        module = sys.modules[module_name]
+        setattr(module, function_name,
+                wrappers[wrapper](getattr(module, function_name), files))
+
+def run_job(program, args, cwd):
+    """ Runs the main() of a program with the given arguments in the directory
+    cwd, returning the (status, stdout, stderr) of the run.
+    """
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    if program not in PROGRAMS:
+        return 2, '', f'unknown program {program}, expected one of {", ".join(PROGRAMS)}\n'
+    saved_argv = sys.argv
+    saved_cwd = os.getcwd()
+    status = 0
+    try:
+        os.chdir(cwd)
+        sys.argv = [program + '.py'] + list(args)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                sys.modules[program].main()
+            except SystemExit as error:
+                if isinstance(error.code, int):
+                    status = error.code
+                elif error.code is not None:
+                    print(error.code, file=sys.stderr)
+                    status = 1
+            except Exception: # pylint: disable=W0703
+                traceback.print_exc()
+                status = 1
+    finally:
+        sys.argv = saved_argv
+        os.chdir(saved_cwd)
+    return status, stdout.getvalue(), stderr.getvalue()
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """ Handles a connection from the client: reads one job, a line of JSON,
+    and writes the result as a line of JSON.
+    """
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if request.get('stop'):
+            response = {'status': 0, 'stdout': '', 'stderr': ''}
+            # shutdown() waits for serve_forever() to return, so must be called
+            # from another thread than the one serving this request
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            status, stdout, stderr = run_job(request['program'], request.get('args', []),
+                                             request.get('cwd') or os.getcwd())
+            response = {'status': status, 'stdout': stdout, 'stderr': stderr}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+def serve(socket_path):
+    """ Runs the server on the Unix socket socket_path until a stop request is
+    received.
+    """
+    preload()
+    # The socket is bound under another name and renamed once it listens, so
+    # that a client never finds it before it accepts connections
+    listening_path = f'{socket_path}.{os.getpid()}'
+    if os.path.exists(listening_path):
+        os.unlink(listening_path)
+    with socketserver.UnixStreamServer(listening_path, JobHandler) as server:
+        os.replace(listening_path, socket_path)
+        try:
+            server.serve_forever(poll_interval=0.1)
+        finally:
+            os.unlink(socket_path)
+
+def submit(socket_path, request):
+    """ Sends a request to the server, returning its response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with client.makefile('rb') as response:
+            return json.loads(response.readline())
+
+def get_args():
+    """ Gets the command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='addr_daemon',
+        description='Runs the address programs in a resident server.')
+    parser.add_argument('--socket', default=default_socket(),
+                        help='the Unix socket of the server (default $ADDR_DAEMON_SOCKET, or '
+                        'addr_daemon-UID.sock in the temporary directory)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('serve', help='run the server')
+    run_parser = subparsers.add_parser('run', help='run a program in the server')
+    run_parser.add_argument('program', choices=PROGRAMS)
+    run_parser.add_argument('args', nargs=argparse.REMAINDER,
+                            help='the arguments of the program')
+    subparsers.add_parser('stop', help='stop the server')
+    return parser.parse_args()
+
+def main():
+    """ Main function
+    """
+    args = get_args()
+    if args.command == 'serve':
+        serve(args.socket)
+    elif args.command == 'stop':
+        submit(args.socket, {'stop': True})
+    else:
+        response = submit(args.socket, {'program': args.program, 'args': args.args,
+                                        'cwd': os.getcwd()})
+        sys.stdout.write(response['stdout'])
+        sys.stderr.write(response['stderr'])
+        sys.exit(response['status'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_daemon module.  The server is run as a separate
+process, as it changes the functions of the programs (see addr_daemon.WARM).
+
+Usage:
+$ python3 addr_daemon_test.py
+
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import addr_daemon
+import golden_test
+
+class WarmTestCase(unittest.TestCase):
+    def test_warm(self):
+        calls = []
+        def read(file_name):
+            calls.append(file_name)
+            with open(file_name, encoding='utf-8') as file_in:
+                return file_in.read()
+        with tempfile.TemporaryDirectory() as work_dir:
+            file_name = os.path.join(work_dir, 'conf')
+            with open(file_name, 'w', encoding='utf-8') as file_out:
+                file_out.write('one')
+            warm_read = addr_daemon.warm(read, lambda file_name: [file_name])
+            self.assertEqual([warm_read(file_name) for _ in range(3)], ['one'] * 3)
+            self.assertEqual(len(calls), 1)
+            with open(file_name, 'w', encoding='utf-8') as file_out:
+                file_out.write('two, changed')
+            self.assertEqual(warm_read(file_name), 'two, changed')
+            self.assertEqual(len(calls), 2)
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory() # pylint: disable=R1732
+        self.socket = os.path.join(self.work_dir.name, 'daemon.sock')
+        # pylint: disable=R1732
+        self.server = subprocess.Popen([sys.executable, os.path.join(golden_test.REPO_DIR,
+                                                                     'addr_daemon.py'),
+                                        '--socket', self.socket, 'serve'])
+        for _ in range(200):
+            if os.path.exists(self.socket):
+                break
+            time.sleep(0.05)
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            self.server.kill()
+        self.server.wait()
+        self.work_dir.cleanup()
+
+    def test_jobs(self):
+        for file_name in ['qc_sample.osm', 'zip_code_database.csv']:
+            shutil.copy(os.path.join(golden_test.TEST_DATA_DIR, file_name), self.work_dir.name)
+        with open(os.path.join(golden_test.GOLDEN_DIR, 'qc_sample.txt'),
+                  encoding='utf-8') as golden_in:
+            expected = golden_in.read()
+        request = {'program': 'addr_qc', 'args': ['qc_sample.osm'], 'cwd': self.work_dir.name}
+        for _ in range(2):
+            response = addr_daemon.submit(self.socket, request)
+            self.assertEqual(response['status'], 0, response['stderr'])
+            self.assertEqual(golden_test.canonical_text(response['stdout']), expected)
+        response = addr_daemon.submit(self.socket, dict(request, args=['missing.osm']))
+        self.assertEqual(response['status'], 1)
+        self.assertIn('missing.osm', response['stderr'])
+        response = addr_daemon.submit(self.socket, dict(request, args=['--no-such-option']))
+        self.assertEqual(response['status'], 2)
+        addr_daemon.submit(self.socket, {'stop': True})
+        self.assertEqual(self.server.wait(10), 0)
+        self.assertFalse(os.path.exists(self.socket))
+
+    def test_directories(self):
+        # Each job uses the addr_prep.conf of its own directory, even when the
+        # jobs go back and forth between directories
+        dirs = [os.path.join(self.work_dir.name, name) for name in ('a', 'b')]
+        for work_dir in dirs:
+            os.mkdir(work_dir)
+            golden_test.copy_fixtures(work_dir)
+            shutil.copy(os.path.join(golden_test.TEST_DATA_DIR, 'va_sample.csv'),
+                        os.path.join(work_dir, 'va_sample_raw.csv'))
+        conf_b = os.path.join(dirs[1], 'addr_prep.conf')
+        with open(conf_b, encoding='utf-8') as conf_in:
+            conf = conf_in.read()
+        with open(conf_b, 'w', encoding='utf-8') as conf_out:
+            conf_out.write(conf.replace('  TRL: Trail\n', '  TRL: Trailway\n'))
+        outputs = []
+        for work_dir in dirs + dirs[:1]:
+            response = addr_daemon.submit(self.socket, {'program': 'addr_prep',
+                                                        'args': ['va_sample_raw.csv'],
+                                                        'cwd': work_dir})
+            self.assertEqual(response['status'], 0, response['stderr'])
+            with open(os.path.join(work_dir, 'va_sample_prep.csv'), encoding='utf-8') as prep:
+                outputs.append(prep.read())
+        self.assertNotIn('Trailway', outputs[0])
+        self.assertIn('Trailway', outputs[1])
+        self.assertEqual(outputs[2], outputs[0])
+        addr_daemon.submit(self.socket, {'stop': True})
+        self.server.wait(10)
+
+if __name__ == '__main__':
+    unittest.main()
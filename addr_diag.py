@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+""" addr_diag - Collects the diagnostic messages produced while normalizing addresses.
+
+Rather than printing a message for every row in which, for example, an
+unrecognized street type abbreviation is found, the message is reported to the
+module level DIAG object.  Messages are de-duplicated by category and value,
+counted, and a few sample records kept for each, so that at the end of the run
+a single summary table can be printed, or written to a .csv file.
+
+Usage, within a program:
+    DIAG.reset(describe_row)
+    for row in rows:
+        DIAG.set_record(row)
+        ...
+        DIAG.report('unhandled street type abbreviation', street_type)
+    addr_diag.finish(args.diagnostics_csv)
+
+describe_row is a function which turns a record into a short description for
+use as a sample.  It is only called for the few records which are kept as
+samples.
+"""
+import csv
+import sys
+
+class Diagnostics():
+    """ Counts diagnostic messages by category and value, keeping a few samples of
+    the records in which each was found.
+    """
+    def __init__(self, describe=repr, max_samples=3):
+        self.describe = describe
+        self.max_samples = max_samples
+        self.entries = {}
+        self.record = None
+
+    def reset(self, describe=repr):
+        """ Discards all messages reported so far, and sets the function used to
+        describe sample records.
+        """
+        self.__init__(describe, self.max_samples)
+
+    def set_record(self, record):
+        """ Sets the record currently being processed, which is kept as a sample
+        if a message is reported for it.
+        """
+        self.record = record
+
+    def report(self, category, value=''):
+        """ Reports a message of the given category (e.g. 'unhandled street suffix')
+        concerning the given value (e.g. 'ZZ').
+        """
+        key = (category, value)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = [0, []]
+            self.entries[key] = entry
+        entry[0] += 1
+        if len(entry[1]) < self.max_samples and self.record is not None:
+            entry[1].append(self.describe(self.record))
+
+    def items(self):
+        """ A generator function that yields the category, value, count and list of
+        samples for each message, sorted by category and value.
+        """
+        for (category, value), (count, samples) in sorted(self.entries.items(),
+                                                          key=lambda x: (x[0][0], str(x[0][1]))):
+            yield category, value, count, samples
+
+    def __len__(self):
+        return len(self.entries)
+
+    def print_summary(self, file=None):
+        """ Prints a summary table of the messages, in the style of the addr_qc
+        summaries.
+        """
+        if not self.entries:
+            return
+        file = file or sys.stdout
+        print('Diagnostics', file=file)
+        for category, value, count, samples in self.items():
+            msg = f'{category}: {value!r}' if value != '' else category
+            print(f'    {msg:.<75}{count:.>5}', file=file)
+            for sample in samples:
+                print(f'        e.g. {sample}', file=file)
+
+    def write_csv(self, file_name):
+        """ Writes the messages, one per row, to a .csv file.
+        """
+        with open(file_name, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['category', 'value', 'count'] +
+                            [f'sample_{i + 1}' for i in range(self.max_samples)])
+            for category, value, count, samples in self.items():
+                writer.writerow([category, value, count] + samples)
+
+DIAG = Diagnostics()
+
+def add_args(parser):
+    """ Adds the --diagnostics-csv option to an argparse.ArgumentParser
+    """
+    parser.add_argument('--diagnostics-csv', metavar='CSV_FILE',
+                        help='write the summary of diagnostic messages (e.g. unrecognized '
+                        'abbreviations) to CSV_FILE rather than printing it')
+
+def finish(diagnostics_csv=None):
+    """ At the end of a run, either prints the summary of diagnostic messages, or
+    writes it to the given .csv file.
+    """
+    if diagnostics_csv:
+        DIAG.write_csv(diagnostics_csv)
+    else:
+        DIAG.print_summary()
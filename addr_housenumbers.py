@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+""" addr_housenumbers - Checks of the house numbers along each street.
+
+The checks of addr_qc look at one address at a time, and so cannot see a
+house number which is out of sequence along its street, or an odd number
+among the even numbers of one side of the street.  check_street() looks at
+all of the addresses of a street at once:
+
+* The locations are projected onto the principal axis of the street (the
+  line through them along which they are most spread out), and sorted along
+  it, taking O(n log n) time for the n addresses of the street.
+* The addresses are split into the two sides of that axis.  Where most of the
+  numbers of a side are odd (or even), the others are reported.
+* Along each side the numbers should rise (or fall) steadily.  The numbers
+  which are not part of the longest rising (or falling) sequence of the side,
+  found in O(n log n) time, are reported as out of sequence.
+* A number much further from those of its neighbours along the street than
+  the usual step between the numbers of the street is reported as an outlier.
+
+The axis is a straight line, so the checks suit straight streets, and those
+which curve gently; for a street which loops back on itself, the sides and
+the order along it are only approximate.  Streets whose addresses are not
+spread out much more along the axis than across it are not checked.
+
+Usage:
+    for housenumber, lat, lon, message in check_street(addresses):
+        ...
+"""
+import bisect
+import math
+import re
+
+# The fewest addresses of a street, and of a side of it, which are checked
+MIN_ADDRESSES = 4
+# The addresses of a street are only checked if they are spread out along its
+# axis at least this many times as much as across it (the ratio of the
+# standard deviations), as otherwise the axis, and so the sides and the order
+# along the street, are unreliable, e.g. for a short street or a cul-de-sac.
+MIN_ELONGATION = 1.5
+# The fraction of the numbers of a side which must be odd (or even) for the
+# others to be reported
+PARITY_MAJORITY = 0.8
+# The number of neighbours along the street on each side of an address whose
+# numbers it is compared with to find outliers
+OUTLIER_NEIGHBOURS = 2
+# A number is an outlier when it is more than this many times the median step
+# between the numbers of the street, and at least OUTLIER_MIN, from the median
+# of its neighbours
+OUTLIER_FACTOR = 10
+OUTLIER_MIN = 100
+# The metres in a degree of latitude
+METRES_PER_DEGREE = 111320.0
+
+WRONG_PARITY = 'House number, odd/even on the wrong side of the street'
+OUT_OF_SEQUENCE = 'House number, out of sequence along the street'
+OUTLIER = 'House number, far from the numbers of its neighbours along the street'
+
+def parse_number(housenumber):
+    """ Returns the number at the start of a house number (e.g. 12 for '12A'
+    or '12-14'), or None if it does not start with one.
+    """
+    match = re.match(r'\s*(\d+)', housenumber or '')
+    return int(match.group(1)) if match else None
+
+def principal_axis(points):
+    """ Returns the centroid (x, y) of a list of points and the angle of the
+    principal axis through it, the direction in which the points are most
+    spread out.
+    """
+    count = len(points)
+    mean_x = sum(x for x, _ in points) / count
+    mean_y = sum(y for _, y in points) / count
+    sxx = sum((x - mean_x) ** 2 for x, _ in points)
+    syy = sum((y - mean_y) ** 2 for _, y in points)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    return (mean_x, mean_y), 0.5 * math.atan2(2 * sxy, sxx - syy)
+
+def longest_sequence(numbers):
+    """ Returns the set of the indexes of the numbers in the longest
+    non-decreasing subsequence of numbers, found by patience sorting in
+    O(n log n) time.
+    """
+    # tails[i] is the smallest number ending a subsequence of length i + 1,
+    # and tail_indexes[i] its index
+    tails = []
+    tail_indexes = []
+    previous = [None] * len(numbers)
+    for index, number in enumerate(numbers):
+        position = bisect.bisect_right(tails, number)
+        if position > 0:
+            previous[index] = tail_indexes[position - 1]
+        if position == len(tails):
+            tails.append(number)
+            tail_indexes.append(index)
+        else:
+            tails[position] = number
+            tail_indexes[position] = index
+    found = set()
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        found.add(index)
+        index = previous[index]
+    return found
+
+def check_street(addresses):
+    """ Checks the house numbers of the addresses of a street, a list of
+    (housenumber, lat, lon).  Returns a list of the (housenumber, lat, lon,
+    message) of each problem found, in order along the street.
+    """
+    # pylint: disable=R0914
+    numbered = [(parse_number(housenumber), housenumber, lat, lon)
+                for housenumber, lat, lon in addresses]
+    numbered = [address for address in numbered if address[0] is not None]
+    if len(numbered) < MIN_ADDRESSES:
+        return []
+    # Metres east and north of the first address
+    lat0 = numbered[0][2]
+    scale = math.cos(math.radians(lat0))
+    points = [((lon - numbered[0][3]) * scale * METRES_PER_DEGREE,
+               (lat - lat0) * METRES_PER_DEGREE) for _, _, lat, lon in numbered]
+    (mean_x, mean_y), angle = principal_axis(points)
+    cos_a = math.cos(angle)
+    sin_a = math.sin(angle)
+    # The distance of each address along the axis, and to its left
+    along = [(x - mean_x) * cos_a + (y - mean_y) * sin_a for x, y in points]
+    across = [(y - mean_y) * cos_a - (x - mean_x) * sin_a for x, y in points]
+    # <= so that a street whose addresses are all at one point is not checked
+    if sum(value * value for value in along) <= \
+            MIN_ELONGATION ** 2 * sum(value * value for value in across):
+        return []
+    order = sorted(range(len(numbered)), key=lambda index: (along[index], numbered[index][0]))
+    messages = {index: [] for index in order}
+    for side in (True, False):
+        indexes = [index for index in order if (across[index] >= 0) == side]
+        if len(indexes) < MIN_ADDRESSES:
+            continue
+        odd = sum(numbered[index][0] % 2 for index in indexes)
+        for parity, count in ((1, odd), (0, len(indexes) - odd)):
+            if count >= PARITY_MAJORITY * len(indexes):
+                for index in indexes:
+                    if numbered[index][0] % 2 != parity:
+                        messages[index].append(WRONG_PARITY)
+        numbers = [numbered[index][0] for index in indexes]
+        rising = longest_sequence(numbers)
+        falling = longest_sequence([-number for number in numbers])
+        in_sequence = rising if len(rising) >= len(falling) else falling
+        for position, index in enumerate(indexes):
+            if position not in in_sequence:
+                messages[index].append(OUT_OF_SEQUENCE)
+    numbers = [numbered[index][0] for index in order]
+    steps = sorted(abs(second - first) for first, second in zip(numbers, numbers[1:]))
+    limit = max(OUTLIER_MIN, OUTLIER_FACTOR * steps[len(steps) // 2])
+    for position, index in enumerate(order):
+        neighbours = sorted(numbers[max(0, position - OUTLIER_NEIGHBOURS):position] +
+                            numbers[position + 1:position + 1 + OUTLIER_NEIGHBOURS])
+        if abs(numbers[position] - neighbours[len(neighbours) // 2]) > limit:
+            messages[index].append(OUTLIER)
+    return [(numbered[index][1], numbered[index][2], numbered[index][3], message)
+            for index in order for message in messages[index]]
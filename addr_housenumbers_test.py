@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_housenumbers module.
+
+Usage:
+$ python3 addr_housenumbers_test.py
+
+"""
+import contextlib
+import io
+import math
+import random
+import unittest
+import addr_housenumbers
+import addr_qc
+
+def street(numbers, angle=30.0):
+    """ Returns the (housenumber, lat, lon) of the addresses of a straight street
+    near Staunton, VA at the given angle, the odd numbers on its left and the
+    even numbers on its right, about 10 metres apart for each 2 of number.
+    """
+    rand = random.Random(7)
+    addresses = []
+    for number in numbers:
+        along = int(number) * 5.0
+        across = 15.0 if int(number) % 2 else -15.0
+        east = along * math.cos(math.radians(angle)) - across * math.sin(math.radians(angle))
+        north = along * math.sin(math.radians(angle)) + across * math.cos(math.radians(angle))
+        east += rand.uniform(-2, 2)
+        north += rand.uniform(-2, 2)
+        addresses.append((number, 38.15 + north / 111320.0,
+                          -79.07 + east / 111320.0 / math.cos(math.radians(38.15))))
+    rand.shuffle(addresses)
+    return addresses
+
+class HouseNumberTestCase(unittest.TestCase):
+    def test_parse_number(self):
+        self.assertEqual([addr_housenumbers.parse_number(housenumber)
+                          for housenumber in ['12A', '12-14', ' 7', 'Rear', None]],
+                         [12, 12, 7, None, None])
+
+    def test_longest_sequence(self):
+        numbers = [1, 3, 2, 5, 4, 4, 9, 0]
+        found = addr_housenumbers.longest_sequence(numbers)
+        self.assertEqual(len(found), 5)
+        in_order = [numbers[index] for index in sorted(found)]
+        self.assertEqual(in_order, sorted(in_order))
+        self.assertEqual(addr_housenumbers.longest_sequence([]), set())
+
+    def test_clean_street(self):
+        numbers = [str(number) for number in range(100, 160)]
+        for angle in (0.0, 30.0, 90.0, 135.0):
+            self.assertEqual(addr_housenumbers.check_street(street(numbers, angle)), [])
+        # All at one point, so there is no axis, nor sides
+        self.assertEqual(addr_housenumbers.check_street(
+            [(number, 38.1, -79.0) for number in '1 3 5 7 9 2'.split()]), [])
+
+    def test_problems(self):
+        numbers = [str(number) for number in range(100, 160)]
+        addresses = street(numbers)
+        # 121 on the even side, 130 where 140 should be, and 9999 at 150
+        addresses = [(housenumber, lat, lon) for housenumber, lat, lon in addresses
+                     if housenumber not in ('120', '140', '150')]
+        addresses += [(housenumber, lat, lon) for housenumber, lat, lon in street(
+            ['120', '140', '150']) if housenumber == '120']
+        addresses = [('121', lat, lon) if housenumber == '120' else (housenumber, lat, lon)
+                     for housenumber, lat, lon in addresses]
+        addresses += [('130', lat, lon) for _, lat, lon in street(['140'])]
+        addresses += [('9999A', lat, lon) for _, lat, lon in street(['150'])]
+        found = {(housenumber, message) for housenumber, _, _, message
+                 in addr_housenumbers.check_street(addresses)}
+        self.assertIn(('121', addr_housenumbers.WRONG_PARITY), found)
+        self.assertIn(('130', addr_housenumbers.OUT_OF_SEQUENCE), found)
+        self.assertIn(('9999A', addr_housenumbers.OUT_OF_SEQUENCE), found)
+        self.assertIn(('9999A', addr_housenumbers.OUTLIER), found)
+        self.assertEqual({housenumber for housenumber, _ in found}, {'121', '130', '9999A'})
+
+    def test_qc_report(self):
+        # 9 where 109 should be
+        batch = [{'addr:housenumber': '9' if housenumber == '109' else housenumber,
+                  'addr:street': 'Main Street', 'addr:city': 'Staunton', '@lat': str(lat),
+                  '@lon': str(lon)}
+                 for housenumber, lat, lon in street([str(number) for number in range(100, 120)])]
+        # Too short a street to be checked
+        batch += [{'addr:housenumber': housenumber, 'addr:street': 'Oak Court',
+                   'addr:city': 'Staunton', '@lat': str(lat), '@lon': str(lon)}
+                  for housenumber, lat, lon in street(['1', '3', '2', '4', '99'])]
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with addr_qc.QcSink({}, house_numbers=True) as sink:
+                sink.write(batch)
+        report = output.getvalue()
+        self.assertIn('House numbers along each street\n    9 | Main Street | Staunton | ', report)
+        self.assertEqual(report.count(addr_housenumbers.OUT_OF_SEQUENCE), 2)
+        self.assertNotIn('Oak Court |', report)
+
+if __name__ == '__main__':
+    unittest.main()
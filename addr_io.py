@@ -0,0 +1,458 @@
+#!/usr/bin/python3
+""" addr_io - Memory mapped readers for the large .csv and .osm input files, and
+reading and writing of compressed files.
+
+The statewide Virginia address file and .osm extracts are large, and most of
+each record is never looked at: addr_split only needs the MUNICIPALITY field to
+decide whether a row is wanted, and addr_qc only a handful of the tags of each
+node.  The readers in this module map the file into memory and find the
+records in the mapped bytes, using the csv module only for the (rare) blocks
+of records which contain quotes.  Records are only built from the fields (or
+tags) that were asked for.  (Decoding a whole block of records, or a whole
+node, at a time turned out to be quicker than decoding only the wanted fields
+one at a time.)
+
+Each reader can be given a byte range (start, end) of the file, and reads the
+records which begin within it.  The first record boundary at or after start
+is found without reading the file from the beginning, so that several workers
+can each read part of the same file, see chunks().
+
+    for row in csv_records('statewide.csv', fields=['ADDRNUM', 'STREET_NAME']):
+        ...
+    for node in osm_nodes('existing.osm', keys=['addr:street']):
+        ...
+
+csv_records() gives the same rows as csv.DictReader (other than for rows with
+more values than the header, see csv_records()), and osm_nodes() the same
+attributes and tags as an XML parser would, restricted to the requested fields
+or keys.
+
+Files whose names end in .gz, .bz2, .xz or .zst are compressed and decompressed
+on the fly, see open_file(), rather than having to be decompressed to disk
+first.  The readers also accept them, but as a compressed file cannot be
+mapped, it is read in blocks in a separate thread, and only as a whole.
+"""
+import bz2
+import contextlib
+import csv
+import gzip
+import html
+import io
+import itertools
+import lzma
+import mmap
+import operator
+import os
+import re
+import sys
+
+# The configuration file
+CONF_FILE = 'addr_prep.conf'
+# The environment variable naming a directory of configuration and data files
+DATA_ENV = 'OSM_ADDR_DATA'
+# The directory of the programs
+PROGRAM_DIR = os.path.dirname(os.path.abspath(__file__))
+# The size of the blocks in which files are split into records
+BLOCK_SIZE = 1 << 20
+# The extensions of the compressed files which can be read and written.  .zst
+# files require the zstandard package.
+COMPRESSIONS = ('.gz', '.bz2', '.xz', '.zst')
+# gzip's own default; the gzip module's default of 9 is several times slower
+GZIP_LEVEL = 6
+
+def data_file(file_name, directory=None):
+    """ Returns the path of a configuration or data file, e.g. addr_prep.conf or
+    zip_code_database.csv: that in directory (by default the current one) if
+    there is one, else that in the directory named by $OSM_ADDR_DATA, else that
+    beside the programs, or once installed, in <prefix>/share/osm_addr.  If
+    there is none, the name in directory is returned, for the error raised when
+    it is opened.
+    """
+    candidates = [os.path.join(directory or '', file_name)]
+    if os.environ.get(DATA_ENV):
+        candidates.append(os.path.join(os.environ[DATA_ENV], file_name))
+    candidates += [os.path.join(PROGRAM_DIR, file_name),
+                   os.path.join(sys.prefix, 'share', 'osm_addr', file_name)]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return candidates[0]
+
+def read_conf(directory=None):
+    """ Returns the contents of the configuration file, addr_prep.conf (see
+    data_file()), as a dictionary.
+    """
+    # PyYAML is only imported when needed, as it is slow to import
+    import yaml # pylint: disable=C0415
+    with open(data_file(CONF_FILE, directory), 'r', encoding='utf-8') as conf_in:
+        return yaml.load(conf_in, Loader=yaml.SafeLoader)
+
+def compression(file_name):
+    """ Returns the extension (e.g. '.gz') of the compression used for a file,
+    or '' if it is not compressed.
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    return extension if extension in COMPRESSIONS else ''
+
+def strip_compression(file_name):
+    """ Returns the name of a file without its compression extension, e.g.
+    'va_raw.csv' for 'va_raw.csv.gz'.
+    """
+    extension = compression(file_name)
+    return file_name[:-len(extension)] if extension else file_name
+
+def open_file(file_name, mode='r', encoding='utf-8', newline=None):
+    """ Opens a file as open() does, but compressing or decompressing it if its
+    name ends in one of COMPRESSIONS.  When writing .zst files, the compression
+    is spread over all of the CPUs.
+    """
+    extension = compression(file_name)
+    kwargs = {} if 'b' in mode else {'encoding': encoding, 'newline': newline}
+    if extension and 'b' not in mode and 't' not in mode:
+        mode += 't'
+    if extension == '.gz':
+        return gzip.open(file_name, mode, compresslevel=GZIP_LEVEL, **kwargs)
+    if extension == '.bz2':
+        return bz2.open(file_name, mode, **kwargs)
+    if extension == '.xz':
+        return lzma.open(file_name, mode, **kwargs)
+    if extension == '.zst':
+        # pylint: disable=C0415
+        import zstandard
+        cctx = zstandard.ZstdCompressor(threads=-1) if 'w' in mode or 'a' in mode else None
+        return zstandard.open(file_name, mode, cctx=cctx, **kwargs)
+    return open(file_name, mode, **kwargs) # pylint: disable=R1732,W1514
+
+def read_blocks(file_in, block_size=None):
+    """ A generator function which yields the contents of a binary file in blocks
+    of block_size (by default BLOCK_SIZE) bytes.  Each block is read (and for a compressed file,
+    decompressed) in a separate thread while the previous one is being
+    processed; the decompressors release the GIL, so this overlaps decompressing
+    with parsing.
+    """
+    # pylint: disable=C0415
+    from concurrent.futures import ThreadPoolExecutor
+    block_size = block_size or BLOCK_SIZE
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(file_in.read, block_size)
+        while True:
+            block = future.result()
+            if not block:
+                return
+            future = executor.submit(file_in.read, block_size)
+            yield block
+
+def _check_whole_file(file_name, start, end):
+    """ Raises ValueError if part of a compressed file is to be read, as it is not
+    possible to start reading a compressed file at an arbitrary offset.
+    """
+    if compression(file_name) and (start or end is not None):
+        raise ValueError(f'{file_name} is compressed, so can only be read as a whole')
+
+@contextlib.contextmanager
+def mapped(file_name):
+    """ A context manager which maps the (uncompressed) file read only into
+    memory, and yields the mmap object, or b'' for an empty file (which cannot
+    be mapped).
+    """
+    file_in = open(file_name, 'rb') # pylint: disable=R1732
+    buf = b''
+    try:
+        if os.fstat(file_in.fileno()).st_size:
+            buf = mmap.mmap(file_in.fileno(), 0, access=mmap.ACCESS_READ)
+        yield buf
+    finally:
+        if buf:
+            buf.close()
+        file_in.close()
+
+def chunks(file_name, count):
+    """ Divides the file into count byte ranges (start, end) of about the same
+    size, for reading by count separate workers.  The ranges need not fall on
+    record boundaries, as each reader starts with the first record that begins
+    within its range.  A compressed file can only be read as a whole, so it is
+    a single range (0, None).
+    """
+    if compression(file_name):
+        return [(0, None)]
+    size = os.path.getsize(file_name)
+    offsets = [size * i // count for i in range(count + 1)]
+    return list(zip(offsets[:-1], offsets[1:]))
+
+# CSV
+
+def _csv_record_end(buf, start):
+    """ Returns the offset just after the end of line of the csv record starting
+    at start.  A line containing an odd number of quotes ends within a quoted
+    field, so the record continues on the next line.
+    """
+    quotes = 0
+    pos = start
+    while True:
+        newline = buf.find(b'\n', pos)
+        if newline < 0:
+            return len(buf)
+        quotes += buf[pos:newline].count(b'"')
+        if quotes % 2 == 0:
+            return newline + 1
+        pos = newline + 1
+
+def _csv_values(line):
+    """ Splits a csv record (bytes, without its end of line) into a list of
+    values, still as bytes unless the record contains quotes.
+    """
+    if b'"' not in line:
+        return line.split(b',')
+    return next(csv.reader(io.StringIO(line.decode('utf-8'), newline='')), [])
+
+def _decode(value):
+    """ Converts a value returned by _csv_values() to a string """
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def _csv_block_rows(block):
+    """ Returns an iterable of the values of each csv record in a block of whole
+    records.  Blocks without quotes (almost all of them, in the Virginia file)
+    are simply split at the commas, rather than by the csv module.
+    """
+    if b'"' in block:
+        rows = csv.reader(io.StringIO(block.decode('utf-8'), newline=''))
+        return (values for values in rows if values)
+    return (line.rstrip('\r').split(',') for line in block.decode('utf-8').split('\n')
+            if line and line != '\r')
+
+def _csv_mapped_blocks(buf, start, end):
+    """ A generator function that splits the csv records beginning at or after
+    start and before end (both of which must be the beginnings of records) into
+    blocks of about BLOCK_SIZE bytes, which is much quicker than one line at a
+    time.
+    """
+    pos = start
+    while pos < end:
+        block_end = min(pos + BLOCK_SIZE, end)
+        if block_end < end:
+            block_end = _csv_record_end(buf, block_end)
+            # The block must contain whole records, i.e. an even number of quotes
+            while block_end < end and buf[pos:block_end].count(b'"') % 2:
+                block_end = _csv_record_end(buf, block_end)
+            block_end = min(block_end, end)
+        yield buf[pos:block_end]
+        pos = block_end
+
+def _csv_stream_blocks(file_in):
+    """ A generator function that reads a binary file, yielding blocks of whole
+    csv records.
+    """
+    rest = b''
+    for block in read_blocks(file_in):
+        block = rest + block
+        # Split after the last end of line which is not within a quoted field
+        cut = block.rfind(b'\n')
+        while cut >= 0 and block.count(b'"', 0, cut) % 2:
+            cut = block.rfind(b'\n', 0, cut)
+        rest = block[cut + 1:]
+        if cut >= 0:
+            yield block[:cut + 1]
+    if rest:
+        yield rest
+
+def _csv_header(line):
+    """ Returns the list of field names in the header line of a csv file.
+    """
+    return [_decode(name) for name in _csv_values(line.rstrip(b'\r\n'))]
+
+@contextlib.contextmanager
+def _csv_input(file_name, start, end):
+    """ A context manager which opens a csv file, and yields its header and a
+    generator of the blocks of whole records beginning within the range start
+    to end.
+    """
+    _check_whole_file(file_name, start, end)
+    resources = contextlib.ExitStack()
+    try:
+        if compression(file_name):
+            file_in = resources.enter_context(open_file(file_name, 'rb'))
+            blocks = _csv_stream_blocks(file_in)
+            first = next(blocks, b'')
+            header_end = _csv_record_end(first, 0)
+            header = _csv_header(first[0:header_end])
+            blocks = itertools.chain([first[header_end:]], blocks)
+        else:
+            buf = resources.enter_context(mapped(file_name))
+            header_end = _csv_record_end(buf, 0)
+            header = _csv_header(buf[0:header_end])
+            start = csv_record_start(buf, start, header_end, len(header))
+            # Read up to where the reader of the following range starts
+            if end is None or end >= len(buf):
+                end = len(buf)
+            else:
+                end = csv_record_start(buf, end, header_end, len(header))
+            blocks = _csv_mapped_blocks(buf, start, end)
+        yield header, blocks
+    finally:
+        resources.close()
+
+def csv_record_start(buf, offset, data_start, field_count):
+    """ Returns the offset of the first csv record beginning at or after offset.
+    Records begin just after an end of line, but an end of line may also be
+    within a quoted field.  A candidate is accepted when the record starting there
+    has field_count fields, which without reading the file from the beginning is
+    the best that can be done.  A malformed record (e.g. one that is too short) is
+    therefore never chosen, but is read by the reader of the preceding range.
+    """
+    if offset <= data_start:
+        return data_start
+    newline = buf.find(b'\n', offset - 1)
+    while 0 <= newline < len(buf) - 1:
+        start = newline + 1
+        line = buf[start:_csv_record_end(buf, start)].rstrip(b'\r\n')
+        if len(_csv_values(line)) == field_count:
+            return start
+        newline = buf.find(b'\n', start)
+    return len(buf)
+
+def csv_records(file_name, fields=None, where=None, start=0, end=None):
+    """ A generator function which reads a .csv file yielding a dictionary for
+    each row, with the field names (from the header) as keys.
+
+    Parameters:
+        file_name - (in) The .csv file, in UTF-8, which may be compressed.
+        fields - (in) The fields to include in each dictionary, or None for all.
+            As with csv.DictReader, a field missing from a row (as the row is
+            too short) has the value None.  Unlike csv.DictReader, which keeps
+            them in a list under the key None, the values beyond the last field
+            of a row which is too long are dropped, as the records only have
+            string keys.
+        where - (in) Optional (field, value) pair.  Only those rows where the
+            field matches the value, ignoring case, are yielded.
+        start, end - (in) The byte range of the file from which to read rows, see
+            chunks().  By default the whole file is read.
+    """
+    with _csv_input(file_name, start, end) as (header, blocks):
+        if not header or header == ['']:
+            return
+        names = header if fields is None else fields
+        for name in names:
+            if name not in header:
+                raise ValueError(f'{file_name} has no field {name}')
+        indexes = [header.index(name) for name in names]
+        where_index = where_value = None
+        if where is not None:
+            where_index = header.index(where[0])
+            where_value = where[1].upper()
+        field_count = len(header)
+        if fields is None:
+            get_values = lambda values: values # pylint: disable=C3001
+        elif len(indexes) > 1:
+            get_values = operator.itemgetter(*indexes)
+        else:
+            get_values = lambda values: [values[index] for index in indexes] # pylint: disable=C3001
+        for block in blocks:
+            for values in _csv_block_rows(block):
+                count = len(values)
+                if where is not None and (where_index >= count or
+                                          values[where_index].upper() != where_value):
+                    continue
+                if count >= field_count:
+                    yield dict(zip(names, get_values(values)))
+                else:
+                    yield {name: values[index] if index < count else None
+                           for name, index in zip(names, indexes)}
+
+# OSM
+
+_NODE = re.compile(rb'<node\s[^>]*?(?:/>|>.*?</node\s*>)', re.DOTALL)
+_ATTR = re.compile(r'([^\s=/>]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+# Tags are almost always written with k before v, and without any characters
+# which need unescaping, and are found by _PLAIN_TAG.  Nodes containing any other
+# tags are read with _TAG and _ATTR.
+_PLAIN_TAG = re.compile(r'<tag\s+k\s*=\s*(?:"([^"&\t\n\r]*)"|\'([^\'&\t\n\r]*)\')'
+                        r'\s+v\s*=\s*(?:"([^"&\t\n\r]*)"|\'([^\'&\t\n\r]*)\')')
+_TAG = re.compile(r'<tag\s([^>]*)>')
+_SPECIAL = re.compile(r'[&\t\n\r]')
+_WHITESPACE = re.compile(r'[\t\n\r]')
+
+def _unescape(value):
+    """ Unescapes an attribute value, and replaces any tabs or ends of line in it
+    by spaces, as an XML parser would.
+    """
+    if _SPECIAL.search(value) is None:
+        return value
+    return html.unescape(_WHITESPACE.sub(' ', value))
+
+def _attrs(text):
+    """ Returns the attributes in the text of a start tag as a dictionary.
+    """
+    return {name: _unescape(dq or sq) for name, dq, sq in _ATTR.findall(text)}
+
+def _tags(node):
+    """ Returns a list of the (key, value) pairs of the tags in the text of a node
+    element.
+    """
+    tags = [(k_dq or k_sq, v_dq or v_sq) for k_dq, k_sq, v_dq, v_sq in _PLAIN_TAG.findall(node)]
+    if len(tags) == node.count('<tag'):
+        return tags
+    tags = []
+    for tag_text in _TAG.findall(node):
+        attrs = _attrs(tag_text)
+        if 'k' in attrs and 'v' in attrs:
+            tags.append((attrs['k'], attrs['v']))
+    return tags
+
+def _osm_stream_blocks(file_in):
+    """ A generator function that reads a binary file, yielding blocks which each
+    end just after a whole node element, or at least do not end within one.
+    """
+    rest = b''
+    for block in read_blocks(file_in):
+        block = rest + block
+        cut = block.rfind(b'<node')
+        if cut < 0:
+            # Keep what may be the beginning of '<node'
+            cut = max(0, len(block) - 4)
+        else:
+            match = _NODE.match(block, cut)
+            if match:
+                cut = match.end()
+        rest = block[cut:]
+        yield block[:cut]
+    yield rest
+
+def _block_nodes(buf, start, end, keys):
+    """ A generator function which yields a record for each node element in buf
+    beginning at or after start and before end.
+    """
+    for match in _NODE.finditer(buf, start):
+        if match.start() >= end:
+            return
+        node = match.group().decode('utf-8')
+        tag_start = node.find('>')
+        record = {'@' + name: value for name, value in _attrs(node[5:tag_start]).items()}
+        for key, value in _tags(node[tag_start:]):
+            if key not in record and (keys is None or key in keys):
+                record[key] = value
+        yield record
+
+def osm_nodes(file_name, keys=None, start=0, end=None):
+    """ A generator function which reads the nodes from a .osm file, yielding a
+    record (see addr_pipeline) for each.  Ways and relations are skipped.  If a
+    key appears more than once in a node, the first value is used.
+
+    Parameters:
+        file_name - (in) The .osm file, in UTF-8, which may be compressed.
+        keys - (in) The tags to include in each record, or None for all.  The
+            attributes of the node (@id, @lat, @lon, ...) are always included.
+        start, end - (in) The byte range of the file from which to read nodes, see
+            chunks().  By default the whole file is read.  As '<' cannot appear
+            unescaped within an attribute value, any '<node' found is the start
+            of a node.
+    """
+    _check_whole_file(file_name, start, end)
+    if keys is not None:
+        keys = set(keys)
+    if compression(file_name):
+        with open_file(file_name, 'rb') as file_in:
+            for block in _osm_stream_blocks(file_in):
+                yield from _block_nodes(block, 0, len(block), keys)
+        return
+    with mapped(file_name) as buf:
+        yield from _block_nodes(buf, start, len(buf) if end is None else end, keys)
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_io module.
+
+Usage:
+$ python3 addr_io_test.py
+
+"""
+from xml.etree import ElementTree
+import csv
+import importlib.util
+import os
+import tempfile
+import unittest
+import addr_io
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CASTLE_PINES_OSM = os.path.join(REPO_DIR, 'Castle_Pines_Addr_Update_2024_02_21',
+                                'CastlePines.osm')
+
+CSV_TEXT = ('ID,NAME,CITY\r\n'
+            '1,"Smith, John",Staunton\r\n'
+            '2,"two\r\nlines ""quoted""",WAYNESBORO\r\n'
+            '\r\n'
+            '3,short\r\n'
+            '4,Café,Staunton\r\n')
+
+class CsvTestCase(unittest.TestCase):
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='',
+                                         encoding='utf-8') as csv_out:
+            csv_out.write(CSV_TEXT)
+            self.file_name = csv_out.name
+
+    def tearDown(self):
+        os.remove(self.file_name)
+
+    def test_same_as_dict_reader(self):
+        with open(self.file_name, newline='', encoding='utf-8') as csvfile:
+            expected = list(csv.DictReader(csvfile))
+        self.assertEqual(list(addr_io.csv_records(self.file_name)), expected)
+
+    def test_long_row(self):
+        with open(self.file_name, 'a', newline='', encoding='utf-8') as csv_out:
+            csv_out.write('5,long,Staunton,extra,values\r\n')
+        with open(self.file_name, newline='', encoding='utf-8') as csvfile:
+            expected = list(csv.DictReader(csvfile))
+        # The values beyond the last field are dropped, rather than kept under None
+        self.assertEqual(expected[-1].pop(None), ['extra', 'values'])
+        self.assertEqual(list(addr_io.csv_records(self.file_name)), expected)
+
+    def test_fields_and_where(self):
+        self.assertEqual(list(addr_io.csv_records(self.file_name, fields=['ID', 'CITY'],
+                                                  where=('CITY', 'staunton'))),
+                         [{'ID': '1', 'CITY': 'Staunton'}, {'ID': '4', 'CITY': 'Staunton'}])
+
+    def test_chunks(self):
+        expected = list(addr_io.csv_records(self.file_name))
+        for count in range(1, len(CSV_TEXT)):
+            rows = []
+            for start, end in addr_io.chunks(self.file_name, count):
+                rows += addr_io.csv_records(self.file_name, start=start, end=end)
+            self.assertEqual(rows, expected, f'{count} chunks')
+
+COMPRESSIONS = ['.gz', '.bz2', '.xz'] + (['.zst'] if importlib.util.find_spec('zstandard')
+                                          else [])
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.block_size = addr_io.BLOCK_SIZE
+        # Small blocks, so that records and nodes are split between blocks
+        addr_io.BLOCK_SIZE = 37
+        self.work_dir = tempfile.TemporaryDirectory() # pylint: disable=R1732
+
+    def tearDown(self):
+        addr_io.BLOCK_SIZE = self.block_size
+        self.work_dir.cleanup()
+
+    def write(self, file_name, text):
+        file_name = os.path.join(self.work_dir.name, file_name)
+        with addr_io.open_file(file_name, 'w', newline='') as file_out:
+            file_out.write(text)
+        return file_name
+
+    def test_csv(self):
+        expected = list(addr_io.csv_records(self.write('plain.csv', CSV_TEXT)))
+        for extension in COMPRESSIONS:
+            file_name = self.write('test.csv' + extension, CSV_TEXT)
+            self.assertEqual(list(addr_io.csv_records(file_name)), expected, extension)
+            with self.assertRaises(ValueError):
+                list(addr_io.csv_records(file_name, start=10))
+
+    def test_osm(self):
+        with open(CASTLE_PINES_OSM, encoding='utf-8') as osm_in:
+            text = osm_in.read()
+        expected = list(addr_io.osm_nodes(CASTLE_PINES_OSM))
+        for extension in COMPRESSIONS:
+            file_name = self.write('test.osm' + extension, text)
+            self.assertEqual(list(addr_io.osm_nodes(file_name)), expected, extension)
+
+class OsmTestCase(unittest.TestCase):
+    def test_same_as_element_tree(self):
+        expected = []
+        for elem in ElementTree.parse(CASTLE_PINES_OSM).getroot().iter('node'):
+            record = {'@' + k: v for k, v in elem.attrib.items()}
+            for tag in elem.iter('tag'):
+                record.setdefault(tag.attrib['k'], tag.attrib['v'])
+            expected.append(record)
+        self.assertEqual(list(addr_io.osm_nodes(CASTLE_PINES_OSM)), expected)
+        nodes = []
+        for start, end in addr_io.chunks(CASTLE_PINES_OSM, 7):
+            nodes += addr_io.osm_nodes(CASTLE_PINES_OSM, start=start, end=end)
+        self.assertEqual(nodes, expected)
+
+    def test_keys_and_escapes(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.osm', delete=False,
+                                         encoding='utf-8') as osm_out:
+            osm_out.write("<?xml version='1.0' encoding='UTF-8'?>\n<osm version='0.6'>\n"
+                          "<node id='-1' lat='1' lon='2' />\n"
+                          '<node id="-2" lat="3" lon="4">\n'
+                          '  <tag k="name" v="A &amp; B &#10;&lt;&quot;" />\n'
+                          '  <tag k="addr:street" v="Main\tStreet"/>\n'
+                          '  <tag k="addr:street" v="Other Street"/>\n'
+                          '</node>\n<way id="5"><nd ref="-1"/></way>\n</osm>\n')
+            file_name = osm_out.name
+        try:
+            self.assertEqual(list(addr_io.osm_nodes(file_name)),
+                             [{'@id': '-1', '@lat': '1', '@lon': '2'},
+                              {'@id': '-2', '@lat': '3', '@lon': '4',
+                               'name': 'A & B \n<"', 'addr:street': 'Main Street'}])
+            self.assertEqual(list(addr_io.osm_nodes(file_name, keys=['addr:street']))[1],
+                             {'@id': '-2', '@lat': '3', '@lon': '4',
+                              'addr:street': 'Main Street'})
+        finally:
+            os.remove(file_name)
+
+class DataFileTestCase(unittest.TestCase):
+    def test_data_file(self):
+        saved_env = os.environ.pop(addr_io.DATA_ENV, None)
+        try:
+            with tempfile.TemporaryDirectory() as work_dir, \
+                    tempfile.TemporaryDirectory() as data_dir:
+                # Beside the programs
+                self.assertEqual(addr_io.data_file(addr_io.CONF_FILE, work_dir),
+                                 os.path.join(addr_io.PROGRAM_DIR, addr_io.CONF_FILE))
+                self.assertEqual(addr_io.data_file('missing.csv', work_dir),
+                                 os.path.join(work_dir, 'missing.csv'))
+                for directory in (data_dir, work_dir):
+                    with open(os.path.join(directory, addr_io.CONF_FILE), 'w',
+                              encoding='utf-8') as conf_out:
+                        conf_out.write(f'directory: {directory}\n')
+                    os.environ[addr_io.DATA_ENV] = data_dir
+                    # That in the directory first, then that in $OSM_ADDR_DATA
+                    self.assertEqual(addr_io.data_file(addr_io.CONF_FILE, work_dir),
+                                     os.path.join(directory, addr_io.CONF_FILE))
+                    self.assertEqual(addr_io.read_conf(work_dir), {'directory': directory})
+        finally:
+            os.environ.pop(addr_io.DATA_ENV, None)
+            if saved_env is not None:
+                os.environ[addr_io.DATA_ENV] = saved_env
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,942 @@
+#!/usr/bin/python3
+""" addr_pipeline - Composable stages for reading, transforming and writing
+address records.
+
+The programs are built from the following kinds of stages, which pass records
+to each other in batches (lists) of records:
+
+* Sources - generator functions which read a file and yield batches of records,
+  e.g. csv_source(), fgdb_source(), osm_source() and geojson_source().
+* Stages - generator functions which take an iterable of batches and yield
+  batches, e.g. the normalizers (addr_prep.va_normalize(),
+  co_addr_prep.co_normalize()), field_filter() and existing_filter().
+* Sinks - objects with write(batch) and close() methods which write the records
+  somewhere, e.g. CsvSink, OsmSink, GeoJsonSink, the columnar GeoParquetSink
+  and FlatGeobufSink, and StreetSplitSink (and addr_qc.QcSink which checks
+  them).  drain() feeds batches to one or more sinks.
+
+A record is a dictionary, or for normalized addresses an addr_record.AddrRecord
+which behaves as one while using much less memory.  The keys are either OSM
+tags (e.g. 'addr:street'), or for records that have not been normalized yet,
+the field names of the input file (e.g. 'STREET_NAME').  The keys starting with '@' are not tags:
+'@lat' and '@lon' hold the location, '@id' the OSM id, and the other '@' keys
+any other attributes of an OSM node (e.g. '@action').
+
+As the stages are generators, the whole chain runs as a single pass over the
+input.  With the --threads option, reading (e.g. csv parsing or OGR decoding)
+and writing each run in their own thread, with bounded queues of batches
+between them and the normalizer, see threaded() and ThreadedSink.  The queues
+limit the memory used when one stage is faster than another.
+
+Running this module allows the Virginia workflow (addr_split ->
+addr_prep -> addr_qc) or the Colorado workflow (co_addr_prep -> addr_qc ->
+split_osm_addr_by_street) to be run as a single pass, without writing and
+re-reading intermediate files.
+
+Usage:
+$ python3 addr_pipeline.py va statewide.csv --county "Augusta County" --raw augusta_raw.csv \\
+    --output augusta_prep.csv --qc
+$ python3 addr_pipeline.py co /path/to/fgdb/layer --city "Castle Pines" \\
+    --existing existing.osm --output castle_pines.osm --split-street out_dir
+"""
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import os
+import queue
+import struct
+import threading
+import addr_diag
+import addr_io
+import addr_record
+import addr_spatial
+import addr_stats
+from addr_stats import STATS
+
+BATCH_SIZE = 1000
+# The maximum number of batches waiting in the queue between two threads.
+QUEUE_BATCHES = 8
+
+def batched(iterable, batch_size=BATCH_SIZE, stage='read'):
+    """ Groups the records produced by iterable into batches (lists) of up to
+    batch_size records.  The time taken to produce the records is added to the
+    given stage.
+    """
+    iterator = iter(iterable)
+    while True:
+        with STATS.timer(stage):
+            batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        STATS.add_rows(stage, len(batch))
+        yield batch
+
+# Sources
+
+def csv_field_names(file_name):
+    """ Returns the list of field names from the header of a .csv file.
+    """
+    with addr_io.open_file(file_name, newline='') as csvfile:
+        return next(csv.reader(csvfile), [])
+
+def csv_source(file_name, batch_size=BATCH_SIZE, fields=None, where=None):
+    """ Reads a .csv file, such as the Virginia address file, yielding batches of
+    records with the field names as keys.  Only the given fields (by default all)
+    are read, and if where is a (field, value) pair, only the rows in which the
+    field matches the value, ignoring case.  See addr_io.csv_records().
+    """
+    # Closed explicitly, so that the file is released as soon as this is
+    with contextlib.closing(addr_io.csv_records(file_name, fields, where)) as records:
+        yield from batched(records, batch_size)
+
+def fgdb_source(fgdb_and_layer, fields, raw_fields=(), batch_size=BATCH_SIZE):
+    """ Reads a layer of point features from a file geodatabase, yielding batches
+    of records.
+
+    Parameters:
+        fgdb_and_layer - (in) Path to the file geodatabase including the layer,
+            e.g. /path/to/fgdb/layer
+        fields - (in) The fields to read.  Leading and trailing whitespace is
+            removed from the values, and null values are converted to ''.
+        raw_fields - (in) Fields whose values are read as is, other than null
+            values which are converted to ''.
+        batch_size - (in) The maximum number of records in each batch.
+
+    The feature id is placed in '@fid', and the location in '@lat' and '@lon'.
+    """
+    # pylint: disable=C0415
+    import pathlib
+    from osgeo import ogr
+    driver = ogr.GetDriverByName("OpenFileGDB")
+    path = pathlib.PurePath(fgdb_and_layer)
+    data_source = driver.Open(str(path.parents[0]), 0)
+    layer = data_source.GetLayer(str(path.name))
+    def records():
+        for feature in layer:
+            point = feature.GetGeometryRef().GetPoint(0)
+            record = {'@fid': feature.GetFID(), '@lat': point[1], '@lon': point[0]}
+            for field in raw_fields:
+                record[field] = feature.GetField(field) or ''
+            for field in fields:
+                value = feature.GetField(field)
+                record[field] = value.strip() if value else ''
+            yield record
+    yield from batched(records(), batch_size)
+
+def osm_source(file_name, batch_size=BATCH_SIZE, keys=None):
+    """ Reads the nodes from a .osm file, yielding batches of records.  Ways and
+    relations are skipped.  Only the given tags (by default all) are read.  If a
+    key appears more than once in a node, the first value is used.  See
+    addr_io.osm_nodes().
+    """
+    with contextlib.closing(addr_io.osm_nodes(file_name, keys)) as nodes:
+        yield from batched(nodes, batch_size)
+
+def geojson_collections(file_name):
+    """ A generator function that yields the FeatureCollections in a GeoJSON file.
+    Both plain GeoJSON files, and GeoJSON text sequences (RFC 7464, as used for
+    MapRoulette line by line challenges) in which each line holds a
+    FeatureCollection preceded by a record separator character, are handled.
+    """
+    with addr_io.open_file(file_name) as json_in:
+        first = json_in.read(1)
+        if first != '\x1e':
+            yield json.loads(first + json_in.read())
+            return
+        for line in itertools.chain([first + json_in.readline()], json_in):
+            line = line.strip('\x1e \t\r\n')
+            if line:
+                yield json.loads(line)
+
+def geojson_source(file_name, batch_size=BATCH_SIZE):
+    """ Reads the point features from a GeoJSON file (such as those used to create
+    MapRoulette challenges), yielding batches of records.  The properties become
+    the tags, and an '@id' property of the form 'node/-1' becomes the id.
+    """
+    def records():
+        for collection in geojson_collections(file_name):
+            for feature in collection['features']:
+                geometry = feature.get('geometry') or {}
+                if geometry.get('type') != 'Point':
+                    continue
+                record = {}
+                for key, value in (feature.get('properties') or {}).items():
+                    if key == '@id':
+                        record['@id'] = str(value).rsplit('/', 1)[-1]
+                    elif value is not None:
+                        record[key] = str(value)
+                record['@lon'], record['@lat'] = geometry['coordinates'][:2]
+                yield record
+    yield from batched(records(), batch_size)
+
+# Stages
+
+def field_filter(batches, field, value):
+    """ Passes on only those records where the given field matches the given
+    value, ignoring case.
+    """
+    value = value.upper()
+    for batch in batches:
+        with STATS.timer('filter', len(batch)):
+            batch = [record for record in batch if (record.get(field) or '').upper() == value]
+        if batch:
+            yield batch
+
+def existing_addrs_key(record):
+    """ Returns the key of a record in the set of existing addresses returned by
+    co_addr_prep.get_existing_addrs()
+    """
+    return (record.get('addr:city', ''), record.get('addr:street', ''),
+            record.get('addr:housenumber', ''), record.get('addr:unit', ''))
+
+def existing_filter(batches, existing_addrs, key=existing_addrs_key):
+    """ Drops those records whose address is in existing_addrs (the addresses
+    already in OSM), key being the function returning the key of a record in
+    existing_addrs (see addr_streets.existing_matcher()).
+    """
+    for batch in batches:
+        with STATS.timer('dedupe', len(batch)):
+            count = len(batch)
+            batch = [record for record in batch
+                     if key(record) not in existing_addrs]
+            STATS.count('already in OSM', count - len(batch))
+        if batch:
+            yield batch
+
+def spatial_sort(batches, curve, batch_size=BATCH_SIZE):
+    """ Sorts the records along the named curve ('hilbert' or 'zorder', see
+    addr_spatial), so that neighbouring addresses are written next to each
+    other.  As all of the records must be read before the first is known,
+    they are held in memory.  With no curve, the batches are passed on as is.
+    """
+    if not curve:
+        yield from batches
+        return
+    records = [record for batch in batches for record in batch]
+    with STATS.timer('sort', len(records)):
+        records = addr_spatial.sort_records(records, curve)
+    for start in range(0, len(records), batch_size):
+        yield records[start:start + batch_size]
+
+def assign_ids(batches, first_id=-1):
+    """ Gives each record without an '@id' a new (negative) OSM id, so that all
+    of the sinks the records are written to agree on the ids.
+    """
+    node_id = first_id
+    for batch in batches:
+        for record in batch:
+            if '@id' not in record:
+                record['@id'] = str(node_id)
+                node_id -= 1
+        yield batch
+
+def tap(batches, *sinks):
+    """ Writes each batch to the given sinks, and also passes it on to the next
+    stage.
+    """
+    for batch in batches:
+        write_batch(batch, sinks)
+        yield batch
+
+class _Failure():
+    """ Passes an exception raised in one thread to the thread consuming its output.
+    """
+    def __init__(self, exception):
+        self.exception = exception
+
+_END = object()
+
+def _put(batch_queue, item, stop):
+    """ Puts item on the queue, waiting while the queue is full, unless stop is set.
+    Returns False if stop was set before the item could be put on the queue.
+    """
+    while not stop.is_set():
+        try:
+            batch_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def threaded(batches, queue_batches=QUEUE_BATCHES, stage='read'):
+    """ Runs the stages producing batches (typically a source) in a separate
+    thread, and yields the batches they produce.  At most queue_batches batches
+    are held in the queue between the threads, after which the producing thread
+    waits.  The time spent waiting for the producing thread is added to the stage
+    'wait for <stage>'.  An exception raised in the producing thread is re-raised
+    in the consuming thread.
+    """
+    batch_queue = queue.Queue(queue_batches)
+    stop = threading.Event()
+    def produce():
+        try:
+            for batch in batches:
+                if not _put(batch_queue, batch, stop):
+                    return
+            _put(batch_queue, _END, stop)
+        except BaseException as ex: # pylint: disable=W0718
+            _put(batch_queue, _Failure(ex), stop)
+    thread = threading.Thread(target=produce, name=stage, daemon=True)
+    thread.start()
+    try:
+        while True:
+            with STATS.timer('wait for ' + stage):
+                item = batch_queue.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def read_ahead(batches, threads):
+    """ Returns batches run in their own thread (see threaded()) if threads is True,
+    otherwise returns batches unchanged.
+    """
+    return threaded(batches) if threads else batches
+
+# Sinks
+
+class Sink():
+    """ Base class of the sinks.  A sink can be used as a context manager, in which
+    case it is closed at the end of the with statement.
+    """
+    stage = 'write'
+
+    def write(self, batch):
+        """ Writes a batch of records """
+        raise NotImplementedError
+
+    def close(self):
+        """ Finishes writing """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class CsvSink(Sink):
+    """ Writes records to a .csv file.
+
+    Parameters:
+        file_name - (in) The file to write.
+        field_names - (in) The columns of the file.
+        key_map - (in) Optional dictionary mapping column names to the record key
+            whose value is written in that column, e.g. {'latitude': '@lat'}.
+            Columns not in key_map are written from the key of the same name.
+    """
+    def __init__(self, file_name, field_names, key_map=None):
+        self.csvfile = addr_io.open_file(file_name, 'w', newline='')
+        self.columns = [(name, (key_map or {}).get(name, name)) for name in field_names]
+        self.writer = csv.writer(self.csvfile)
+        self.writer.writerow(field_names)
+
+    def write(self, batch):
+        columns = self.columns
+        self.writer.writerows([['' if record.get(key) is None else record.get(key)
+                                for _, key in columns] for record in batch])
+
+    def close(self):
+        self.csvfile.close()
+
+def escape(text):
+    """ Returns text with &, <, > and " escaped, for an XML attribute value, as
+    xml.sax.saxutils.escape(text, {'"': '&quot;'}) does.  xml.sax.saxutils is
+    not used as it imports urllib, which is slow to import.
+    """
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace(
+        '"', '&quot;')
+
+def format_node(record):
+    """ Returns a record as an OSM node in .osm (xml) format.  New nodes (those
+    without an '@action' attribute) are marked action="modify" so that JOSM will
+    upload them.  Tags with empty values are omitted.
+    """
+    attrs = {'id': record['@id']}
+    if '@action' not in record and not record['@id'].isdigit():
+        attrs['action'] = 'modify'
+        attrs['visible'] = 'true'
+    tags = []
+    for key, value in record.items():
+        if key[0:1] == '@':
+            if key != '@fid':
+                attrs[key[1:]] = value
+        elif value is not None and value != '':
+            tags.append(f'        <tag k="{escape(key)}" '
+                        f'v="{escape(str(value))}" />\n')
+    attrs_str = ' '.join(f'{k}="{escape(str(v))}"' for k, v in attrs.items())
+    return f'    <node {attrs_str}>\n' + ''.join(tags) + '    </node>\n'
+
+OSM_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="JOSM">\n'
+# The files written by StreetSplitSink are used to create MapRoulette tasks, so
+# JOSM is told not to upload or download them.
+SPLIT_OSM_HEADER = ("<?xml version='1.0' encoding='UTF-8'?>\n"
+                    "<osm version='0.6' upload='never' download='never' generator='JOSM'>\n")
+OSM_FOOTER = '</osm>\n'
+
+class OsmSink(Sink):
+    """ Writes records as nodes to a .osm file.  Records without an '@id' are
+    given new (negative) ids.
+    """
+    def __init__(self, file_name):
+        self.osm_file = addr_io.open_file(file_name, 'w')
+        self.osm_file.write(OSM_HEADER)
+        self.node_id = -1
+
+    def write(self, batch):
+        for record in batch:
+            if '@id' not in record:
+                record['@id'] = str(self.node_id)
+                self.node_id -= 1
+        self.osm_file.write(''.join(format_node(record) for record in batch))
+
+    def close(self):
+        self.osm_file.write(OSM_FOOTER)
+        self.osm_file.close()
+
+class GeoJsonSink(Sink):
+    """ Writes records as point features to a GeoJSON file, in the form used to
+    create MapRoulette challenges.
+    """
+    def __init__(self, file_name):
+        self.json_file = addr_io.open_file(file_name, 'w')
+        self.json_file.write('{"type":"FeatureCollection","features":[')
+        self.first = True
+        self.node_id = -1
+
+    def write(self, batch):
+        features = []
+        for record in batch:
+            properties = {k: v for k, v in record.items()
+                          if k[0:1] != '@' and v is not None and v != ''}
+            node_id = record.get('@id')
+            if node_id is None:
+                node_id = self.node_id
+                self.node_id -= 1
+            properties['@id'] = f'node/{node_id}'
+            features.append(json.dumps(
+                {'type': 'Feature', 'properties': properties,
+                 'geometry': {'type': 'Point',
+                              'coordinates': [float(record['@lon']), float(record['@lat'])]}},
+                separators=(',', ':')))
+        if features:
+            if not self.first:
+                self.json_file.write(',')
+            self.json_file.write(','.join(features))
+            self.first = False
+
+    def close(self):
+        self.json_file.write(']}\n')
+        self.json_file.close()
+
+# The tags written by the columnar sinks, in column order
+ADDRESS_TAGS = [key for key in addr_record.KEY_SLOTS if key[0] != '@']
+# The default maximum number of addresses in each file written by TileSplitSink
+MAX_TILE_ADDRESSES = 500
+# The number of records in each row group of a GeoParquet file
+ROW_GROUP_SIZE = 64 * 1024
+
+class GeoParquetSink(Sink):
+    """ Writes records to a GeoParquet file (see https://geoparquet.org), for the
+    later stages to read only the columns and row groups that they need.
+
+    Parameters:
+        file_name - (in) The file to write.
+        tags - (in) The tags written, one column each.  By default ADDRESS_TAGS.
+        source - (in) The name of the input, written in the source column of
+            each row for provenance.
+
+    Besides the tags there are lat and lon columns, osm_id (the '@id'),
+    source_id (the feature id '@fid' in the source), a WKB point geometry
+    column, and a bbox column which GeoParquet readers use as a covering to
+    skip the row groups outside of the area they want.  The records are
+    written in row groups of ROW_GROUP_SIZE, so only one row group is held in
+    memory.  Requires pyarrow.
+    """
+    def __init__(self, file_name, tags=None, source=None):
+        # pylint: disable=C0415
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.tags = list(tags or ADDRESS_TAGS)
+        self.source = source
+        self.rows = []
+        self.bounds = [180.0, 90.0, -180.0, -90.0]
+        string = pyarrow.string()
+        self.schema = pyarrow.schema(
+            [(tag, string) for tag in self.tags] +
+            [('lat', pyarrow.float64()), ('lon', pyarrow.float64()), ('osm_id', string),
+             ('source', string), ('source_id', string), ('geometry', pyarrow.binary()),
+             ('bbox', pyarrow.struct([(name, pyarrow.float64())
+                                      for name in ('xmin', 'ymin', 'xmax', 'ymax')]))])
+        self.file_name = file_name
+        self.writer = pyarrow.parquet.ParquetWriter(file_name, self.schema, compression='zstd')
+
+    def write(self, batch):
+        for record in batch:
+            lat = float(record['@lat'])
+            lon = float(record['@lon'])
+            source_id = record.get('@fid')
+            self.rows.append([record.get(tag) for tag in self.tags] + [
+                lat, lon, record.get('@id'), self.source,
+                None if source_id is None else str(source_id),
+                struct.pack('<BIdd', 1, 1, lon, lat),
+                {'xmin': lon, 'ymin': lat, 'xmax': lon, 'ymax': lat}])
+            bounds = self.bounds
+            bounds[:] = [min(bounds[0], lon), min(bounds[1], lat),
+                         max(bounds[2], lon), max(bounds[3], lat)]
+        while len(self.rows) >= ROW_GROUP_SIZE:
+            self.write_row_group(self.rows[:ROW_GROUP_SIZE])
+            del self.rows[:ROW_GROUP_SIZE]
+
+    def write_row_group(self, rows):
+        """ Writes the rows (lists of column values) as one row group """
+        columns = [self.pyarrow.array(values, field.type)
+                   for values, field in zip(zip(*rows), self.schema)]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(columns, schema=self.schema),
+                                row_group_size=len(rows))
+
+    def geo_metadata(self):
+        """ Returns the GeoParquet 'geo' metadata of the file """
+        bbox = self.bounds if self.bounds[0] <= self.bounds[2] else []
+        return json.dumps({
+            'version': '1.1.0', 'primary_column': 'geometry',
+            'columns': {'geometry': {
+                'encoding': 'WKB', 'geometry_types': ['Point'], 'bbox': bbox,
+                'covering': {'bbox': {name: ['bbox', name]
+                                      for name in ('xmin', 'ymin', 'xmax', 'ymax')}}}}})
+
+    def close(self):
+        if self.rows:
+            self.write_row_group(self.rows)
+            self.rows = []
+        # The bbox of the whole file is only known at the end, so the metadata
+        # is added to the footer when the file is closed.
+        self.writer.add_key_value_metadata({'geo': self.geo_metadata()})
+        self.writer.close()
+
+class FlatGeobufSink(Sink):
+    """ Writes records to a FlatGeobuf file with a packed Hilbert R-tree spatial
+    index, so that readers can fetch the addresses of an area without reading
+    the whole file.
+
+    Parameters:
+        file_name - (in) The file to write.
+        tags - (in) The tags written, one field each.  By default ADDRESS_TAGS.
+        source - (in) The name of the input, written in the source field of each
+            feature for provenance.
+
+    The fields are as for GeoParquetSink, other than the location which is only
+    in the geometry.  Requires the GDAL python bindings (osgeo), as fgdb_source().
+    """
+    def __init__(self, file_name, tags=None, source=None):
+        # pylint: disable=C0415
+        from osgeo import ogr, osr
+        self.ogr = ogr
+        self.tags = list(tags or ADDRESS_TAGS)
+        self.source = source
+        spatial_ref = osr.SpatialReference()
+        spatial_ref.ImportFromEPSG(4326)
+        spatial_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        driver = ogr.GetDriverByName('FlatGeobuf')
+        self.data_source = driver.CreateDataSource(file_name)
+        self.layer = self.data_source.CreateLayer('addresses', spatial_ref, ogr.wkbPoint,
+                                                  options=['SPATIAL_INDEX=YES'])
+        self.field_names = self.tags + ['osm_id', 'source', 'source_id']
+        for name in self.field_names:
+            self.layer.CreateField(ogr.FieldDefn(name, ogr.OFTString))
+        self.layer_defn = self.layer.GetLayerDefn()
+
+    def write(self, batch):
+        ogr = self.ogr
+        for record in batch:
+            feature = ogr.Feature(self.layer_defn)
+            for index, tag in enumerate(self.tags):
+                value = record.get(tag)
+                if value is not None:
+                    feature.SetField(index, str(value))
+            values = (record.get('@id'), self.source, record.get('@fid'))
+            for index, value in enumerate(values, len(self.tags)):
+                if value is not None:
+                    feature.SetField(index, str(value))
+            point = ogr.Geometry(ogr.wkbPoint)
+            point.AddPoint_2D(float(record['@lon']), float(record['@lat']))
+            feature.SetGeometry(point)
+            self.layer.CreateFeature(feature)
+
+    def close(self):
+        # The spatial index is built when the data source is released
+        self.layer = None
+        self.data_source = None
+
+def street_file_name(record):
+    """ Returns the name (without extension) of the file to which StreetSplitSink
+    writes a record, made from its city and street.
+    """
+    city = (record.get('addr:city') or '').strip().replace(' ', '_') or 'NoCity'
+    street = (record.get('addr:street') or '').strip().replace(' ', '_') or 'NoStreet'
+    return city + '__' + street
+
+def write_split_file(file_name, records):
+    """ Writes the records to a .osm file of the kind written by StreetSplitSink
+    and TileSplitSink, which JOSM will not upload.
+    """
+    with open(file_name, 'w', encoding='utf-8') as file_handle:
+        file_handle.write(SPLIT_OSM_HEADER)
+        file_handle.write(''.join(format_node(record) for record in records))
+        file_handle.write(OSM_FOOTER)
+
+class StreetSplitSink(Sink):
+    """ Writes records to separate .osm files in out_dir, one for each city and
+    street.
+
+    Parameters:
+        out_dir - (in) The directory in which to write the files.
+        max_size - (in) Optional maximum number of addresses in a file.  The
+            addresses of a street with more than this are cut into spatially
+            compact tiles (see addr_spatial.tiles()), written to files numbered
+            from 1, e.g. City__Street__2.osm.
+        curve - (in) Optional curve ('hilbert' or 'zorder') along which the
+            addresses of each file are sorted, see addr_spatial.
+
+    With max_size or curve, the records are held in memory until the sink is
+    closed, otherwise each is written as it arrives.
+    """
+    def __init__(self, out_dir, max_size=None, curve=None):
+        self.out_dir = out_dir
+        self.out = {}
+        self.node_id = -1
+        self.max_size = max_size
+        self.curve = curve
+        self.streets = {} if max_size or curve else None
+
+    def assign_ids(self, records):
+        """ Gives each record without an '@id' a new (negative) OSM id """
+        for record in records:
+            if '@id' not in record:
+                record['@id'] = str(self.node_id)
+                self.node_id -= 1
+
+    def write(self, batch):
+        self.assign_ids(batch)
+        for record in batch:
+            if self.streets is not None:
+                self.streets.setdefault(street_file_name(record), []).append(record)
+                continue
+            file_name = os.path.join(self.out_dir, street_file_name(record) + '.osm')
+            file_handle = self.out.get(file_name)
+            if file_handle is None:
+                file_handle = open(file_name, 'w', encoding='utf-8') # pylint: disable=R1732
+                file_handle.write(SPLIT_OSM_HEADER)
+                self.out[file_name] = file_handle
+            file_handle.write(format_node(record))
+
+    def write_street(self, base_name, records):
+        """ Writes all of the records of a street, whose file name without
+        extension is base_name, cutting them into tiles if there are more than
+        max_size.  Returns the number of files written.
+        """
+        self.assign_ids(records)
+        curve = self.curve or 'hilbert'
+        if self.max_size and len(records) > self.max_size:
+            parts = addr_spatial.tiles(records, self.max_size, curve)
+            for number, part in enumerate(parts, 1):
+                write_split_file(os.path.join(self.out_dir, f'{base_name}__{number}.osm'), part)
+            return len(parts)
+        if self.curve:
+            records = addr_spatial.sort_records(records, curve)
+        write_split_file(os.path.join(self.out_dir, base_name + '.osm'), records)
+        return 1
+
+    def close(self):
+        for file_handle in self.out.values():
+            file_handle.write(OSM_FOOTER)
+            file_handle.close()
+        files = len(self.out)
+        for base_name, records in (self.streets or {}).items():
+            files += self.write_street(base_name, records)
+        STATS.count('files written', files)
+
+class TileSplitSink(Sink):
+    """ Writes records to separate .osm files in out_dir, one for each tile of at
+    most max_size addresses, regardless of street.  The tiles are cells of a
+    quadtree, see addr_spatial.tiles(), and are numbered along the curve
+    ('hilbert' or 'zorder'), e.g. tile_0001.osm, so that consecutive files
+    cover neighbouring areas.  The records are held in memory until the sink
+    is closed.
+    """
+    def __init__(self, out_dir, max_size, curve='hilbert'):
+        self.out_dir = out_dir
+        self.max_size = max_size
+        self.curve = curve
+        self.records = []
+        self.node_id = -1
+
+    def write(self, batch):
+        for record in batch:
+            if '@id' not in record:
+                record['@id'] = str(self.node_id)
+                self.node_id -= 1
+        self.records.extend(batch)
+
+    def close(self):
+        with STATS.timer('tile', len(self.records)):
+            parts = addr_spatial.tiles(self.records, self.max_size, self.curve)
+        width = max(4, len(str(len(parts))))
+        for number, part in enumerate(parts, 1):
+            write_split_file(os.path.join(self.out_dir, f'tile_{number:0{width}}.osm'), part)
+        STATS.count('files written', len(parts))
+        self.records = []
+
+class ThreadedSink(Sink):
+    """ Wraps another sink so that its writing is done in a separate thread.  At
+    most queue_batches batches are held in the queue for the writing thread,
+    after which write() waits.  The time spent waiting is added to the stage
+    'queue <stage>'.  An exception raised while writing is re-raised by the next
+    call to write() or close().
+    """
+    def __init__(self, sink, queue_batches=QUEUE_BATCHES):
+        self.sink = sink
+        self.stage = 'queue ' + sink.stage
+        self.batch_queue = queue.Queue(queue_batches)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_batches, name=sink.stage, daemon=True)
+        self.thread.start()
+
+    def _write_batches(self):
+        """ Writes the batches from the queue, in the writing thread.
+        """
+        while True:
+            batch = self.batch_queue.get()
+            if batch is _END:
+                return
+            if self.error is None:
+                try:
+                    with STATS.timer(self.sink.stage, len(batch)):
+                        self.sink.write(batch)
+                except BaseException as ex: # pylint: disable=W0718
+                    self.error = ex
+
+    def write(self, batch):
+        if self.error is not None:
+            raise self.error
+        self.batch_queue.put(batch)
+
+    def close(self):
+        self.batch_queue.put(_END)
+        self.thread.join()
+        self.sink.close()
+        if self.error is not None:
+            raise self.error
+
+def write_behind(sink, threads):
+    """ Returns the sink wrapped in a ThreadedSink if threads is True, otherwise
+    returns the sink unchanged.
+    """
+    return ThreadedSink(sink) if threads else sink
+
+def open_sink(file_name, field_names=None, key_map=None, source=None):
+    """ Returns a sink for the given file, chosen by its extension: .osm for an
+    OsmSink, .geojson or .json for a GeoJsonSink, .parquet or .geoparquet for a
+    GeoParquetSink, .fgb for a FlatGeobufSink, .sqlite (or .sqlite3 or .db) for
+    the addresses layer of an addr_store.StoreSink (all with the given source),
+    otherwise a CsvSink with the given field names and key_map (by default
+    ADDRESS_TAGS and the location).  Other than for the stores and the columnar
+    formats, which are compressed internally, the extension may be followed by
+    a compression extension, e.g. .osm.gz, see addr_io.open_file().
+    """
+    # pylint: disable=C0415
+    import addr_store
+    if addr_store.is_store(file_name):
+        return addr_store.StoreSink(file_name, addr_store.ADDRESS_LAYER, source)
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension in ('.parquet', '.geoparquet'):
+        return GeoParquetSink(file_name, source=source)
+    if extension == '.fgb':
+        return FlatGeobufSink(file_name, source=source)
+    extension = os.path.splitext(addr_io.strip_compression(file_name))[1].lower()
+    if extension == '.osm':
+        return OsmSink(file_name)
+    if extension in ('.geojson', '.json'):
+        return GeoJsonSink(file_name)
+    if field_names is None:
+        field_names = ADDRESS_TAGS + ['latitude', 'longitude']
+        key_map = {'latitude': '@lat', 'longitude': '@lon'}
+    return CsvSink(file_name, field_names, key_map)
+
+def write_batch(batch, sinks):
+    """ Writes a batch to each of the sinks, timing each.
+    """
+    for sink in sinks:
+        with STATS.timer(sink.stage, len(batch)):
+            sink.write(batch)
+
+def drain(batches, *sinks):
+    """ Runs the pipeline, by writing every batch produced by batches to each of
+    the sinks.
+    """
+    for batch in batches:
+        write_batch(batch, sinks)
+
+def add_order_args(parser):
+    """ Adds the --order option, for spatial_sort(), to an argparse.ArgumentParser
+    """
+    parser.add_argument('--order', choices=sorted(addr_spatial.CURVES),
+                        help='write the addresses sorted along this space filling curve, '
+                        'so that neighbouring addresses are next to each other, rather '
+                        'than in the order of the input')
+
+def add_args(parser):
+    """ Adds the --threads option to an argparse.ArgumentParser
+    """
+    parser.add_argument('--threads', action='store_true',
+                        help='read and write in separate threads, overlapping reading, '
+                        'converting and writing')
+
+# One pass workflows
+
+def run_va(args):
+    """ Runs the Virginia workflow, addr_split -> addr_prep -> addr_qc, as a single
+    pass.
+    """
+    # pylint: disable=C0415
+    import addr_boundary
+    import addr_prep
+    import addr_qc
+    addr_prep.get_conf()
+    addr_diag.DIAG.reset(addr_prep.describe_row)
+    sinks = []
+    # The other fields are only needed to write the --raw file
+    fields = None if args.raw else addr_prep.VA_FIELDS
+    where = ('MUNICIPALITY', args.county) if args.county else None
+    batches = read_ahead(csv_source(args.input_file, fields=fields, where=where), args.threads)
+    if args.raw:
+        raw_sink = CsvSink(args.raw, csv_field_names(args.input_file) + ['latitude', 'longitude'],
+                           {'latitude': 'LAT', 'longitude': 'LONG'})
+        sinks.append(write_behind(raw_sink, args.threads))
+        batches = tap(batches, sinks[-1])
+    indexes = addr_boundary.load_indexes(args.city_boundaries, args.postcode_boundaries)
+    batches = addr_boundary.assign_jurisdictions(addr_prep.va_normalize(batches), *indexes)
+    batches = assign_ids(spatial_sort(batches, args.order))
+    run_sinks(batches, args, sinks, addr_prep.PREP_FIELDS, addr_prep.PREP_KEY_MAP, addr_qc,
+              args.input_file, indexes)
+
+def run_co(args):
+    """ Runs the Colorado workflow, co_addr_prep -> addr_qc -> split_osm_addr_by_street,
+    as a single pass.
+    """
+    # pylint: disable=C0415
+    import addr_boundary
+    import addr_qc
+    import addr_streets
+    import co_addr_prep
+    co_addr_prep.get_conf()
+    addr_diag.DIAG.reset(co_addr_prep.describe_feature)
+    city = args.city.upper() if args.city else None
+    existing_addrs = co_addr_prep.get_existing_addrs(args.existing, city)
+    batches = read_ahead(co_addr_prep.co_source(args.input_fgdb_and_layer, city), args.threads)
+    batches = co_addr_prep.co_normalize(batches)
+    # The city and postcode are filled in before the existing addresses, whose
+    # key includes the city, are filtered out, as co_addr_prep does
+    indexes = addr_boundary.load_indexes(args.city_boundaries, args.postcode_boundaries)
+    batches = addr_boundary.assign_jurisdictions(batches, *indexes)
+    if existing_addrs:
+        existing_addrs, key = addr_streets.existing_matcher(existing_addrs, args.match_streets)
+        batches = existing_filter(batches, existing_addrs, key)
+    batches = assign_ids(spatial_sort(batches, args.order))
+    run_sinks(batches, args, [], None, None, addr_qc, args.input_fgdb_and_layer, indexes)
+
+def run_sinks(batches, args, sinks, field_names, key_map, addr_qc, source, indexes):
+    """ Writes the normalized records to the sinks requested on the command line,
+    and prints the diagnostics and QC reports.  source names the input, for the
+    provenance columns of the columnar formats, and indexes are the
+    addr_boundary.BoundaryIndex of the cities and postcodes for the QC checks.
+    """
+    # pylint: disable=R0913
+    if args.output:
+        sinks.append(write_behind(open_sink(args.output, field_names, key_map, source),
+                                  args.threads))
+    if args.split_street:
+        sinks.append(write_behind(StreetSplitSink(args.split_street, args.max_addresses,
+                                                  args.order), args.threads))
+    if args.split_tiles:
+        sinks.append(write_behind(TileSplitSink(args.split_tiles, args.max_addresses,
+                                                args.order or 'hilbert'), args.threads))
+    if args.qc:
+        sinks.append(addr_qc.QcSink(addr_qc.get_zips(), bbox=args.bbox,
+                                    boundary=addr_qc.load_boundary(args.boundary),
+                                    indexes=indexes, near_streets=args.near_streets,
+                                    max_memory=args.max_memory,
+                                    house_numbers=args.house_numbers))
+    try:
+        drain(batches, *sinks)
+    finally:
+        for sink in sinks:
+            sink.close()
+    addr_diag.finish(args.diagnostics_csv)
+
+def get_args():
+    """ Gets the command line arguments.
+    """
+    # pylint: disable=C0415
+    import addr_qc
+    import addr_streets
+    parser = argparse.ArgumentParser(
+        prog='addr_pipeline',
+        description='Runs a whole address workflow as a single pass over the input.')
+    subparsers = parser.add_subparsers(dest='workflow', required=True)
+    va_parser = subparsers.add_parser('va', help='addr_split -> addr_prep -> addr_qc')
+    va_parser.add_argument('input_file', help='Virginia address file (.csv)')
+    va_parser.add_argument('--county', help='only process the addresses of this county')
+    va_parser.add_argument('--raw', help='also write the unconverted addresses of the county '
+                           'to this file, as addr_split.py does')
+    va_parser.set_defaults(func=run_va)
+    co_parser = subparsers.add_parser('co', help='co_addr_prep -> addr_qc -> '
+                                      'split_osm_addr_by_street')
+    co_parser.add_argument('input_fgdb_and_layer', help='file geodatabase containing address '
+                           'info, including the layer e.g. /path/to/fgdb/layer')
+    co_parser.add_argument('--city', help='only process addresses with the indicated city')
+    co_parser.add_argument('--existing', help='file of existing OSM addresses which are not '
+                           'to be placed in the output (.osm, possibly compressed, or .osm.pbf).')
+    addr_streets.add_args(co_parser)
+    co_parser.set_defaults(func=run_co)
+    for sub_parser in (va_parser, co_parser):
+        sub_parser.add_argument('--output', help='write the converted addresses to this file '
+                                '(.csv, .osm, .geojson, or .parquet (GeoParquet) or .fgb '
+                                '(FlatGeobuf) for columnar output)')
+        sub_parser.add_argument('--qc', action='store_true',
+                                help='perform the addr_qc checks on the converted addresses')
+        addr_qc.add_args(sub_parser)
+        sub_parser.add_argument('--split-street', metavar='OUT_DIR',
+                                help='write the converted addresses to a separate .osm file for '
+                                'each street in OUT_DIR')
+        sub_parser.add_argument('--split-tiles', metavar='OUT_DIR',
+                                help='write the converted addresses to a separate .osm file for '
+                                'each spatially compact tile of at most --max-addresses '
+                                'addresses in OUT_DIR')
+        sub_parser.add_argument('--max-addresses', type=int, metavar='N',
+                                help='the maximum number of addresses in each file written by '
+                                f'--split-street or --split-tiles (default {MAX_TILE_ADDRESSES} '
+                                'for --split-tiles), larger streets being cut into tiles')
+        add_order_args(sub_parser)
+        add_args(sub_parser)
+        addr_stats.add_args(sub_parser)
+        addr_diag.add_args(sub_parser)
+    args = parser.parse_args()
+    if args.split_tiles and not args.max_addresses:
+        args.max_addresses = MAX_TILE_ADDRESSES
+    return args
+
+def main():
+    """ Main function
+    """
+    args = get_args()
+    addr_stats.run(args.func, args, args)
+
+if __name__ == '__main__':
+    main()
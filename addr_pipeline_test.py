@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_pipeline module.
+
+Usage:
+$ python3 addr_pipeline_test.py
+
+"""
+import csv
+import importlib.util
+import os
+import tempfile
+import unittest
+import addr_pipeline
+import addr_record
+
+class ListSink(addr_pipeline.Sink):
+    """ A sink which keeps the batches written to it """
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.closed = False
+        self.fail_on = fail_on
+
+    def write(self, batch):
+        if batch == self.fail_on:
+            raise ValueError('write failed')
+        self.batches.append(batch)
+
+    def close(self):
+        self.closed = True
+
+def make_batches(count, fail_at=None):
+    """ Generates count batches, raising ValueError at batch fail_at """
+    for i in range(count):
+        if i == fail_at:
+            raise ValueError('read failed')
+        yield [{'n': i}]
+
+class ThreadedTestCase(unittest.TestCase):
+    def test_threaded_order(self):
+        batches = list(addr_pipeline.threaded(make_batches(100), queue_batches=2))
+        self.assertEqual(batches, [[{'n': i}] for i in range(100)])
+
+    def test_threaded_exception(self):
+        with self.assertRaises(ValueError):
+            list(addr_pipeline.threaded(make_batches(10, fail_at=5)))
+
+    def test_threaded_early_stop(self):
+        batches = addr_pipeline.threaded(make_batches(1000), queue_batches=1)
+        self.assertEqual(next(batches), [{'n': 0}])
+        batches.close()
+
+    def test_threaded_sink(self):
+        sink = ListSink()
+        with addr_pipeline.ThreadedSink(sink, queue_batches=1) as threaded_sink:
+            addr_pipeline.drain(make_batches(50), threaded_sink)
+        self.assertTrue(sink.closed)
+        self.assertEqual(sink.batches, [[{'n': i}] for i in range(50)])
+
+    def test_threaded_sink_exception(self):
+        sink = ListSink(fail_on=[{'n': 3}])
+        with self.assertRaises(ValueError):
+            with addr_pipeline.ThreadedSink(sink) as threaded_sink:
+                addr_pipeline.drain(make_batches(5), threaded_sink)
+
+class StageTestCase(unittest.TestCase):
+    def test_field_filter(self):
+        batches = [[{'city': 'Staunton'}, {'city': 'WAYNESBORO'}], [{'city': None}]]
+        self.assertEqual(list(addr_pipeline.field_filter(batches, 'city', 'waynesboro')),
+                         [[{'city': 'WAYNESBORO'}]])
+
+    def test_format_node(self):
+        node = addr_pipeline.format_node({'@id': '-3', '@lat': 1.5, '@lon': 2,
+                                          'addr:street': 'A & "B"', 'addr:unit': ''})
+        self.assertEqual(node, '    <node id="-3" action="modify" visible="true" lat="1.5" '
+                         'lon="2">\n        <tag k="addr:street" v="A &amp; &quot;B&quot;" />\n'
+                         '    </node>\n')
+
+def make_records():
+    """ Returns a batch of normalized records """
+    return [addr_record.AddrRecord(housenumber='12', street='Main Street', city='Staunton',
+                                   state='VA', lat=38.15, lon=-79.07, id='-1', fid=4),
+            addr_record.AddrRecord(housenumber='3', street='Oak Lane', unit='B', lat='38.2',
+                                   lon='-79.1', id='-2')]
+
+class SinkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory() # pylint: disable=R1732
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_default_csv(self):
+        file_name = os.path.join(self.work_dir.name, 'out.csv')
+        with addr_pipeline.open_sink(file_name) as sink:
+            sink.write(make_records())
+        with open(file_name, encoding='utf-8', newline='') as csv_in:
+            rows = list(csv.DictReader(csv_in))
+        self.assertEqual(list(rows[0]), addr_pipeline.ADDRESS_TAGS + ['latitude', 'longitude'])
+        self.assertEqual((rows[1]['addr:unit'], rows[1]['latitude']), ('B', '38.2'))
+
+    def test_split_sinks(self):
+        records = [{'addr:city': 'Staunton', 'addr:street': 'Main Street',
+                    'addr:housenumber': str(n), '@lat': 38.1 + (n % 10) / 1000,
+                    '@lon': -79.0 - n // 10 / 1000}
+                   for n in range(250)]
+        records.append({'addr:city': 'Staunton', 'addr:street': 'Oak Lane', '@lat': 38.2,
+                        '@lon': -79.1})
+        with addr_pipeline.StreetSplitSink(self.work_dir.name, 100, 'hilbert') as sink:
+            sink.write(records)
+        files = sorted(os.listdir(self.work_dir.name))
+        # Main Street is cut into numbered tiles, Oak Lane is not
+        self.assertEqual(files[-1], 'Staunton__Oak_Lane.osm')
+        self.assertTrue(all(name.startswith('Staunton__Main_Street__') for name in files[:-1]))
+        self.assertEqual(self.count_nodes(self.work_dir.name, files[:-1]), 250)
+        tile_dir = os.path.join(self.work_dir.name, 'tiles')
+        os.mkdir(tile_dir)
+        with addr_pipeline.TileSplitSink(tile_dir, 100) as sink:
+            sink.write(records)
+        files = sorted(os.listdir(tile_dir))
+        self.assertEqual(files[0], 'tile_0001.osm')
+        self.assertEqual(self.count_nodes(tile_dir, files), 251)
+
+    def count_nodes(self, out_dir, files):
+        """ Returns the number of nodes in the files, checking that none has more
+        than 100.
+        """
+        nodes = 0
+        for name in files:
+            with open(os.path.join(out_dir, name), encoding='utf-8') as osm_in:
+                count = osm_in.read().count('<node ')
+            self.assertLessEqual(count, 100)
+            nodes += count
+        return nodes
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_geoparquet(self):
+        # pylint: disable=C0415
+        import json
+        import pyarrow.parquet
+        file_name = os.path.join(self.work_dir.name, 'out.parquet')
+        with addr_pipeline.open_sink(file_name, source='va.csv') as sink:
+            sink.write(make_records())
+        table = pyarrow.parquet.read_table(file_name, columns=['addr:street', 'lat', 'source_id',
+                                                               'source'])
+        self.assertEqual(table.to_pydict(), {'addr:street': ['Main Street', 'Oak Lane'],
+                                             'lat': [38.15, 38.2], 'source_id': ['4', None],
+                                             'source': ['va.csv', 'va.csv']})
+        geo = json.loads(pyarrow.parquet.read_schema(file_name).metadata[b'geo'])
+        self.assertEqual(geo['columns']['geometry']['bbox'], [-79.1, 38.15, -79.07, 38.2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,14 +12,25 @@ Output:
 input_file_prep.csv
 
 To create the name of the output file "raw" is removed from the name of the
-input file and replaced with "prep"
+input file and replaced with "prep".  The input file may be compressed (e.g.
+input_file_raw.csv.gz), in which case the output file is compressed in the same
+way (input_file_prep.csv.gz).
 
 """
 import argparse
 import re
-import csv
 import os
-import yaml
+import addr_diag
+import addr_io
+import addr_pipeline
+import addr_record
+import addr_stats
+from addr_diag import DIAG
+from addr_stats import STATS
+
+# The modules used only by some of the options (the boundaries and the store)
+# are imported where they are used, so that addr_prep (and osm-addr prep-va
+# --help) starts quickly.
 
 street_types = {}
 street_prefixes = {}
@@ -27,6 +38,11 @@ street_suffixes = {}
 unit_labels = {}
 unit_labels_stand_alone = {}
 street_name_special_cases = []
+street_name_cache = {}
+# The lookups in street_name_cache not yet added to STATS, as [hits, misses],
+# which are counted here rather than each recorded, as fix_street_name() is
+# called for every address (see add_street_name_stats())
+street_name_lookups = [0, 0]
 
 def get_conf():
     """ Gets configuration information from the configuration file
@@ -38,25 +54,32 @@ def get_conf():
     global unit_labels
     global unit_labels_stand_alone
     global street_name_special_cases
-    with open('addr_prep.conf', 'r', encoding='utf-8') as conf_in:
-        conf2 = yaml.load(conf_in, Loader=yaml.SafeLoader)
-        street_types = conf2['street_types']
-        street_prefixes = conf2['street_prefixes']
-        street_suffixes = conf2['street_suffixes']
-        unit_labels = conf2['unit_labels']
-        unit_labels_stand_alone = conf2['unit_labels_stand_alone']
-        street_name_special_cases = conf2['street_name_special_cases']
+    street_name_cache.clear()
+    street_name_lookups[0] = street_name_lookups[1] = 0
+    conf2 = addr_io.read_conf()
+    street_types = conf2['street_types']
+    street_prefixes = conf2['street_prefixes']
+    street_suffixes = conf2['street_suffixes']
+    unit_labels = conf2['unit_labels']
+    unit_labels_stand_alone = conf2['unit_labels_stand_alone']
+    street_name_special_cases = conf2['street_name_special_cases']
 
 def fix_street_name(street_name):
     """ 'Fixes' the street name, including:
         * Converting from all upper case to title case
         * Handling upper case in the middle of words, e.g. McDonald
         * Handling words that should be all upper case, e.g. IBM
+    The same street name occurs many times in the input, so the results are cached.
     """
+    if street_name in street_name_cache:
+        street_name_lookups[0] += 1
+        return street_name_cache[street_name]
+    street_name_lookups[1] += 1
     street_name_temp = title_case(street_name)
     for case in street_name_special_cases:
         pat = re.compile(case[0], flags=re.IGNORECASE)
         street_name_temp = apply_case(pat, case[1], street_name_temp)
+    street_name_cache[street_name] = street_name_temp
     return street_name_temp
 
 def apply_case(pat, replacement, string_in):
@@ -169,79 +192,157 @@ def title_case(title):
 
 def expand_street_suffix(street_suffix):
     """ Expands abbreviations in the street suffix field. The field is considered
-    as a whole. If the contents of the street suffix field is not recognized as
-    an abbreviation, a message is printed to stdout.
+    as a whole. If the contents of the street suffix field is not blank, and is
+    not recognized as an abbreviation, it is reported to the diagnostics summary.
     """
     if street_suffix in street_suffixes:
         return street_suffixes[street_suffix]
-    print('unhanded street suffix: ' + street_suffix)
+    if not street_suffix:
+        return ''
+    DIAG.report('unhandled street suffix', street_suffix)
     return None
 
 def expand_street_prefix(street_prefix):
     """ Expands abbreviations in the street prefix field.  The field is considered
     as a whole. if the contents of the street prefix field is not blank, and is
-    not recognized as an abbreviation, a message is printed to stdout.
+    not recognized as an abbreviation, it is reported to the diagnostics summary.
     """
     if street_prefix in street_prefixes:
         return street_prefixes[street_prefix]
-    print('unhanded street prefix: ' + street_prefix)
+    if not street_prefix:
+        return ''
+    DIAG.report('unhandled street prefix', street_prefix)
     return None
 
 def expand_street_type(street_type_abbr):
     """ Expands abbreviations in the street type field.  The field is considered
     as a whole.  If the contents of the street type field is not blank, and is
-    not recognized as an abbreviation, a message is printed to stdout.
+    not recognized as an abbreviation, it is reported to the diagnostics summary.
     """
     if street_type_abbr in street_types:
         return street_types[street_type_abbr]
-    print('unhandled street type abbreviation:' + street_type_abbr)
+    if not street_type_abbr:
+        return ''
+    DIAG.report('unhandled street type abbreviation', street_type_abbr)
     return None
 
+# The fields of the input file which are used
+VA_FIELDS = ['PLACENAME', 'PREADDRNUM', 'ADDRNUM', 'ADDRNUMSUF', 'STREET_PREFIX', 'STREET_NAME',
+             'STREET_TYPE', 'STREET_SUFFIX', 'UNITTYPE', 'UNITID', 'PO_NAME', 'ZIP_5', 'LAT',
+             'LONG']
+
+def describe_row(row):
+    """ Returns a short description of a row of the input file, for use in the
+    diagnostics summary.
+    """
+    fields = ['PREADDRNUM', 'ADDRNUM', 'ADDRNUMSUF', 'STREET_PREFIX', 'STREET_NAME',
+              'STREET_TYPE', 'STREET_SUFFIX', 'UNITTYPE', 'UNITID']
+    return ' '.join(' '.join(row[field] for field in fields).split()) + ', ' + row['PO_NAME']
+
+PREP_FIELDS = ['name', 'addr:housenumber', 'addr:street', 'addr:unit:label',
+               'addr:unit', 'addr:city', 'addr:state', 'addr:postcode',
+               'latitude', 'longitude']
+PREP_KEY_MAP = {'latitude': '@lat', 'longitude': '@lon'}
+
+def normalize_row(row):
+    """ Converts a row of the Virginia address file into a record of OSM tags
+    (an addr_record.AddrRecord).
+    """
+    DIAG.set_record(row)
+    addr_street = make_addr_street(
+        row['STREET_PREFIX'],
+        row['STREET_NAME'],
+        row['STREET_TYPE'],
+        row['STREET_SUFFIX'])
+    if addr_street is None or addr_street == '':
+        DIAG.report('blank street')
+    addr_city = row['PO_NAME'].title()
+    # Reduce multiple spaces between words to single space
+    addr_city = ' '.join(addr_city.split())
+    addr_unit_label, addr_unit = make_addr_unit_and_label(row['UNITTYPE'],
+                                                          row['UNITID'])
+    return addr_record.AddrRecord(name=row['PLACENAME'].title(),
+                                  housenumber=make_addr_housenumber(row['PREADDRNUM'],
+                                                                    row['ADDRNUM'],
+                                                                    row['ADDRNUMSUF']),
+                                  street=addr_street,
+                                  unit_label=addr_unit_label,
+                                  unit=addr_unit,
+                                  city=addr_city,
+                                  state='VA',
+                                  postcode=row['ZIP_5'],
+                                  lat=row['LAT'],
+                                  lon=row['LONG'])
+
+def va_normalize(batches):
+    """ Pipeline stage (see addr_pipeline) which converts batches of rows from the
+    Virginia address file into batches of records of OSM tags.
+    """
+    for batch in batches:
+        with STATS.timer('normalize', len(batch)):
+            batch = [normalize_row(row) for row in batch]
+        add_street_name_stats()
+        yield batch
+
+def add_street_name_stats():
+    """ Adds the lookups in the cache of fix_street_name() since the last call
+    to the statistics of the run.
+    """
+    STATS.add_cache('street name', *street_name_lookups)
+    street_name_lookups[0] = street_name_lookups[1] = 0
+
+def prep_file(addr_input, addr_output, diagnostics_csv=None, threads=False, store=None,
+              boundaries=(None, None)):
+    """ Converts the addresses in addr_input to OSM tags and writes them to
+    addr_output, and to the addresses layer of the store (see addr_store) if
+    one is given.  If threads is True, reading and writing are done in
+    separate threads.  boundaries are the GeoJSON files of the municipal and
+    ZCTA boundaries, from which missing cities and postcodes are filled in.
+    """
+    # pylint: disable=R0913, C0415
+    import addr_boundary
+    import addr_store
+    DIAG.reset(describe_row)
+    indexes = addr_boundary.load_indexes(*boundaries)
+    batches = addr_pipeline.read_ahead(addr_pipeline.csv_source(addr_input, fields=VA_FIELDS),
+                                       threads)
+    sinks = [addr_pipeline.write_behind(addr_pipeline.CsvSink(addr_output, PREP_FIELDS,
+                                                              PREP_KEY_MAP), threads)]
+    if store:
+        sinks.append(addr_pipeline.write_behind(
+            addr_store.StoreSink(store, addr_store.ADDRESS_LAYER, addr_input), threads))
+    try:
+        addr_pipeline.drain(addr_boundary.assign_jurisdictions(va_normalize(batches), *indexes),
+                            *sinks)
+    finally:
+        for sink in sinks:
+            sink.close()
+    addr_diag.finish(diagnostics_csv)
+
 def main():
     """ Main function, gets the command line argument, and converts the specified
     file to one suitable for import to OSM.
     """
-    get_conf()
+    # pylint: disable=C0415
+    import addr_boundary
+    import addr_store
     parser = argparse.ArgumentParser(description='Prepares address file for import to OSM.')
     parser.add_argument('input_file', help='file containing address info')
+    addr_pipeline.add_args(parser)
+    addr_stats.add_args(parser)
+    addr_diag.add_args(parser)
+    addr_store.add_args(parser)
+    addr_boundary.add_args(parser)
     args = parser.parse_args()
+    # The configuration is read once the arguments are, so not for --help
+    get_conf()
     addr_input = args.input_file
-    addr_output, _ = os.path.splitext(addr_input)
+    # The output is compressed in the same way as the input, if it is
+    addr_output, _ = os.path.splitext(addr_io.strip_compression(addr_input))
     addr_output = addr_output.replace('_raw','')
-    addr_output = addr_output + '_prep.csv'
-    with open(addr_input, newline='', encoding='utf-8') as csvfile:
-        with open(addr_output, 'w', newline='', encoding='utf-8') as csvfile_out:
-            field_names = ['name', 'addr:housenumber', 'addr:street', 'addr:unit:label',
-                           'addr:unit', 'addr:city', 'addr:state', 'addr:postcode',
-                           'latitude', 'longitude']
-            writer = csv.DictWriter(csvfile_out, fieldnames=field_names)
-            writer.writeheader()
-            addr_reader = csv.DictReader(csvfile)
-            for row in addr_reader:
-                addr_street = make_addr_street(
-                    row['STREET_PREFIX'],
-                    row['STREET_NAME'],
-                    row['STREET_TYPE'],
-                    row['STREET_SUFFIX'])
-                if addr_street is None or addr_street == '':
-                    print('BLANK Street')
-                addr_city = row['PO_NAME'].title()
-                # Reduce multiple spaces between words to single space
-                addr_city = ' '.join(addr_city.split())
-                addr_unit_label, addr_unit = make_addr_unit_and_label(row['UNITTYPE'],
-                                                                      row['UNITID'])
-                writer.writerow({'name': row['PLACENAME'].title(),
-                                 'addr:housenumber': make_addr_housenumber(row['PREADDRNUM'],
-                                                                           row['ADDRNUM'],
-                                                                           row['ADDRNUMSUF']),
-                                 'addr:street': addr_street,
-                                 'addr:unit:label': addr_unit_label,
-                                 'addr:unit': addr_unit,
-                                 'addr:city': addr_city,
-                                 'addr:state': 'VA',
-                                 'addr:postcode': row['ZIP_5'],
-                                 'latitude': row['LAT'],
-                                 'longitude': row['LONG']})
+    addr_output = addr_output + '_prep.csv' + addr_io.compression(addr_input)
+    addr_stats.run(prep_file, args, addr_input, addr_output, args.diagnostics_csv,
+                   args.threads, args.store, (args.city_boundaries, args.postcode_boundaries))
 
 if __name__ == '__main__':
     main()
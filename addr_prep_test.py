@@ -7,6 +7,9 @@ $ python3 addr_prep_test.py
 """
 import unittest
 import addr_prep
+import co_addr_prep
+from addr_diag import DIAG
+from addr_stats import STATS
 
 class UnitTestCase(unittest.TestCase):
     def setUp(self):
@@ -38,5 +41,47 @@ class UnitTestCase(unittest.TestCase):
         self.assertEqual(label, 'Unit')
         self.assertEqual(unit_id, 'Office')
 
+    def test_diagnostics(self):
+        DIAG.reset()
+        for _ in range(3):
+            addr_street = addr_prep.make_addr_street('', 'MAIN', 'XYZ', 'ZZ')
+            self.assertEqual(addr_street, 'Main')
+        addr_prep.make_addr_street('N', 'OAK', 'ST', '')
+        self.assertEqual(len(DIAG), 2)
+        self.assertEqual(list(DIAG.items()),
+                         [('unhandled street suffix', 'ZZ', 3, []),
+                          ('unhandled street type abbreviation', 'XYZ', 3, [])])
+
+    def test_blank_fields(self):
+        # Blank fields are not reported, even when the configuration does not
+        # list them
+        for module, make_street in ((addr_prep, lambda: addr_prep.make_addr_street(
+                                         '', 'MAIN', '', '')),
+                                    (co_addr_prep, lambda: co_addr_prep.make_addr_street_co(
+                                         '', '', '', '', 'MAIN', '', ''))):
+            module.get_conf()
+            for abbreviations in (module.street_types, module.street_prefixes,
+                                  module.street_suffixes):
+                abbreviations.pop('', None)
+            DIAG.reset()
+            try:
+                self.assertEqual(make_street(), 'Main')
+                self.assertEqual(len(DIAG), 0)
+            finally:
+                module.get_conf()
+
+    def test_street_name_cache(self):
+        row = dict.fromkeys(addr_prep.VA_FIELDS, '')
+        rows = [dict(row, ADDRNUM=str(number), STREET_NAME=name, STREET_TYPE='ST')
+                for number, name in enumerate(['MAIN', 'OAK', 'MAIN', 'MAIN'])]
+        STATS.reset()
+        batches = list(addr_prep.va_normalize([rows[:2], rows[2:]]))
+        self.assertEqual([record['addr:street'] for batch in batches for record in batch],
+                         ['Main Street', 'Oak Street', 'Main Street', 'Main Street'])
+        # The lookups are added to STATS after each batch
+        self.assertEqual(STATS.summary()['caches']['street name'],
+                         {'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+        STATS.reset()
+
 if __name__ == '__main__':
     unittest.main()
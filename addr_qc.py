@@ -9,18 +9,31 @@ If you provide this program a database of zipcodes it will check if the postcode
 in the data are valid. You can download such a database from:
 https://www.unitedstateszipcodes.org/zip-code-database/
 
+The addresses may also be read from the addresses layer of an SQLite working
+store (see addr_store), in which case the duplicate addresses and locations are
+found with indexed queries rather than by counting every address in memory.
+
 Usage
 $ python3 addr_qc addresses.osm
+$ python3 addr_qc work.sqlite
 
 Under Linux you can create a symbolic link to this file so that you can execute
 if from anywhere on your system.
 * Open a terminal and navigate to ~/.local/bin
 * $ ln -s /path_to_this_file/addr_qc.py addr_qc
 """
-from xml.etree import ElementTree
 import argparse
 import csv
 import re
+import addr_io
+import addr_pipeline
+import addr_stats
+from addr_stats import STATS
+
+# The modules used only by some of the checks and options (the boundaries, the
+# store, the cache, the street and house number checks, and the spilling of the
+# duplicate counts) are imported where they are used, so that addr_qc (and
+# osm-addr qc --help) starts quickly.
 
 class CountingSet():
     """ A class that acts like a set, but that keeps track of how many of each
@@ -33,16 +46,16 @@ class CountingSet():
     def __getattr__(self, item):
         return self._dict[item]
 
-    def add(self, item):
+    def add(self, item, count=1):
         """ Add the specified item to the set.  If the item already exists in
-        the set, its counter is incremented.  If the item does not exist in the
-        set, it is added with its counter set to 1.
+        the set, its counter is incremented (by count).  If the item does not
+        exist in the set, it is added with its counter set to count.
         """
         if item in self._dict:
-            self._dict[item] = self._dict[item] + 1
+            self._dict[item] = self._dict[item] + count
         else:
-            self._dict[item] = 1
-        self.total_count += 1
+            self._dict[item] = count
+        self.total_count += count
 
     def items(self):
         """ A generator function that yeilds items and a count of how many times
@@ -54,47 +67,245 @@ class CountingSet():
     def __len__(self):
         return len(self._dict)
 
+    def close(self):
+        """ Releases any resources held by the set """
+
+# The approximate number of bytes of memory taken by each item of a
+# SpillingCountingSet, an address of five short strings and its count
+ITEM_BYTES = 500
+# The number of partitions into which a SpillingCountingSet spills its items
+SPILL_PARTITIONS = 64
 
-def get_value(key, element):
-    """ Given an OSM element, and a key, returns the value of that key, or None
-    if the element doesn't have that key.
+class SpillingCountingSet(CountingSet):
+    """ A CountingSet which holds at most max_items items in memory.  When it
+    has more, the items and their counts are appended to one of
+    SPILL_PARTITIONS temporary files (chosen by the hash of the item), and
+    memory is cleared.  items() then counts each partition in turn, so that
+    only the items of one partition are held in memory at once, which allows
+    SPILL_PARTITIONS times as many items as fit in memory to be counted.
+
+    items() yields the same items and counts, in the same order (that in
+    which each item was first added), as a CountingSet: each item is kept with
+    the number of the add() which first added it, the items of each
+    partition are written sorted by that number, and the sorted partitions
+    are merged.
     """
-    for child in element:
-        if child.tag == 'tag':
-            if 'k' in child.attrib:
-                k = child.attrib['k']
-                if k == key:
-                    if 'v' in child.attrib:
-                        return child.attrib['v']
-    return None
+    def __init__(self, max_items, spill_dir=None):
+        super().__init__()
+        self.max_items = max_items
+        self.spill_dir = spill_dir
+        self._work_dir = None
+        self._partitions = None
+        self._seq = 0
+
+    def add(self, item, count=1):
+        entry = self._dict.get(item)
+        if entry is None:
+            self._dict[item] = [self._seq, count]
+            if len(self._dict) > self.max_items:
+                self._spill()
+        else:
+            entry[1] += count
+        self._seq += 1
+        self.total_count += count
+
+    def _spill(self):
+        """ Appends the items in memory to the partition files """
+        # pylint: disable=C0415
+        import pickle
+        import tempfile
+        if self._work_dir is None:
+            self._work_dir = tempfile.TemporaryDirectory( # pylint: disable=R1732
+                prefix='addr_qc_', dir=self.spill_dir)
+            # pylint: disable=R1732
+            self._partitions = [tempfile.TemporaryFile(dir=self._work_dir.name)
+                                for _ in range(SPILL_PARTITIONS)]
+        with STATS.timer('spill', len(self._dict)):
+            for item, (seq, count) in self._dict.items():
+                pickle.dump((item, seq, count), self._partitions[hash(item) % SPILL_PARTITIONS])
+            self._dict.clear()
+
+    def _sorted_partition(self, index):
+        """ Counts the items of a partition, writing them, sorted by the number
+        of the add() which first added them, to a temporary file, which is
+        returned.
+        """
+        # pylint: disable=C0415
+        import pickle
+        import tempfile
+        partition = self._partitions[index]
+        partition.flush()
+        partition.seek(0)
+        counts = {}
+        while True:
+            try:
+                item, seq, count = pickle.load(partition)
+            except EOFError:
+                break
+            entry = counts.get(item)
+            if entry is None:
+                counts[item] = [seq, count]
+            else:
+                entry[0] = min(entry[0], seq)
+                entry[1] += count
+        partition.seek(0, 2)
+        sorted_file = tempfile.TemporaryFile(dir=self._work_dir.name) # pylint: disable=R1732
+        for item, (seq, count) in sorted(counts.items(), key=lambda x: x[1][0]):
+            pickle.dump((seq, item, count), sorted_file)
+        sorted_file.seek(0)
+        return sorted_file
+
+    @staticmethod
+    def _read_sorted(sorted_file):
+        """ A generator function which yields the (seq, item, count) of a file
+        written by _sorted_partition(), closing it at the end.
+        """
+        import pickle # pylint: disable=C0415
+        with sorted_file:
+            while True:
+                try:
+                    yield pickle.load(sorted_file)
+                except EOFError:
+                    return
+
+    def items(self):
+        if self._work_dir is None:
+            for item, (_, count) in self._dict.items():
+                yield item, count
+            return
+        import heapq # pylint: disable=C0415
+        self._spill()
+        with STATS.timer('merge spilled'):
+            sorted_files = [self._sorted_partition(index) for index in range(SPILL_PARTITIONS)]
+        for _, item, count in heapq.merge(*[self._read_sorted(sorted_file)
+                                            for sorted_file in sorted_files]):
+            yield item, count
+
+    def __len__(self):
+        if self._work_dir is None:
+            return len(self._dict)
+        return sum(1 for _ in self.items())
 
-def get_id(element):
-    """ Given an OSM element, return it's id
+    def close(self):
+        if self._work_dir is not None:
+            for partition in self._partitions:
+                partition.close()
+            self._work_dir.cleanup()
+            self._work_dir = None
+
+
+def coordinate_value(value):
+    """ Returns a latitude or longitude as read, or None if it is missing or
+    blank (as in a row of the Virginia file without a location).
     """
-    return element.attrib['id']
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return value
 
-def get_lat_lon(element):
-    """ Given an OSM node, return it's latitude and longitude
+def get_lat_lon(record):
+    """ Given the record of an OSM node, return it's latitude and longitude
     """
-    if 'lat' in element.attrib:
-        lat = float(element.attrib['lat'])
-    else:
-        lat = None
-    if 'lon' in element.attrib:
-        lon = float(element.attrib['lon'])
-    else:
-        lon = None
-    return lat, lon
+    lat = coordinate_value(record.get('@lat'))
+    lon = coordinate_value(record.get('@lon'))
+    return (None if lat is None else float(lat)), (None if lon is None else float(lon))
 
-def main():
-    """ Main function
+# The messages of the coordinate checks, of which at most one is reported for
+# each node, in order of precedence.
+COORDINATE_ERRORS = ['Coordinates, null or missing',
+                     'Coordinates, suspect, at North or South Pole',
+                     'Coordinates, off Earth',
+                     'Coordinates, suspect, on antimeridian',
+                     'Coordinates, suspect, on Null Island (0, 0)']
+OUTSIDE_BBOX = 'Coordinates, outside expected bounding box'
+OUTSIDE_BOUNDARY = 'Coordinates, outside boundary'
+
+def coordinate_error(lat, lon):
+    """ Returns the index in COORDINATE_ERRORS of the error found in a location,
+    or None.
+    """
+    if lat is None or lon is None:
+        return 0
+    if lat in (-90.0, 90.0):
+        return 1
+    if lat < -90.0 or lat > 90.0 or lon < -180.0 or lon > 180.0:
+        return 2
+    if lon in (180.0, -180.00):
+        return 3
+    if lon == 0 and lat == 0:
+        return 4
+    return None
+
+def check_coordinates(batch, bbox=None, boundary=None):
+    """ Runs the coordinate checks on a batch of records at once.  When numpy is
+    installed the locations are gathered into arrays, and the checks are run
+    on the whole batch as array operations.
+
+    Parameters:
+        batch - (in) The records.
+        bbox - (in) Optional (min_lat, min_lon, max_lat, max_lon) in which all of
+            the locations are expected to be, e.g. that of the county.
+        boundary - (in) Optional addr_boundary.Boundary in which all of the
+            locations are expected to be.
+
+    Returns:
+        A list of the (lat, lon) of each record, with None for missing values,
+        and a list of the list of the coordinate errors found in each record.
+    """
+    import addr_boundary # pylint: disable=C0415
+    numpy = addr_boundary.numpy_module()
+    if numpy is None:
+        locations = [get_lat_lon(record) for record in batch]
+        errors = []
+        for lat, lon in locations:
+            error = coordinate_error(lat, lon)
+            if error is not None:
+                errors.append([COORDINATE_ERRORS[error]])
+            elif bbox and not (bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]):
+                errors.append([OUTSIDE_BBOX])
+            elif boundary and not boundary.contains_point(lat, lon):
+                errors.append([OUTSIDE_BOUNDARY])
+            else:
+                errors.append([])
+        return locations, errors
+    lat_values = [coordinate_value(record.get('@lat')) for record in batch]
+    lon_values = [coordinate_value(record.get('@lon')) for record in batch]
+    missing = numpy.array([lat is None or lon is None
+                           for lat, lon in zip(lat_values, lon_values)], dtype=bool)
+    # numpy parses the strings itself
+    lats = numpy.array(['nan' if lat is None else lat for lat in lat_values], dtype=float)
+    lons = numpy.array(['nan' if lon is None else lon for lon in lon_values], dtype=float)
+    with numpy.errstate(invalid='ignore'):
+        # numpy.select() takes the first condition met, as coordinate_error() does
+        codes = numpy.select(
+            [missing, (lats == -90.0) | (lats == 90.0),
+             (lats < -90.0) | (lats > 90.0) | (lons < -180.0) | (lons > 180.0),
+             (lons == 180.0) | (lons == -180.0), (lons == 0) & (lats == 0)],
+            [1, 2, 3, 4, 5], 0)
+        valid = codes == 0
+        if bbox:
+            outside = valid & ~((lats >= bbox[0]) & (lats <= bbox[2]) &
+                                (lons >= bbox[1]) & (lons <= bbox[3]))
+            codes[outside] = len(COORDINATE_ERRORS) + 1
+            valid &= ~outside
+        if boundary:
+            codes[valid & ~boundary.contains(lats, lons)] = len(COORDINATE_ERRORS) + 2
+    messages = [None] + COORDINATE_ERRORS + [OUTSIDE_BBOX, OUTSIDE_BOUNDARY]
+    errors = [[] for _ in batch]
+    for index in numpy.flatnonzero(codes):
+        errors[index].append(messages[codes[index]])
+    locations = [(None if lat is None else lat_float, None if lon is None else lon_float)
+                 for lat, lon, lat_float, lon_float
+                 in zip(lat_values, lon_values, lats.tolist(), lons.tolist())]
+    return locations, errors
+
+# The database of zipcodes, found as addr_io.data_file() finds it
+ZIP_DATABASE = 'zip_code_database.csv'
+
+def get_zips():
+    """ Reads the database of zipcodes, returning a dictionary keyed by zipcode.
     """
-    parser = argparse.ArgumentParser()
-    parser.add_argument("in_file",
-                        help="An .osm file containing addresses which is to be tested")
-    args = parser.parse_args()
     zips = {}
-    with open('zip_code_database.csv', newline='', encoding='utf-8') as csvfile:
+    with open(addr_io.data_file(ZIP_DATABASE), newline='', encoding='utf-8') as csvfile:
         zip_reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
         for row in zip_reader:
             zipcode = row['zip']
@@ -102,173 +313,423 @@ def main():
             cities.append(row['primary_city'])
             cities = [x.strip().upper() for x in cities]
             zips[zipcode] = {'cities': cities, 'type': row['type']}
-    tree = ElementTree.parse(args.in_file)
-    root = tree.getroot()
-    cities = CountingSet()
-    postcodes = CountingSet()
-    streets = CountingSet()
-    addrs = CountingSet()
-    all_errors = CountingSet()
-    locations = CountingSet()
-    units =  set()
-    for child in root:
-        if child.tag != 'node':
-            continue
-        # only look at new nodes
-        if int(get_id(child)) >= 0:
-            continue
-        errors = []
-        city = get_value('addr:city', child)
-        if city:
-            city = city.strip()
-        street = get_value('addr:street', child)
-        if street:
-            street = street.strip()
-        postcode = get_value('addr:postcode', child)
-        housenumber = get_value('addr:housenumber', child)
-        unit = get_value('addr:unit', child)
-        addrs.add((housenumber.upper() if housenumber else None,
-                   street.upper() if street else None,
-                   city.upper() if city else None,
-                   postcode.upper() if postcode else None,
-                   unit.upper() if unit else None))
-        lat, lon = get_lat_lon(child)
-        locations.add((lat, lon))
-        # Coordinate checks
-        if lat is None or lon is None:
-            msg = 'Coordinates, null or missing'
+    return zips
+
+def main():
+    """ Main function
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("in_file",
+                        help="An .osm file (or .sqlite store) containing addresses which is "
+                        "to be tested")
+    add_args(parser)
+    parser.add_argument('--cache', metavar='CACHE_FILE',
+                        help='keep the results of the checks of each street in this SQLite '
+                        'file, and only check again the streets which have changed since '
+                        '(the results of the streets not in in_file are dropped from it)')
+    addr_pipeline.add_args(parser)
+    addr_stats.add_args(parser)
+    args = parser.parse_args()
+    if args.cache and args.max_memory:
+        parser.error('--cache keeps all of the addresses in memory, so cannot be used with '
+                     '--max-memory')
+    addr_stats.run(qc_file, args, args.in_file, args.threads, args.bbox, args.boundary,
+                   args.city_boundaries, args.postcode_boundaries, args.near_streets,
+                   args.max_memory, args.house_numbers, args.cache)
+
+def parse_bbox(text):
+    """ Parses the --bbox option, returning (min_lat, min_lon, max_lat, max_lon)
+    """
+    try:
+        bbox = tuple(float(value) for value in text.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        raise argparse.ArgumentTypeError('expected MIN_LAT,MIN_LON,MAX_LAT,MAX_LON')
+    return bbox
+
+def add_args(parser):
+    """ Adds the --bbox, --boundary, --city-boundaries, --postcode-boundaries
+    --near-streets, --house-numbers and --max-memory options to an argparse.ArgumentParser
+    """
+    parser.add_argument('--bbox', type=parse_bbox, metavar='MIN_LAT,MIN_LON,MAX_LAT,MAX_LON',
+                        help='report addresses outside of this bounding box, e.g. that of the '
+                        'county or state')
+    parser.add_argument('--boundary', metavar='GEOJSON_FILE',
+                        help='report addresses outside of the polygons in this GeoJSON file, '
+                        'e.g. the boundary of the county')
+    import addr_boundary # pylint: disable=C0415
+    addr_boundary.add_args(parser)
+    parser.add_argument('--near-streets', action='store_true',
+                        help='also list the streets of each city which are possibly the same, '
+                        'e.g. "Mc Donald Rd" and "McDonald Road"')
+    parser.add_argument('--house-numbers', action='store_true',
+                        help='also check the house numbers along each street: odd and even '
+                        'numbers on the same side, numbers out of sequence, and outliers')
+    parser.add_argument('--max-memory', type=float, metavar='MB',
+                        help='count the addresses and locations for the duplicate checks in '
+                        'about this much memory, spilling them to temporary files beyond it')
+
+def load_boundary(file_name):
+    """ Returns the addr_boundary.Boundary read from the --boundary GeoJSON file,
+    or None if there is none.
+    """
+    if not file_name:
+        return None
+    import addr_boundary # pylint: disable=C0415
+    with STATS.timer('read boundary'):
+        return addr_boundary.Boundary.from_file(file_name)
+
+def qc_file(in_file, threads=False, bbox=None, boundary=None, city_boundaries=None,
+            postcode_boundaries=None, near_streets=False, max_memory=None,
+            house_numbers=False, cache=None):
+    """ Performs the quality checks on the given .osm file or store, and prints
+    the results.  If threads is True the file is parsed in a separate thread.
+    Addresses outside of the bbox, or the GeoJSON file boundary, if given, are
+    reported, as are those whose city or postcode differs from that of the
+    area of city_boundaries or postcode_boundaries (GeoJSON files) they lie in.
+    If near_streets is True the streets which are possibly the same are listed.
+    With max_memory (in MB), the duplicates are counted within about that much
+    memory (see SpillingCountingSet).  If house_numbers is True the house
+    numbers along each street are also checked (see addr_housenumbers).  With
+    cache, the name of an SQLite file, only the streets which have changed
+    since they were last checked are checked again (see addr_cache).  As all of
+    the addresses are then kept in memory (see CachedQcSink), cache cannot be
+    given with max_memory.
+    """
+    # pylint: disable=R0913, C0415
+    import addr_boundary
+    import addr_cache
+    import addr_store
+    if cache and max_memory:
+        raise ValueError('cache cannot be used with max_memory')
+    with STATS.timer('read zip database'):
+        zips = get_zips()
+    store = addr_store.is_store(in_file)
+    if store:
+        batches = addr_store.store_source(in_file, keys=QC_KEYS)
+    else:
+        batches = addr_pipeline.osm_source(in_file, keys=QC_KEYS)
+    indexes = addr_boundary.load_indexes(city_boundaries, postcode_boundaries)
+    qc_args = (zips, not store, bbox, load_boundary(boundary), indexes, near_streets,
+               max_memory, house_numbers)
+    if cache:
+        check_context = addr_cache.context([bbox], [addr_io.data_file(ZIP_DATABASE), boundary,
+                                                    city_boundaries, postcode_boundaries])
+        qc_sink = CachedQcSink(cache, check_context, *qc_args)
+    else:
+        qc_sink = QcSink(*qc_args)
+    with qc_sink:
+        addr_pipeline.drain(addr_pipeline.read_ahead(batches, threads), qc_sink)
+        if store:
+            # Only the duplicates are needed for the report
+            summary = qc_sink.summary
+            for addr, count in addr_store.duplicate_addresses(in_file):
+                summary.addrs.add(addr, count)
+            for location, count in addr_store.duplicate_locations(in_file):
+                summary.locations.add(location, count)
+
+# The tags which are checked
+QC_KEYS = ['addr:city', 'addr:street', 'addr:postcode', 'addr:housenumber', 'addr:unit']
+
+class QcSummary():
+    """ The counts of cities, postcodes, streets, addresses, errors and locations
+    found while checking the nodes, from which the reports are printed.  Unless
+    count_duplicates is True, the addresses and locations are not counted, and
+    only the duplicates found otherwise are added to addrs and locations.  If
+    near_streets is True the streets of each city are also added to an
+    addr_streets.StreetIndex, to report those which are possibly the same.
+    With max_memory (in MB), the addresses and locations are counted in
+    SpillingCountingSets which spill to temporary files in spill_dir (by
+    default the system's) rather than use more memory than that.  If
+    house_numbers is True the house number and location of each address are
+    kept for each street and city, for addr_housenumbers.check_street().
+    """
+    # pylint: disable=R0913
+    def __init__(self, count_duplicates=True, near_streets=False, max_memory=None,
+                 spill_dir=None, house_numbers=False):
+        self.count_duplicates = count_duplicates
+        self.cities = CountingSet()
+        self.postcodes = CountingSet()
+        self.streets = CountingSet()
+        if max_memory:
+            # Half of the memory for each
+            max_items = max(1, int(max_memory * 1024 * 1024 / ITEM_BYTES / 2))
+            self.addrs = SpillingCountingSet(max_items, spill_dir)
+            self.locations = SpillingCountingSet(max_items, spill_dir)
+        else:
+            self.addrs = CountingSet()
+            self.locations = CountingSet()
+        self.all_errors = CountingSet()
+        self.units = set()
+        self.city_streets = {} if near_streets else None
+        self.street_numbers = {} if house_numbers else None
+
+def find_errors(record, zips, coordinate_errors, areas=(None, None)):
+    """ Checks a record (see addr_pipeline) of a node.  Only new nodes (those
+    with a negative id, or no id at all) are checked.  coordinate_errors are
+    the errors in the location of the node found by check_coordinates(), and
+    areas is the name of the municipality and of the ZCTA that it lies in (or
+    None when unknown).  Returns the (city, street, postcode, housenumber, unit,
+    errors) of the record, errors being the messages of the errors found, for
+    add_findings(), or None if the node is not new.
+    """
+    # pylint: disable=R0912
+    # only look at new nodes
+    if '@id' in record and int(record['@id']) >= 0:
+        return None
+    city = record.get('addr:city')
+    if city:
+        city = city.strip()
+    street = record.get('addr:street')
+    if street:
+        street = street.strip()
+    postcode = record.get('addr:postcode')
+    housenumber = record.get('addr:housenumber')
+    unit = record.get('addr:unit')
+    # Coordinate checks
+    errors = list(coordinate_errors)
+    # City checks
+    if not city:
+        msg = 'City, missing'
+        errors.append(msg)
+    else:
+        if not re.search(r'^[A-Z]', city) or re.search(r'[A-Z]{2}', city):
+            msg = 'City, invalid capitalization'
             errors.append(msg)
-            all_errors.add(msg)
-        elif lat in (-90.0, 90.0):
-            msg = 'Coordinates, suspect, at North or South Pole'
+        if re.search(r'[^ -~]', city):
+            msg = 'City, contains non printable characters'
             errors.append(msg)
-            all_errors.add(msg)
-        elif lat < -90.0 or lat > 90.0 or lon < -180.0 or lon > 180.0:
-            msg = 'Coordinates, off Earth'
+        if re.search(r';', city):
+            msg = "City, possible multiple values separated by ';'"
             errors.append(msg)
-            all_errors.add(msg)
-        elif lon in (180.0, -180.00):
-            msg = 'Coordinates, suspect, on antimeridian'
+        if areas[0] and city.upper() != areas[0].strip().upper():
+            msg = 'City, does not match the municipal boundary at the location'
             errors.append(msg)
-            all_errors.add(msg)
-        elif lon == 0 and lat == 0:
-            msg = 'Coordinates, suspect, on Null Island (0, 0)'
+    # Housenumber checks
+    if not housenumber:
+        msg = 'Housenumber, missing'
+        errors.append(msg)
+    else:
+        if re.search(r'PO BOX', housenumber.upper()):
+            msg = 'Housenumber, PO Box not a valid housenumber'
             errors.append(msg)
-            all_errors.add(msg)
-        # City checks
-        if not city:
-            msg = 'City, missing'
+        if re.search(r';', housenumber):
+            msg = "Housenumber, possible multiple values separated by ';'"
             errors.append(msg)
-            all_errors.add(msg)
-        else:
-            cities.add(city)
-            if not re.search(r'^[A-Z]', city) or re.search(r'[A-Z]{2}', city):
-                msg = 'City, invalid capitalization'
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r'[^ -~]', city):
-                msg = 'City, contains non printable characters'
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r';', city):
-                msg = "City, possible multiple values separated by ';'"
-                errors.append(msg)
-                all_errors.add(msg)
-        # Housenumber checks
-        if not housenumber:
-            msg = 'Housenumber, missing'
+        if re.search(r'[^ -~]', housenumber):
+            msg = 'Housenumber, contains non printable characters'
             errors.append(msg)
-            all_errors.add(msg)
-        else:
-            if re.search(r'PO BOX', housenumber.upper()):
-                msg = 'Housenumber, PO Box not a valid housenumber'
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r';', housenumber):
-                msg = "Housenumber, possible multiple values separated by ';'"
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r'[^ -~]', housenumber):
-                msg = 'Housenumber, contains non printable characters'
-                errors.append(msg)
-                all_errors.add(msg)
-        # Postcode checks
-        if not postcode:
-            msg = 'Postcode, missing'
+    # Postcode checks
+    if not postcode:
+        msg = 'Postcode, missing'
+        errors.append(msg)
+    else:
+        if areas[1] and postcode != areas[1]:
+            msg = 'Postcode, does not match the ZCTA at the location'
             errors.append(msg)
-            all_errors.add(msg)
-        else:
-            postcodes.add(postcode)
-            if not re.search(r'^[0-9]{5}$', postcode):
-                msg = 'Postcode, Invalid, must be exactly five numeric digits'
-                errors.append(msg)
-                all_errors.add(msg)
-            elif postcode not in zips:
-                msg = 'Postcode, valid format, but not in postal database'
-                errors.append(msg)
-                all_errors.add(msg)
-            else:
-                if zips[postcode]['type'] == 'PO BOX':
-                    msg = 'Postcode, valid format, but only valid for PO Boxes'
-                    errors.append(msg)
-                    all_errors.add(msg)
-                if city:
-                    for split_city in city.split(';'):
-                        if split_city.upper().strip() not in zips[postcode]['cities']:
-                            msg = 'Postcode, valid format, but does not correspond to city'
-                            errors.append(msg)
-                            all_errors.add(msg)
-        # Street checks
-        if not street:
-            msg = 'Street, missing'
+        if not re.search(r'^[0-9]{5}$', postcode):
+            msg = 'Postcode, Invalid, must be exactly five numeric digits'
+            errors.append(msg)
+        elif postcode not in zips:
+            msg = 'Postcode, valid format, but not in postal database'
             errors.append(msg)
-            all_errors.add(msg)
         else:
-            streets.add(street)
-            if not re.search(r'^[A-Z1-9]', street) or re.search(r'[A-Z]{2}', street):
-                msg = 'Street, invalid capitalization'
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r'^[WENS]\b', street):
-                msg = 'Street, unexpanded abbreviation at start'
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r'/b[WENS]\.?$', street):
-                msg = 'Street, unexpanded abbreviation at end'
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r';', street):
-                msg = "Street, possible multiple ';' separated values"
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r'(\b\S+\b)\s+\b\1\b', street):
-                msg = 'Street, repeated word'
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r'[^ -~]', street):
-                msg = 'Street, contains non printable characters'
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r'PO BOX', street.upper()):
-                msg = 'Street, PO Box not a valid street'
+            if zips[postcode]['type'] == 'PO BOX':
+                msg = 'Postcode, valid format, but only valid for PO Boxes'
                 errors.append(msg)
-                all_errors.add(msg)
-        # Unit checks
-        if unit:
-            units.add(unit)
-            if re.search(r'[^ -~]', unit):
-                msg = 'Unit, contains non printable characters'
-                errors.append(msg)
-                all_errors.add(msg)
-            if re.search(r';', unit):
-                msg = "Unit, possible multiple ';' separated values"
-                errors.append(msg)
-                all_errors.add(msg)
-        if errors:
-            print(f'{repr(housenumber)} | {repr(street)} | {repr(city)} | {repr(postcode)} '
-                  f'| {repr(unit)}')
-            for error in errors:
-                print('    ' + error)
+            if city:
+                for split_city in city.split(';'):
+                    if split_city.upper().strip() not in zips[postcode]['cities']:
+                        msg = 'Postcode, valid format, but does not correspond to city'
+                        errors.append(msg)
+    # Street checks
+    if not street:
+        msg = 'Street, missing'
+        errors.append(msg)
+    else:
+        if not re.search(r'^[A-Z1-9]', street) or re.search(r'[A-Z]{2}', street):
+            msg = 'Street, invalid capitalization'
+            errors.append(msg)
+        if re.search(r'^[WENS]\b', street):
+            msg = 'Street, unexpanded abbreviation at start'
+            errors.append(msg)
+        if re.search(r'/b[WENS]\.?$', street):
+            msg = 'Street, unexpanded abbreviation at end'
+            errors.append(msg)
+        if re.search(r';', street):
+            msg = "Street, possible multiple ';' separated values"
+            errors.append(msg)
+        if re.search(r'(\b\S+\b)\s+\b\1\b', street):
+            msg = 'Street, repeated word'
+            errors.append(msg)
+        if re.search(r'[^ -~]', street):
+            msg = 'Street, contains non printable characters'
+            errors.append(msg)
+        if re.search(r'PO BOX', street.upper()):
+            msg = 'Street, PO Box not a valid street'
+            errors.append(msg)
+    # Unit checks
+    if unit:
+        if re.search(r'[^ -~]', unit):
+            msg = 'Unit, contains non printable characters'
+            errors.append(msg)
+        if re.search(r';', unit):
+            msg = "Unit, possible multiple ';' separated values"
+            errors.append(msg)
+    return city, street, postcode, housenumber, unit, errors
+
+def add_findings(summary, findings, location, coordinate_errors):
+    """ Adds what find_errors() found in a record to the QcSummary, and prints
+    the errors found.
+    """
+    city, street, postcode, housenumber, unit, errors = findings
+    if summary.count_duplicates:
+        summary.addrs.add((housenumber.upper() if housenumber else None,
+                           street.upper() if street else None,
+                           city.upper() if city else None,
+                           postcode.upper() if postcode else None,
+                           unit.upper() if unit else None))
+        summary.locations.add(location)
+    for msg in errors:
+        summary.all_errors.add(msg)
+    if city:
+        summary.cities.add(city)
+    if postcode:
+        summary.postcodes.add(postcode)
+    if street:
+        summary.streets.add(street)
+        if summary.city_streets is not None:
+            index = summary.city_streets.get(city)
+            if index is None:
+                import addr_streets # pylint: disable=C0415
+                index = summary.city_streets[city] = addr_streets.StreetIndex()
+            index.add(street)
+        if summary.street_numbers is not None and housenumber and not coordinate_errors:
+            summary.street_numbers.setdefault((street, city), []).append(
+                (housenumber, location[0], location[1]))
+    if unit:
+        summary.units.add(unit)
+    if errors:
+        print(f'{repr(housenumber)} | {repr(street)} | {repr(city)} | {repr(postcode)} '
+              f'| {repr(unit)}')
+        for error in errors:
+            print('    ' + error)
+
+class QcSink(addr_pipeline.Sink):
+    """ Pipeline sink (see addr_pipeline) which checks each record written to it,
+    and prints the reports when closed.
+    """
+    stage = 'check'
+
+    # pylint: disable=R0913
+    def __init__(self, zips, count_duplicates=True, bbox=None, boundary=None,
+                 indexes=(None, None), near_streets=False, max_memory=None,
+                 house_numbers=False):
+        self.zips = zips
+        self.summary = QcSummary(count_duplicates, near_streets, max_memory,
+                                 house_numbers=house_numbers)
+        self.bbox = bbox
+        self.boundary = boundary
+        self.indexes = indexes
+
+    def check_batch(self, batch):
+        """ Checks a batch of records, returning a list of the (location,
+        coordinate errors, findings) of each record (see check_coordinates()
+        and find_errors()).
+        """
+        locations, errors = check_coordinates(batch, self.bbox, self.boundary)
+        # The municipality and ZCTA of each location, looked up for the whole batch
+        areas = [index.lookup(locations) if index else [None] * len(batch)
+                 for index in self.indexes]
+        return [(location, coordinate_errors,
+                 find_errors(record, self.zips, coordinate_errors, (city_area, postcode_area)))
+                for record, location, coordinate_errors, city_area, postcode_area
+                in zip(batch, locations, errors, *areas)]
+
+    def write(self, batch):
+        for location, coordinate_errors, findings in self.check_batch(batch):
+            if findings:
+                add_findings(self.summary, findings, location, coordinate_errors)
+
+    def close(self):
+        with STATS.timer('report'):
+            print_report(self.summary)
+        self.summary.addrs.close()
+        self.summary.locations.close()
+
+class CachedQcSink(QcSink):
+    """ A QcSink which only checks the streets whose results are not in the
+    cache file (see addr_cache), and merges their results with those of the
+    other streets found in the cache.  Its output is the same as that of a
+    QcSink, but the errors of the nodes are only printed once all of the
+    records have been written, as the records of each street are checked
+    together, and so all of the records are kept in memory until then.  The
+    results of the streets not written are dropped from the cache, so that it
+    only holds those of the last run.
+
+    Parameters:
+        cache_file - (in) The cache.
+        check_context - (in) The context of the checks (see
+            addr_cache.context()).
+        The other parameters are those of QcSink.
+    """
+    def __init__(self, cache_file, check_context, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_file = cache_file
+        self.check_context = check_context
+        self.records = []
+
+    def write(self, batch):
+        self.records.extend(batch)
+
+    def close(self):
+        import addr_cache # pylint: disable=C0415
+        streets = {}
+        for index, record in enumerate(self.records):
+            streets.setdefault(record.get('addr:street'), []).append(index)
+        with STATS.timer('hash', len(self.records)):
+            digests = {street: addr_cache.street_digest([self.records[index]
+                                                         for index in indexes],
+                                                        self.check_context)
+                       for street, indexes in streets.items()}
+        cache = addr_cache.QcCache(self.cache_file)
+        try:
+            with STATS.timer('read cache'):
+                cached = cache.get(digests.values())
+            results = [None] * len(self.records)
+            checked = {}
+            for street, indexes in streets.items():
+                street_results = cached.get(digests[street])
+                STATS.cache('qc street', street_results is not None)
+                if street_results is None:
+                    with STATS.timer('check', len(indexes)):
+                        street_results = self.check_batch([self.records[index]
+                                                           for index in indexes])
+                    checked[digests[street]] = street_results
+                for index, result in zip(indexes, street_results):
+                    results[index] = result
+            with STATS.timer('write cache'):
+                cache.put(checked)
+                cache.keep_only(digests.values())
+        finally:
+            cache.close()
+        for location, coordinate_errors, findings in results:
+            if findings:
+                add_findings(self.summary, findings, location, coordinate_errors)
+        super().close()
+
+def print_report(summary):
+    """ Prints the lists of duplicates, cities, postcodes, streets, units and
+    the error summary.
+    """
+    cities = summary.cities
+    postcodes = summary.postcodes
+    streets = summary.streets
+    addrs = summary.addrs
+    all_errors = summary.all_errors
+    locations = summary.locations
+    units = summary.units
     print()
     print('List of duplicate addresses')
     total_dups = 0
@@ -292,6 +753,13 @@ def main():
     for street, count in sorted(streets.items(), key=lambda x: x[0].upper()):
         print(f'    {street:.<35}{count:.>5}')
     print()
+    if summary.city_streets is not None:
+        print('Possibly the same streets')
+        for city, index in sorted(summary.city_streets.items(),
+                                  key=lambda x: (x[0] or '').upper()):
+            for names in index.near_duplicates():
+                print(f'    {city or "(no city)"} | {" | ".join(names)}')
+        print()
     print('List of units found in data')
     for unit in sorted(units, key=lambda x: x.upper()):
         print(f'    {unit}')
@@ -302,11 +770,23 @@ def main():
             msg = f'Multiple features in same location {loc[0]}, {loc[1]}'
             print(f'    {msg:.<75}{count:.>5}')
     print()
+    if summary.street_numbers is not None:
+        import addr_housenumbers # pylint: disable=C0415
+        print('House numbers along each street')
+        for (street, city), addresses in sorted(summary.street_numbers.items(),
+                                                key=lambda x: (x[0][0].upper(),
+                                                               (x[0][1] or '').upper())):
+            for housenumber, lat, lon, msg in addr_housenumbers.check_street(addresses):
+                all_errors.add(msg)
+                print(f'    {housenumber} | {street} | {city} | {lat}, {lon}')
+                print(f'        {msg}')
+        print()
     print('Error summary')
     for error, count in sorted(all_errors.items(), key=lambda x: x[0]):
         print(f'    {error:.<75}{count:.>5}')
     print(f'    {"Duplicate addresses, total features":.<75}{total_dups:.>}')
     print(f'    {"Duplicate addresses, sets":.<75}{dup_sets:.>5}')
 
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_qc module.  The reports as a whole are covered by
+golden_test.py, and the coordinate checks by addr_boundary_test.py.
+
+Usage:
+$ python3 addr_qc_test.py
+
+"""
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+import addr_qc
+from addr_stats import STATS
+
+class SpillingCountingSetTestCase(unittest.TestCase):
+    def test_same_as_counting_set(self):
+        rand = random.Random(6)
+        items = [(str(rand.randint(1, 400)), rand.choice(['MAIN STREET', None]))
+                 for _ in range(3000)] + [(38.1, -79.0)] * 5
+        expected = addr_qc.CountingSet()
+        spilling = addr_qc.SpillingCountingSet(50)
+        for item in items:
+            count = rand.randint(1, 3)
+            expected.add(item, count)
+            spilling.add(item, count)
+        try:
+            self.assertIsNotNone(spilling._work_dir) # pylint: disable=W0212
+            self.assertEqual(list(spilling.items()), list(expected.items()))
+            self.assertEqual(len(spilling), len(expected))
+            self.assertEqual(spilling.total_count, expected.total_count)
+        finally:
+            spilling.close()
+
+    def test_in_memory(self):
+        spilling = addr_qc.SpillingCountingSet(10)
+        for item in ['b', 'a', 'b']:
+            spilling.add(item)
+        self.assertEqual(list(spilling.items()), [('b', 2), ('a', 1)])
+        self.assertIsNone(spilling._work_dir) # pylint: disable=W0212
+        spilling.close()
+
+def records(oak_city='Staunton'):
+    """ Returns the records of a few streets with some errors, the address on
+    Oak Lane being in oak_city.
+    """
+    return [{'@id': '-1', '@lat': '38.1', '@lon': '-79.0', 'addr:housenumber': '1',
+             'addr:street': 'Main Street', 'addr:city': 'Staunton', 'addr:postcode': '24401'},
+            {'@id': '-2', '@lat': '38.1', '@lon': '-79.0', 'addr:housenumber': '2',
+             'addr:street': 'OAK LANE', 'addr:city': oak_city},
+            {'@id': '5', '@lat': '38.2', '@lon': '-79.0', 'addr:housenumber': '3',
+             'addr:street': 'Main Street'},
+            {'@id': '-3', '@lat': '38.3', '@lon': '-79.1', 'addr:housenumber': '1',
+             'addr:street': 'Main Street ', 'addr:city': 'STAUNTON', 'addr:postcode': '24401'}]
+
+class CacheTestCase(unittest.TestCase):
+    ZIPS = {'24401': {'cities': ['STAUNTON'], 'type': 'STANDARD'}}
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory() # pylint: disable=R1732
+        self.cache = os.path.join(self.work_dir.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def report(self, sink, batch):
+        """ Returns the output of a sink for the batch """
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with sink:
+                sink.write(batch)
+        return output.getvalue()
+
+    def test_cache(self):
+        context = ('test',)
+        for oak_city in ['Staunton', 'Waynesboro']:
+            expected = self.report(addr_qc.QcSink(self.ZIPS), records(oak_city))
+            STATS.reset()
+            self.assertEqual(self.report(addr_qc.CachedQcSink(self.cache, context, self.ZIPS),
+                                         records(oak_city)), expected)
+        # Only Oak Lane changed
+        self.assertEqual((STATS.cache_hits, STATS.cache_misses),
+                         ({'qc street': 2}, {'qc street': 1}))
+        # The results of Oak Lane in Staunton were dropped
+        self.assertEqual(self.cached_streets(), 3)
+        STATS.reset()
+        self.report(addr_qc.CachedQcSink(self.cache, ('other',), self.ZIPS), records())
+        self.assertEqual(STATS.cache_misses, {'qc street': 3})
+        self.assertEqual(self.cached_streets(), 3)
+
+    def cached_streets(self):
+        """ Returns the number of streets whose results are in the cache """
+        connection = sqlite3.connect(self.cache)
+        try:
+            return connection.execute('SELECT COUNT(*) FROM streets').fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_max_memory(self):
+        # The cached checks keep all of the records in memory
+        with self.assertRaises(ValueError):
+            addr_qc.qc_file('missing.osm', max_memory=10, cache=self.cache)
+        self.assertFalse(os.path.exists(self.cache))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+""" addr_record - A compact record type for normalized addresses.
+
+The normalizers (addr_prep.normalize_row() and co_addr_prep.normalize_feature())
+produce an AddrRecord rather than a dictionary for each address.  An AddrRecord
+keeps the usual address tags in __slots__ rather than in a per-record
+dictionary, and interns the strings that repeat from one address to the next
+(street, city, state, postcode and unit label), so that a multi-million address
+run holds one copy of each street name rather than one per address.
+
+An AddrRecord behaves like the dictionaries used for other records (see
+addr_pipeline): it is indexed by OSM tag (e.g. record['addr:street']) or by the
+'@' keys ('@lat', '@lon', '@id', '@fid'), a tag whose value is None is absent, and any
+other keys are kept in a small dictionary created only when needed.  The order
+in which the keys are returned by items() is given by the class attribute KEYS,
+so that a program can keep the tag order of its output files by using a
+subclass with a different KEYS.
+"""
+from collections.abc import MutableMapping
+import sys
+
+# The attribute in which each key is kept.
+KEY_SLOTS = {
+    'name': 'name',
+    'addr:housenumber': 'housenumber',
+    'addr:street': 'street',
+    'addr:unit:label': 'unit_label',
+    'addr:unit': 'unit',
+    'addr:city': 'city',
+    'addr:state': 'state',
+    'addr:postcode': 'postcode',
+    '@lat': 'lat',
+    '@lon': 'lon',
+    '@id': 'id',
+    '@fid': 'fid',
+}
+SLOTS = tuple(KEY_SLOTS.values())
+# The attributes whose values are interned, as they are shared by many addresses.
+INTERNED = frozenset(('street', 'unit_label', 'city', 'state', 'postcode'))
+
+def _intern(value):
+    """ Interns value if it is a string """
+    return sys.intern(value) if isinstance(value, str) else value
+
+class AddrRecord(MutableMapping):
+    """ A normalized address, with the same interface as a dictionary of OSM tags.
+    The keyword arguments are the attributes listed in SLOTS, plus any other keys
+    as a dictionary in extra.
+    """
+    __slots__ = SLOTS + ('extra',)
+    KEYS = tuple(KEY_SLOTS)
+
+    def __init__(self, name=None, housenumber=None, street=None, unit_label=None, unit=None,
+                 city=None, state=None, postcode=None, lat=None, lon=None, id=None, fid=None,
+                 extra=None):
+        # pylint: disable=R0913, W0622
+        self.name = name
+        self.housenumber = housenumber
+        self.street = _intern(street)
+        self.unit_label = _intern(unit_label)
+        self.unit = unit
+        self.city = _intern(city)
+        self.state = _intern(state)
+        self.postcode = _intern(postcode)
+        self.lat = lat
+        self.lon = lon
+        self.id = id
+        self.fid = fid
+        self.extra = extra or None
+
+    def __getitem__(self, key):
+        slot = KEY_SLOTS.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            if value is None:
+                raise KeyError(key)
+            return value
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def get(self, key, default=None):
+        slot = KEY_SLOTS.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            return default if value is None else value
+        if self.extra is None:
+            return default
+        return self.extra.get(key, default)
+
+    def __contains__(self, key):
+        slot = KEY_SLOTS.get(key)
+        if slot is not None:
+            return getattr(self, slot) is not None
+        return self.extra is not None and key in self.extra
+
+    def __setitem__(self, key, value):
+        slot = KEY_SLOTS.get(key)
+        if slot is not None:
+            setattr(self, slot, _intern(value) if slot in INTERNED else value)
+        elif self.extra is None:
+            self.extra = {key: value}
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        slot = KEY_SLOTS.get(key)
+        if slot is not None:
+            setattr(self, slot, None)
+        else:
+            del self.extra[key]
+
+    def __iter__(self):
+        for key in self.KEYS:
+            if getattr(self, KEY_SLOTS[key]) is not None:
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return (sum(getattr(self, slot) is not None for slot in SLOTS) +
+                (len(self.extra) if self.extra is not None else 0))
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self.items())!r})'
+
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, slot) for slot in AddrRecord.__slots__))
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_record module.
+
+Usage:
+$ python3 addr_record_test.py
+
+"""
+import pickle
+import unittest
+import addr_record
+
+class AddrRecordTestCase(unittest.TestCase):
+    def make_record(self):
+        return addr_record.AddrRecord(housenumber='12', street=''.join(['Main', ' Street']),
+                                      unit='', city='Staunton', lat='38.1', lon='-79.0')
+
+    def test_mapping(self):
+        record = self.make_record()
+        self.assertEqual(record['addr:street'], 'Main Street')
+        self.assertEqual(record.get('addr:unit'), '')
+        self.assertNotIn('addr:postcode', record)
+        self.assertIsNone(record.get('addr:postcode'))
+        with self.assertRaises(KeyError):
+            _ = record['name']
+        record['@id'] = '-1'
+        record['@action'] = 'modify'
+        self.assertEqual(list(record.items()),
+                         [('addr:housenumber', '12'), ('addr:street', 'Main Street'),
+                          ('addr:unit', ''), ('addr:city', 'Staunton'), ('@lat', '38.1'),
+                          ('@lon', '-79.0'), ('@id', '-1'), ('@action', 'modify')])
+        self.assertEqual(len(record), 8)
+        del record['@action']
+        self.assertEqual(record, {'addr:housenumber': '12', 'addr:street': 'Main Street',
+                                  'addr:unit': '', 'addr:city': 'Staunton', '@lat': '38.1',
+                                  '@lon': '-79.0', '@id': '-1'})
+
+    def test_interned(self):
+        self.assertIs(self.make_record().street, self.make_record()['addr:street'])
+
+    def test_pickle(self):
+        record = self.make_record()
+        record['@fid'] = 7
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+
+if __name__ == '__main__':
+    unittest.main()
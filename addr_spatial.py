@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+""" addr_spatial - Orders addresses along a space filling curve, and cuts them
+into spatially compact tiles.
+
+The addresses are written in the order of the source (e.g. geodatabase FID
+order), which scatters neighbouring addresses throughout the output.  Sorting
+them by their position along a Hilbert curve (or the simpler Z-order curve)
+places addresses which are close to each other on the ground close to each
+other in the output, so that any run of consecutive addresses covers a small
+area.
+
+Both curves visit each quadrant of the world completely before moving on to
+the next, so the addresses within any quadtree cell are a contiguous range of
+the sorted addresses.  tiles() uses this to cut the sorted addresses into
+quadtree cells of at most max_size addresses each, by splitting only the cells
+which hold too many.
+
+Usage:
+    records = sort_records(records, 'hilbert')
+    for tile in tiles(records, 500, 'hilbert'):
+        ...
+"""
+import bisect
+
+# The number of bits of each coordinate used for the keys.  With 24 bits a
+# cell is about 2 m across, so only addresses at the same spot share a key.
+ORDER = 24
+# The number of bits of each coordinate handled by each lookup in HILBERT_TABLE
+_CHUNK = 4
+# The key of records without a location, beyond the keys of every location, so
+# that they are sorted after all of the others
+NO_LOCATION = 1 << 2 * ORDER
+
+def _hilbert_table():
+    """ Builds the state table for computing Hilbert keys _CHUNK bits at a time.
+    The state is the reflection (bit 0) and swap (bit 1) of the coordinates
+    made by the cells above the current level.  The entry for a state and the
+    next _CHUNK bits of x and y holds the next 2 * _CHUNK bits of the key and
+    the new state.
+    """
+    table = []
+    for state in range(4):
+        for x_bits in range(1 << _CHUNK):
+            for y_bits in range(1 << _CHUNK):
+                digits = 0
+                cur = state
+                for shift in range(_CHUNK - 1, -1, -1):
+                    x_bit = x_bits >> shift & 1
+                    y_bit = y_bits >> shift & 1
+                    if cur & 1:
+                        x_bit ^= 1
+                        y_bit ^= 1
+                    if cur & 2:
+                        x_bit, y_bit = y_bit, x_bit
+                    digits = digits << 2 | (3 * x_bit) ^ y_bit
+                    if y_bit == 0:
+                        cur ^= 2 | x_bit
+                table.append((digits, cur))
+    return table
+
+HILBERT_TABLE = _hilbert_table()
+
+def _spread_table():
+    """ Builds the table of each byte with a zero bit inserted above each of its
+    bits, for computing Z-order keys.
+    """
+    table = []
+    for value in range(256):
+        spread = 0
+        for bit in range(8):
+            spread |= (value >> bit & 1) << (2 * bit)
+        table.append(spread)
+    return table
+
+SPREAD_TABLE = _spread_table()
+
+def grid(lat, lon):
+    """ Returns the cell (x, y) of the 2**ORDER by 2**ORDER grid covering the world
+    which holds the location.
+    """
+    size = 1 << ORDER
+    x = int((float(lon) + 180.0) / 360.0 * size)
+    y = int((float(lat) + 90.0) / 180.0 * size)
+    return min(max(x, 0), size - 1), min(max(y, 0), size - 1)
+
+def hilbert_key(lat, lon):
+    """ Returns the position of the location along a Hilbert curve covering the
+    world.
+    """
+    x, y = grid(lat, lon)
+    table = HILBERT_TABLE
+    mask = (1 << _CHUNK) - 1
+    key = 0
+    state = 0
+    for shift in range(ORDER - _CHUNK, -1, -_CHUNK):
+        digits, state = table[(state << 2 * _CHUNK) | (x >> shift & mask) << _CHUNK |
+                              (y >> shift & mask)]
+        key = key << 2 * _CHUNK | digits
+    return key
+
+def zorder_key(lat, lon):
+    """ Returns the position of the location along a Z-order (Morton) curve
+    covering the world, which is its x and y cell with their bits interleaved.
+    """
+    x, y = grid(lat, lon)
+    table = SPREAD_TABLE
+    key = 0
+    for shift in range(ORDER - 8, -1, -8):
+        key = key << 16 | table[x >> shift & 0xff] << 1 | table[y >> shift & 0xff]
+    return key
+
+CURVES = {'hilbert': hilbert_key, 'zorder': zorder_key}
+
+def record_key(curve):
+    """ Returns a function giving the key of a record (from its '@lat' and '@lon')
+    along the named curve ('hilbert' or 'zorder').
+    """
+    key = CURVES[curve]
+    def location_key(record):
+        lat = record.get('@lat')
+        lon = record.get('@lon')
+        if lat is None or lon is None or str(lat).strip() == '' or str(lon).strip() == '':
+            return NO_LOCATION
+        return key(lat, lon)
+    return location_key
+
+def sort_records(records, curve='hilbert'):
+    """ Returns a list of the records sorted along the named curve.  Records at
+    the same location keep their order.
+    """
+    return sorted(records, key=record_key(curve))
+
+def tiles(records, max_size, curve='hilbert'):
+    """ Cuts the records into tiles of at most max_size records each, returning a
+    list of the tiles (lists of records) in the order of the curve.  Each tile
+    is a cell of a quadtree, split only as far as needed to meet max_size, so
+    that sparse areas get a few large tiles and dense areas many small ones.
+    More than max_size records at the same location are cut into several tiles.
+    The records without a location are cut into the last tiles.
+    """
+    key = record_key(curve)
+    keyed = sorted(((key(record), index, record) for index, record in enumerate(records)),
+                   key=lambda item: item[:2])
+    keys = [item[0] for item in keyed]
+    located = bisect.bisect_left(keys, NO_LOCATION)
+    ranges = []
+    def split(start, end, level):
+        # The records from start to end are those within a cell at level, which
+        # holds a range of 4**(ORDER - level) keys.
+        if end - start <= max_size:
+            if end > start:
+                ranges.append((start, end))
+            return
+        if level == ORDER:
+            ranges.extend((pos, min(pos + max_size, end)) for pos in range(start, end, max_size))
+            return
+        quarter = 1 << 2 * (ORDER - level - 1)
+        first = keys[start] // (4 * quarter) * 4 * quarter
+        for part in range(4):
+            part_end = bisect.bisect_left(keys, first + (part + 1) * quarter, start, end)
+            split(start, part_end, level + 1)
+            start = part_end
+    split(0, located, 0)
+    ranges.extend((pos, min(pos + max_size, len(keyed)))
+                  for pos in range(located, len(keyed), max_size))
+    return [[item[2] for item in keyed[start:end]] for start, end in ranges]
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_spatial module.
+
+Usage:
+$ python3 addr_spatial_test.py
+
+"""
+import random
+import unittest
+import addr_spatial
+
+def reference_hilbert(size, x, y):
+    """ The Hilbert curve position of cell (x, y) in a size by size grid, computed
+    one bit at a time (see https://en.wikipedia.org/wiki/Hilbert_curve).
+    """
+    key = 0
+    step = size // 2
+    while step > 0:
+        x_bit = 1 if x & step else 0
+        y_bit = 1 if y & step else 0
+        key += step * step * ((3 * x_bit) ^ y_bit)
+        if y_bit == 0:
+            if x_bit == 1:
+                x = size - 1 - x
+                y = size - 1 - y
+            x, y = y, x
+        step //= 2
+    return key
+
+def random_records(count, seed=1):
+    """ Returns count records at random locations around Staunton, VA """
+    rand = random.Random(seed)
+    return [{'@lat': rand.uniform(38.0, 38.3), '@lon': rand.uniform(-79.2, -78.9), 'n': n}
+            for n in range(count)]
+
+class SpatialTestCase(unittest.TestCase):
+    def test_keys(self):
+        rand = random.Random(2)
+        size = 1 << addr_spatial.ORDER
+        for _ in range(500):
+            lat = rand.uniform(-90, 90)
+            lon = rand.uniform(-180, 180)
+            x, y = addr_spatial.grid(lat, lon)
+            self.assertEqual(addr_spatial.hilbert_key(lat, lon), reference_hilbert(size, x, y))
+            zorder = 0
+            for bit in range(addr_spatial.ORDER):
+                zorder |= (x >> bit & 1) << (2 * bit + 1) | (y >> bit & 1) << (2 * bit)
+            self.assertEqual(addr_spatial.zorder_key(str(lat), str(lon)), zorder)
+        self.assertEqual(addr_spatial.grid(90, 180), (size - 1, size - 1))
+
+    def test_sort(self):
+        records = random_records(1000)
+        for curve in addr_spatial.CURVES:
+            ordered = addr_spatial.sort_records(records, curve)
+            self.assertEqual(sorted(record['n'] for record in ordered), list(range(1000)))
+            # Consecutive addresses are much closer than in the input order
+            def path(records):
+                return sum(abs(a['@lat'] - b['@lat']) + abs(a['@lon'] - b['@lon'])
+                           for a, b in zip(records, records[1:]))
+            self.assertLess(path(ordered), path(records) / 10)
+
+    def test_tiles(self):
+        records = random_records(2000)
+        # Many addresses at the same spot, which can only be cut by count
+        records += [{'@lat': 38.1, '@lon': -79.0, 'n': 2000 + n} for n in range(120)]
+        for curve in addr_spatial.CURVES:
+            tiles = addr_spatial.tiles(records, 100, curve)
+            self.assertTrue(all(0 < len(tile) <= 100 for tile in tiles))
+            self.assertEqual(sorted(record['n'] for tile in tiles for record in tile),
+                             list(range(2120)))
+            # Each tile is a quadtree cell, so the bounding boxes of the tiles do
+            # not overlap
+            boxes = []
+            for tile in tiles:
+                cells = [addr_spatial.grid(record['@lat'], record['@lon']) for record in tile]
+                boxes.append((min(x for x, _ in cells), min(y for _, y in cells),
+                              max(x for x, _ in cells), max(y for _, y in cells)))
+            boxes = sorted(set(boxes))
+            self.assertGreater(len(boxes), 20)
+            for index, box in enumerate(boxes):
+                for other in boxes[index + 1:]:
+                    self.assertTrue(box[2] < other[0] or other[2] < box[0] or
+                                    box[3] < other[1] or other[3] < box[1], (box, other))
+        self.assertEqual(addr_spatial.tiles([], 100), [])
+
+    def test_no_location(self):
+        records = random_records(250)
+        unlocated = [{'n': 250}, {'@lat': '', '@lon': '', 'n': 251},
+                     {'@lat': '38.1', 'n': 252}, {'@lat': ' ', '@lon': '-79.0', 'n': 253}]
+        records = unlocated[:2] + records + unlocated[2:]
+        for curve in addr_spatial.CURVES:
+            ordered = addr_spatial.sort_records(records, curve)
+            self.assertEqual([record['n'] for record in ordered[-4:]], [250, 251, 252, 253])
+            tiles = addr_spatial.tiles(records, 3, curve)
+            self.assertEqual(sorted(record['n'] for tile in tiles for record in tile),
+                             list(range(254)))
+            self.assertEqual([[record['n'] for record in tile] for tile in tiles[-2:]],
+                             [[250, 251, 252], [253]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,48 +1,52 @@
 #!/usr/bin/python3
-import re
-import copy
-import csv
-import sys
+import argparse
+import addr_pipeline
+import addr_stats
+import addr_store
 
 
 def main():
-    addr_input = sys.argv[1]
-    county = sys.argv[2]
-    split_county(addr_input, county)
-
-def split_county(addr_input, county):
+    parser = argparse.ArgumentParser(
+        prog='addr_split',
+        description='Makes a file of the addresses of a single county from the Virginia '
+        'statewide address file.')
+    parser.add_argument('input_file', help='the statewide address file')
+    parser.add_argument('county', help='the county (or city) to extract')
+    addr_pipeline.add_args(parser)
+    addr_stats.add_args(parser)
+    addr_store.add_args(parser)
+    args = parser.parse_args()
+    addr_stats.run(split_county, args, args.input_file, args.county, args.threads, args.store)
+
+def split_county(addr_input, county, threads=False, store=None):
     """ Makes a file of just the data from a single county.  The format is the same
     as that of the input file, with the exception that latitude and longitude are
-    added so that the data can be visualized in JOSM.
+    added so that the data can be visualized in JOSM.  If a store is given, the
+    rows are also written to its raw layer (see addr_store).  If threads is True,
+    reading and writing are done in separate threads, which helps when the files
+    are on network storage.
     """
     out_file_name = county.lower().replace(' county','') + '_raw.csv'
-    with open(addr_input, newline='') as csvfile:
-        addr_reader = csv.DictReader(csvfile)
-        with open(out_file_name, 'w', newline='') as csvfile_out:
-            field_names = copy.deepcopy(addr_reader.fieldnames)
-            field_names.append('latitude')
-            field_names.append('longitude')
-            writer = csv.DictWriter(csvfile_out, fieldnames=field_names)
-            writer.writeheader()
-            county = county.upper()
-            for row in addr_reader:
-                # Unlike the rest of the file, it seems that the 'MUNICIPALITY' field's
-                # contents are in title case, but we don't take any chances and force
-                # an uppercase comparison.
-                if row['MUNICIPALITY'].upper() == county:
-                    new_row = {}
-                    for key, value in row.items():
-                        new_row[key] = value
-                    new_row['latitude'] = row['LAT']
-                    new_row['longitude'] = row['LONG']
-                    writer.writerow(new_row)
-
-
+    field_names = addr_pipeline.csv_field_names(addr_input) + ['latitude', 'longitude']
+    # Unlike the rest of the file, it seems that the 'MUNICIPALITY' field's
+    # contents are in title case, but we don't take any chances and csv_source
+    # uses an uppercase comparison.  The rows of other counties are still parsed,
+    # but are dropped before a record is made of them.
+    batches = addr_pipeline.read_ahead(
+        addr_pipeline.csv_source(addr_input, where=('MUNICIPALITY', county)), threads)
+    sink = addr_pipeline.CsvSink(out_file_name, field_names,
+                                 {'latitude': 'LAT', 'longitude': 'LONG'})
+    sinks = [addr_pipeline.write_behind(sink, threads)]
+    if store:
+        sinks.append(addr_pipeline.write_behind(
+            addr_store.StoreSink(store, addr_store.RAW_LAYER, addr_input, 'LAT', 'LONG'),
+            threads))
+    try:
+        addr_pipeline.drain(batches, *sinks)
+    finally:
+        for sink in sinks:
+            sink.close()
 
 
 if __name__ == '__main__':
-
-
-    #summarize()
-    #split_county()
     main()
@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+""" addr_stats - Timing and counter instrumentation shared by the address programs.
+
+Each program records the time spent in each stage of its work (e.g. read,
+normalize, dedupe, write), the number of rows handled by each stage, cache hits
+and misses, and counts of noteworthy events (such as unrecognized
+abbreviations) in the module level STATS object.  At the end of the run the
+summary can be printed in human readable form, or as JSON.
+
+Usage, within a program:
+    parser = argparse.ArgumentParser()
+    addr_stats.add_args(parser)
+    args = parser.parse_args()
+    addr_stats.run(work, args)
+
+where work is the function that does the actual work.  Within the program:
+    with STATS.timer('normalize'):
+        ...
+    for row in STATS.timed_iter(reader, 'read'):
+        ...
+    STATS.count('unhandled street type: XYZ')
+"""
+import contextlib
+import json
+import sys
+import threading
+import time
+
+class Stats():
+    """ Accumulates timings, row counts, cache statistics and counters for a run.
+    The stages of a pipeline may run in several threads (see addr_pipeline), so
+    each update is made holding a lock.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.stage_times = {}
+        self.stage_rows = {}
+        self.cache_hits = {}
+        self.cache_misses = {}
+        self.counters = {}
+
+    def reset(self):
+        """ Discards everything recorded so far.
+        """
+        self.__init__()
+
+    def add_time(self, stage, seconds, rows=0):
+        """ Adds the given number of seconds, and optionally rows, to a stage.
+        """
+        with self.lock:
+            self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+            if rows:
+                self.stage_rows[stage] = self.stage_rows.get(stage, 0) + rows
+
+    def add_rows(self, stage, rows=1):
+        """ Adds to the number of rows handled by a stage without adding any time.
+        """
+        with self.lock:
+            self.stage_rows[stage] = self.stage_rows.get(stage, 0) + rows
+
+    @contextlib.contextmanager
+    def timer(self, stage, rows=0):
+        """ A context manager which adds the time spent within it to a stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, rows)
+
+    def timed_iter(self, iterable, stage):
+        """ A generator which yields the items of iterable, adding the time spent
+        producing each one (e.g. reading and parsing) to the given stage, and
+        counting each item as a row.
+        """
+        iterator = iter(iterable)
+        perf_counter = time.perf_counter
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, perf_counter() - start)
+                return
+            self.add_time(stage, perf_counter() - start, 1)
+            yield item
+
+    def cache(self, name, hit):
+        """ Records a hit (hit is True) or a miss in the named cache.
+        """
+        with self.lock:
+            if hit:
+                self.cache_hits[name] = self.cache_hits.get(name, 0) + 1
+            else:
+                self.cache_misses[name] = self.cache_misses.get(name, 0) + 1
+
+    def add_cache(self, name, hits, misses):
+        """ Adds a number of hits and misses to the named cache, for a cache
+        whose lookups are counted by the caller rather than each recorded.
+        """
+        with self.lock:
+            if hits:
+                self.cache_hits[name] = self.cache_hits.get(name, 0) + hits
+            if misses:
+                self.cache_misses[name] = self.cache_misses.get(name, 0) + misses
+
+    def count(self, name, increment=1):
+        """ Increments the named counter.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + increment
+
+    def summary(self):
+        """ Returns a dictionary summarizing everything recorded so far, suitable
+        for conversion to JSON.
+        """
+        with self.lock:
+            stages = {}
+            for stage in list(self.stage_times) + list(self.stage_rows):
+                if stage in stages:
+                    continue
+                seconds = self.stage_times.get(stage, 0.0)
+                rows = self.stage_rows.get(stage, 0)
+                rate = round(rows / seconds, 1) if seconds and rows else None
+                stages[stage] = {'seconds': round(seconds, 6), 'rows': rows,
+                                 'rows_per_second': rate}
+            caches = {}
+            for name in sorted(set(self.cache_hits) | set(self.cache_misses)):
+                hits = self.cache_hits.get(name, 0)
+                misses = self.cache_misses.get(name, 0)
+                caches[name] = {'hits': hits, 'misses': misses,
+                                'hit_rate': round(hits / (hits + misses), 4)}
+            return {'total_seconds': round(time.perf_counter() - self.start_time, 6),
+                    'stages': stages,
+                    'caches': caches,
+                    'counters': dict(sorted(self.counters.items()))}
+
+    def print_summary(self, stats_format='text', file=None):
+        """ Prints the summary either as text or as JSON (stats_format='json').
+        """
+        file = file or sys.stderr
+        summary = self.summary()
+        if stats_format == 'json':
+            json.dump(summary, file, indent=2)
+            print(file=file)
+            return
+        print('Timing', file=file)
+        for stage, stage_summary in summary['stages'].items():
+            rate = stage_summary['rows_per_second']
+            rate = f'{rate:>12.1f} rows/s' if rate is not None else ''
+            print(f'    {stage:.<30}{stage_summary["seconds"]:>10.3f} s'
+                  f'{stage_summary["rows"]:>10} rows{rate}', file=file)
+        print(f'    {"total":.<30}{summary["total_seconds"]:>10.3f} s', file=file)
+        if summary['caches']:
+            print('Caches', file=file)
+            for name, cache in summary['caches'].items():
+                print(f'    {name:.<30}{cache["hits"]:>10} hits{cache["misses"]:>10} misses'
+                      f'{cache["hit_rate"]:>8.1%}', file=file)
+        print_counters(summary['counters'], file)
+
+def print_counters(counters, file=None):
+    """ Prints the given counters, one per line, in the style of the addr_qc summaries.
+    """
+    if not counters:
+        return
+    file = file or sys.stdout
+    print('Counters', file=file)
+    for name, count in sorted(counters.items()):
+        print(f'    {name:.<75}{count:.>5}', file=file)
+
+STATS = Stats()
+
+def add_args(parser):
+    """ Adds the --stats and --profile options to an argparse.ArgumentParser
+    """
+    parser.add_argument('--stats', nargs='?', const='text', choices=['text', 'json'],
+                        help='print timing and counter statistics to stderr at the end of '
+                        'the run, either as text (the default) or as json')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='PROFILE_FILE',
+                        help='run under cProfile, and either print the top functions to '
+                        'stderr, or save the profile to PROFILE_FILE; only the main thread '
+                        'is profiled, so with --threads the reading and writing threads are '
+                        'not included')
+
+def run(func, args, *func_args):
+    """ Calls func(*func_args), under cProfile if requested with --profile, and then
+    prints the statistics if requested with --stats.  cProfile only profiles the
+    thread that calls func, so the reading and writing threads started with
+    --threads are left out of the profile; their time shows up in --stats instead.
+    """
+    STATS.reset()
+    try:
+        if getattr(args, 'profile', None):
+            # Only imported when profiling, as they are slow to import
+            # pylint: disable=C0415
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(func, *func_args)
+            finally:
+                if args.profile == '-':
+                    pstats.Stats(profiler, stream=sys.stderr).sort_stats(
+                        'cumulative').print_stats(30)
+                else:
+                    profiler.dump_stats(args.profile)
+        return func(*func_args)
+    finally:
+        if getattr(args, 'stats', None):
+            STATS.print_summary(args.stats)
@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_stats module.
+
+Usage:
+$ python3 addr_stats_test.py
+
+"""
+import sys
+import threading
+import unittest
+import addr_stats
+
+class StatsTestCase(unittest.TestCase):
+    def test_threads(self):
+        # The stages of a pipeline update the same Stats from several threads
+        stats = addr_stats.Stats()
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        def work():
+            for index in range(5000):
+                stats.add_time('read', 0.5, 1)
+                stats.add_rows('write')
+                stats.cache('street', index % 2 == 0)
+                stats.count('unhandled street type')
+                stats.summary()
+        try:
+            threads = [threading.Thread(target=work) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        summary = stats.summary()
+        self.assertEqual(summary['stages']['read'], {'seconds': 20000.0, 'rows': 40000,
+                                                     'rows_per_second': 2.0})
+        self.assertEqual(summary['stages']['write']['rows'], 40000)
+        self.assertEqual(summary['caches']['street'], {'hits': 20000, 'misses': 20000,
+                                                       'hit_rate': 0.5})
+        self.assertEqual(summary['counters'], {'unhandled street type': 40000})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+""" addr_store - An SQLite working store for the addresses passed between the
+programs.
+
+Rather than each program writing a .csv or .osm file which the next one reads
+and parses in full, the programs can write their output to, and read their
+input from, a single SQLite file (a "store", any file named .sqlite, .sqlite3
+or .db).  Each program writes to a named layer of the store, e.g. addr_split to
+'raw', and addr_prep and co_addr_prep to 'addresses', replacing the previous
+contents of that layer.
+
+All of the layers are kept in the one table, addresses, with a column for each
+of the usual address tags (see addr_pipeline.ADDRESS_TAGS), the location, the
+OSM id, the provenance of the address (its source file and feature id there)
+and any other keys as JSON.  The table is indexed on street, city and postcode
+and has an R-tree on the location, so that addr_qc can find the duplicate
+addresses and locations, and split_osm_addr_by_street the addresses of each
+street, with indexed queries rather than by holding everything in memory, and
+the addresses of an area can be read with store_source(bbox=...).
+
+Usage:
+    with StoreSink('work.sqlite', 'addresses', source='statewide.csv') as sink:
+        addr_pipeline.drain(batches, sink)
+    for batch in store_source('work.sqlite', 'addresses'):
+        ...
+"""
+import json
+import os
+import addr_pipeline
+from addr_stats import STATS
+
+# The extensions of the files which are treated as stores
+EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+# The layers written by the programs
+RAW_LAYER = 'raw'
+ADDRESS_LAYER = 'addresses'
+# The columns other than the tags, and the record key held in each
+ATTR_COLUMNS = {'osm_id': '@id', 'lat': '@lat', 'lon': '@lon', 'source_id': '@fid'}
+
+def add_args(parser):
+    """ Adds the --store option to an argparse.ArgumentParser
+    """
+    parser.add_argument('--store', metavar='STORE_FILE',
+                        help='also write the output to a layer of this SQLite working store '
+                        '(.sqlite), from which addr_qc.py and split_osm_addr_by_street.py '
+                        'can read it')
+
+def is_store(file_name):
+    """ Returns True if the file name is that of a store """
+    return os.path.splitext(file_name)[1].lower() in EXTENSIONS
+
+def quote(name):
+    """ Returns a column name quoted for SQL, as the tags contain ':' """
+    return '"' + name.replace('"', '""') + '"'
+
+def _upper(value):
+    """ The SQL function py_upper(), which, unlike SQLite's upper(), handles
+    non-ASCII letters as Python does.
+    """
+    return value.upper() if isinstance(value, str) else value
+
+def _strip(value):
+    """ The SQL function py_strip(), which, unlike SQLite's trim(), removes all
+    whitespace as Python does.
+    """
+    return value.strip() if isinstance(value, str) else value
+
+def connect(file_name, read_only=False, check_same_thread=True):
+    """ Opens (creating if needed) a store, returning the sqlite3.Connection.
+    With read_only, the store is opened for reading only, and FileNotFoundError
+    is raised if there is none, rather than an empty store being created.
+    Unless check_same_thread is True, the connection may be used by threads
+    other than that which opened it, though only by one at a time.
+    """
+    # sqlite3 is imported here, as it takes longer to import than the rest of
+    # the module, which the programs import for add_args()
+    import sqlite3 # pylint: disable=C0415
+    if read_only:
+        if not os.path.exists(file_name):
+            raise FileNotFoundError(file_name)
+        # pylint: disable=C0415
+        import urllib.parse
+        connection = sqlite3.connect(
+            f'file:{urllib.parse.quote(os.path.abspath(file_name))}?mode=ro', uri=True)
+    else:
+        connection = sqlite3.connect(file_name, check_same_thread=check_same_thread)
+    connection.create_function('py_upper', 1, _upper, deterministic=True)
+    connection.create_function('py_strip', 1, _strip, deterministic=True)
+    if read_only:
+        return connection
+    tags = ''.join(f', {quote(tag)} TEXT' for tag in addr_pipeline.ADDRESS_TAGS)
+    connection.executescript(f'''
+        CREATE TABLE IF NOT EXISTS addresses (
+            id INTEGER PRIMARY KEY, layer TEXT NOT NULL, osm_id TEXT, source TEXT,
+            source_id TEXT, lat REAL, lon REAL{tags}, tags TEXT);
+        CREATE VIRTUAL TABLE IF NOT EXISTS addresses_rtree USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon);
+    ''')
+    return connection
+
+def create_indexes(connection):
+    """ Creates the indexes of the addresses table, if they do not exist yet.
+    They are created after the addresses are written, which is quicker than
+    updating them for each address.
+    """
+    connection.executescript('''
+        CREATE INDEX IF NOT EXISTS addresses_street
+            ON addresses (layer, "addr:street", "addr:city");
+        CREATE INDEX IF NOT EXISTS addresses_city ON addresses (layer, "addr:city");
+        CREATE INDEX IF NOT EXISTS addresses_postcode ON addresses (layer, "addr:postcode");
+    ''')
+
+class StoreSink(addr_pipeline.Sink):
+    """ Writes records to a layer of a store, replacing its previous contents.
+
+    Parameters:
+        file_name - (in) The store.
+        layer - (in) The name of the layer.
+        source - (in) The name of the input, kept for provenance.
+        lat_key, lon_key - (in) The keys of the location in the records, e.g.
+            'LAT' and 'LONG' for records which have not been normalized.  Keys
+            other than the '@' keys and the tags, including these, are kept as
+            JSON, so that such records are read back unchanged.
+    """
+    # pylint: disable=R0913
+    def __init__(self, file_name, layer=ADDRESS_LAYER, source=None, lat_key='@lat',
+                 lon_key='@lon'):
+        # Wrapped in an addr_pipeline.ThreadedSink, the sink is written in the
+        # writing thread, but opened and closed (once that thread has ended) in
+        # the calling thread
+        self.connection = connect(file_name, check_same_thread=False)
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.layer = layer
+        self.source = source
+        self.lat_key = lat_key
+        self.lon_key = lon_key
+        self.tags = addr_pipeline.ADDRESS_TAGS
+        self.known = set(self.tags) | set(ATTR_COLUMNS.values())
+        self.connection.execute('DELETE FROM addresses_rtree WHERE id IN '
+                                '(SELECT id FROM addresses WHERE layer = ?)', (layer,))
+        self.connection.execute('DELETE FROM addresses WHERE layer = ?', (layer,))
+        self.next_id = self.connection.execute(
+            'SELECT COALESCE(MAX(id), 0) + 1 FROM addresses').fetchone()[0]
+        columns = ['id', 'layer', 'source', 'osm_id', 'source_id', 'lat', 'lon'] + \
+            self.tags + ['tags']
+        self.insert = (f'INSERT INTO addresses ({", ".join(quote(c) for c in columns)}) '
+                       f'VALUES ({", ".join("?" * len(columns))})')
+
+    def write(self, batch):
+        rows = []
+        locations = []
+        for record in batch:
+            row_id = self.next_id
+            self.next_id += 1
+            lat = record.get(self.lat_key)
+            lon = record.get(self.lon_key)
+            lat = float(lat) if lat not in (None, '') else None
+            lon = float(lon) if lon not in (None, '') else None
+            source_id = record.get('@fid')
+            extra = {key: value for key, value in record.items() if key not in self.known}
+            rows.append([row_id, self.layer, self.source, record.get('@id'),
+                         None if source_id is None else str(source_id), lat, lon] +
+                        [record.get(tag) for tag in self.tags] +
+                        [json.dumps(extra) if extra else None])
+            if lat is not None and lon is not None:
+                locations.append((row_id, lat, lat, lon, lon))
+        self.connection.executemany(self.insert, rows)
+        self.connection.executemany('INSERT INTO addresses_rtree VALUES (?, ?, ?, ?, ?)',
+                                    locations)
+
+    def close(self):
+        with STATS.timer('index'):
+            create_indexes(self.connection)
+        self.connection.commit()
+        self.connection.close()
+
+def _records(cursor, keys=None):
+    """ A generator function which yields the rows of a query of the addresses
+    table (selecting osm_id, lat, lon, source_id, the tags and tags) as records.
+    Only the given keys (by default all) are included, other than the '@' keys.
+    """
+    names = list(ATTR_COLUMNS.values()) + addr_pipeline.ADDRESS_TAGS
+    for row in cursor:
+        record = {name: value for name, value in zip(names, row) if value is not None}
+        if row[-1] is not None:
+            record.update(json.loads(row[-1]))
+        if keys is not None:
+            record = {key: value for key, value in record.items()
+                      if key[0] == '@' or key in keys}
+        yield record
+
+def _select():
+    """ Returns the start of a query of the addresses table for _records() """
+    columns = list(ATTR_COLUMNS) + addr_pipeline.ADDRESS_TAGS + ['tags']
+    return f'SELECT {", ".join(quote(column) for column in columns)} FROM addresses'
+
+def store_source(file_name, layer=ADDRESS_LAYER, keys=None, bbox=None,
+                 batch_size=addr_pipeline.BATCH_SIZE):
+    """ Reads the records of a layer of a store, in the order in which they were
+    written, yielding batches of records.
+
+    Parameters:
+        file_name - (in) The store.
+        layer - (in) The name of the layer.
+        keys - (in) The tags to read, by default all.
+        bbox - (in) Optional (min_lat, min_lon, max_lat, max_lon), to read only
+            the records within it, using the R-tree.
+        batch_size - (in) The maximum number of records in each batch.
+    """
+    # pylint: disable=R0913
+    connection = connect(file_name, read_only=True)
+    try:
+        query = _select() + ' WHERE layer = ?'
+        params = [layer]
+        if bbox is not None:
+            query += (' AND id IN (SELECT id FROM addresses_rtree WHERE min_lat >= ? AND '
+                      'max_lat <= ? AND min_lon >= ? AND max_lon <= ?)')
+            params += [bbox[0], bbox[2], bbox[1], bbox[3]]
+        cursor = connection.execute(query + ' ORDER BY id', params)
+        yield from addr_pipeline.batched(_records(cursor, keys), batch_size)
+    finally:
+        connection.close()
+
+# The expression giving each part of the address compared by addr_qc, and
+# whether an address is new (only new addresses are checked).
+_QC_ADDRESS = ('py_upper(NULLIF("addr:housenumber", \'\')), '
+               'py_upper(NULLIF(py_strip("addr:street"), \'\')), '
+               'py_upper(NULLIF(py_strip("addr:city"), \'\')), '
+               'py_upper(NULLIF("addr:postcode", \'\')), '
+               'py_upper(NULLIF("addr:unit", \'\'))')
+_NEW = '(osm_id IS NULL OR CAST(osm_id AS INTEGER) < 0)'
+
+def duplicate_addresses(file_name, layer=ADDRESS_LAYER):
+    """ Returns a list of the (address, count) of each address of the new nodes
+    of a layer found more than once, in the order in which they were first
+    written.  The address is (housenumber, street, city, postcode, unit) in
+    upper case, as compared by addr_qc.
+    """
+    with STATS.timer('duplicate query'):
+        connection = connect(file_name, read_only=True)
+        try:
+            return [(tuple(row[:5]), row[5]) for row in connection.execute(
+                f'SELECT {_QC_ADDRESS}, COUNT(*), MIN(id) FROM addresses '
+                f'WHERE layer = ? AND {_NEW} GROUP BY 1, 2, 3, 4, 5 '
+                'HAVING COUNT(*) > 1 ORDER BY MIN(id)', (layer,))]
+        finally:
+            connection.close()
+
+def duplicate_locations(file_name, layer=ADDRESS_LAYER):
+    """ Returns a list of the ((lat, lon), count) of each location of the new
+    nodes of a layer found more than once, in the order in which they were first
+    written.
+    """
+    with STATS.timer('duplicate query'):
+        connection = connect(file_name, read_only=True)
+        try:
+            return [((row[0], row[1]), row[2]) for row in connection.execute(
+                f'SELECT lat, lon, COUNT(*), MIN(id) FROM addresses WHERE layer = ? AND {_NEW} '
+                'GROUP BY lat, lon HAVING COUNT(*) > 1 ORDER BY MIN(id)', (layer,))]
+        finally:
+            connection.close()
+
+def street_groups(file_name, layer=ADDRESS_LAYER):
+    """ A generator function which yields the name of the file written by
+    split_osm_addr_by_street for each street of a layer (see
+    addr_pipeline.street_file_name()), and a list of the records of that street
+    read using the street index.
+    """
+    connection = connect(file_name, read_only=True)
+    try:
+        groups = {}
+        for city, street in connection.execute(
+                'SELECT DISTINCT "addr:city", "addr:street" FROM addresses WHERE layer = ?',
+                (layer,)):
+            record = {'addr:city': city, 'addr:street': street}
+            groups.setdefault(addr_pipeline.street_file_name(record), []).append((city, street))
+        query = (_select() + ' WHERE layer = ? AND "addr:street" IS ? AND "addr:city" IS ? '
+                 'ORDER BY id')
+        for base_name, streets in groups.items():
+            records = []
+            for city, street in streets:
+                records.extend(_records(connection.execute(query, (layer, street, city))))
+            yield base_name, records
+    finally:
+        connection.close()
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_store module.  Reading the Castle Pines data back from
+a store for addr_qc and split_osm_addr_by_street is covered by golden_test.py.
+
+Usage:
+$ python3 addr_store_test.py
+
+"""
+import os
+import tempfile
+import unittest
+import addr_pipeline
+import addr_record
+import addr_store
+
+def read_layer(store, layer, **kwargs):
+    """ Returns the records of a layer of the store, as a list """
+    return [record for batch in addr_store.store_source(store, layer, **kwargs)
+            for record in batch]
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory() # pylint: disable=R1732
+        self.store = os.path.join(self.work_dir.name, 'work.sqlite')
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_layers(self):
+        raw = [{'ADDRNUM': '12', 'STREET_NAME': 'MAIN', 'LAT': '38.15', 'LONG': '-79.07'},
+               {'ADDRNUM': '3', 'STREET_NAME': 'OAK', 'LAT': '', 'LONG': ''}]
+        with addr_store.StoreSink(self.store, addr_store.RAW_LAYER, 'va.csv', 'LAT',
+                                  'LONG') as sink:
+            sink.write(raw)
+        prepped = [addr_record.AddrRecord(housenumber='12', street='Main Street',
+                                          city='Staunton', lat='38.15', lon='-79.07', fid=4),
+                   addr_record.AddrRecord(housenumber='40', street='Oak Lane', city='Staunton',
+                                          lat=38.3, lon=-79.2, id='-2')]
+        for _ in range(2):
+            # Writing a layer again replaces it
+            with addr_store.StoreSink(self.store, addr_store.ADDRESS_LAYER, 'va.csv') as sink:
+                sink.write(prepped)
+        self.assertEqual(read_layer(self.store, addr_store.RAW_LAYER),
+                         [dict(raw[0], **{'@lat': 38.15, '@lon': -79.07}), raw[1]])
+        self.assertEqual(read_layer(self.store, addr_store.ADDRESS_LAYER),
+                         [{'@lat': 38.15, '@lon': -79.07, '@fid': '4', 'addr:housenumber': '12',
+                           'addr:street': 'Main Street', 'addr:city': 'Staunton'},
+                          {'@id': '-2', '@lat': 38.3, '@lon': -79.2, 'addr:housenumber': '40',
+                           'addr:street': 'Oak Lane', 'addr:city': 'Staunton'}])
+        nearby = read_layer(self.store, addr_store.ADDRESS_LAYER, keys=['addr:street'],
+                            bbox=(38.1, -79.1, 38.2, -79.0))
+        self.assertEqual(nearby, [{'@lat': 38.15, '@lon': -79.07, '@fid': '4',
+                                   'addr:street': 'Main Street'}])
+
+    def test_threads(self):
+        # Written in the writing thread of an addr_pipeline.ThreadedSink
+        records = [{'addr:housenumber': str(number), 'addr:street': 'Main Street',
+                    '@lat': '38.1', '@lon': '-79.1'} for number in range(1, 1000, 2)]
+        with addr_pipeline.write_behind(addr_store.StoreSink(self.store), True) as sink:
+            for start in range(0, len(records), 100):
+                sink.write(records[start:start + 100])
+        self.assertEqual([record['addr:housenumber'] for record in
+                          read_layer(self.store, addr_store.ADDRESS_LAYER)],
+                         [record['addr:housenumber'] for record in records])
+
+    def test_queries(self):
+        records = [{'addr:housenumber': '1', 'addr:street': 'Main Street ', '@lat': '1',
+                    '@lon': '2', '@id': '-1'},
+                   {'addr:housenumber': '2', 'addr:street': 'Oak Lane', '@lat': '1',
+                    '@lon': '2', '@id': '-2'},
+                   {'addr:housenumber': '1', 'addr:street': 'main street', '@lat': '3',
+                    '@lon': '4', '@id': '-3'},
+                   # Existing nodes are not checked
+                   {'addr:housenumber': '2', 'addr:street': 'Oak Lane', '@lat': '5',
+                    '@lon': '6', '@id': '7'}]
+        with addr_store.StoreSink(self.store) as sink:
+            sink.write(records)
+        self.assertEqual(addr_store.duplicate_addresses(self.store),
+                         [(('1', 'MAIN STREET', None, None, None), 2)])
+        self.assertEqual(addr_store.duplicate_locations(self.store), [((1.0, 2.0), 2)])
+        groups = dict(addr_store.street_groups(self.store))
+        self.assertEqual(sorted(groups), ['NoCity__Main_Street', 'NoCity__Oak_Lane',
+                                          'NoCity__main_street'])
+        self.assertEqual([record['@id'] for record in groups['NoCity__Oak_Lane']], ['-2', '7'])
+
+    def test_missing_store(self):
+        # Reading a store which is not there does not create an empty one
+        for read in (read_layer, lambda store, layer: list(addr_store.street_groups(store)),
+                     lambda store, layer: addr_store.duplicate_addresses(store)):
+            with self.assertRaises(FileNotFoundError):
+                read(self.store, addr_store.ADDRESS_LAYER)
+        self.assertFalse(os.path.exists(self.store))
+
+if __name__ == '__main__':
+    unittest.main()
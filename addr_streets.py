@@ -0,0 +1,275 @@
+#!/usr/bin/python3
+""" addr_streets - An index of street names, for finding the variants of a
+street name, e.g. "Mc Donald Rd" and "McDonald Road", or "Shady Oak Lane" and
+"Shady Oaks Lane".
+
+Each street name is reduced to a key: upper case, without punctuation or
+spaces, and with the abbreviations of the street types, prefixes and suffixes
+of addr_prep.conf expanded, so that "Mc Donald Rd" and "McDonald Road" both
+become MCDONALDROAD.  Names with the same key are the same street.  Keys which
+differ by only a letter or two (the edit, or Levenshtein, distance) are held
+in a BK-tree, which finds the keys near a given one without comparing it to
+every other key, and keys which sound alike (see phonetic_key()) are held in a
+dictionary.  A StreetIndex is built for each city, so that the streets of one
+city are only compared with each other.
+
+co_addr_prep uses them to match the addresses already in OSM by the key of
+their street rather than its exact name (--match-streets), and addr_qc to
+report the streets which are possibly the same (--near-streets).
+
+Usage:
+    index = StreetIndex(['McDonald Road', 'Shady Oak Lane'])
+    index.match('Mc Donald Rd')                     # -> 'MCDONALDROAD'
+    index.match('Shady Oaks Ln', max_distance=None) # -> 'SHADYOAKLANE'
+    groups = index.near_duplicates()
+"""
+import os
+import re
+import addr_io
+import addr_pipeline
+
+# The largest edit distance between the keys of streets which are taken to be
+# the same by default (see default_distance())
+MAX_DISTANCE = 2
+# The number of letters of a key for each edit allowed by default
+LETTERS_PER_EDIT = 10
+# The choices of --match-streets
+MATCH_MODES = ('exact', 'normalized', 'fuzzy')
+# The sound of each letter for phonetic_key(), as in Soundex.  Other letters
+# (the vowels, H, W and Y) are dropped.
+SOUNDS = {letter: str(code) for code, letters in enumerate(
+    ['BFPV', 'CGJKQSXZ', 'DT', 'L', 'MN', 'R'], 1) for letter in letters}
+
+_expansions = {}
+
+def expansions():
+    """ Returns a dictionary of the abbreviations of the street types,
+    prefixes and suffixes of the configuration file, and their expansions, in
+    upper case.  The file is only read again if it has changed.
+    """
+    conf_fname = addr_io.data_file(addr_io.CONF_FILE)
+    key = (os.path.abspath(conf_fname), os.path.getmtime(conf_fname))
+    if key not in _expansions:
+        conf = addr_io.read_conf()
+        table = {}
+        for section in ('street_types', 'street_prefixes', 'street_suffixes'):
+            for abbr, expansion in conf[section].items():
+                if abbr:
+                    table[abbr.upper()] = expansion.upper()
+        _expansions[key] = table
+    return _expansions[key]
+
+def street_key(street, table):
+    """ Returns the key of a street name: its words in upper case with the
+    abbreviations in table (see expansions()) expanded, joined without spaces.
+    """
+    words = re.split(r'[^0-9A-Z]+', street.upper())
+    return ''.join(table.get(word, word) for word in words)
+
+def phonetic_key(key):
+    """ Returns the sound of a street key: its first letter, followed by the
+    Soundex code of each of the other letters, with the vowels dropped and the
+    repeated codes removed.  Unlike Soundex it is not cut to four characters,
+    and digits are kept.
+    """
+    if not key:
+        return key
+    sounds = [key[0]]
+    last = SOUNDS.get(key[0])
+    for char in key[1:]:
+        code = char if char.isdigit() else SOUNDS.get(char)
+        if code is not None and code != last:
+            sounds.append(code)
+        last = code
+    return ''.join(sounds)
+
+def levenshtein(first, second):
+    """ Returns the edit distance between two strings: the number of letters
+    which must be inserted, deleted or replaced to turn one into the other.
+    """
+    if len(first) < len(second):
+        first, second = second, first
+    previous = list(range(len(second) + 1))
+    for row, char in enumerate(first, 1):
+        current = [row]
+        for column, other in enumerate(second, 1):
+            current.append(min(previous[column] + 1, current[column - 1] + 1,
+                               previous[column - 1] + (char != other)))
+        previous = current
+    return previous[-1]
+
+def default_distance(key):
+    """ Returns the largest edit distance from a key at which another key is
+    taken to be the same street: one for each LETTERS_PER_EDIT letters, up to
+    MAX_DISTANCE, so that short names such as Elm Street and Elk Street are not
+    matched.
+    """
+    return min(MAX_DISTANCE, len(key) // LETTERS_PER_EDIT)
+
+class BkTree():
+    """ A BK-tree (Burkhard-Keller tree) of strings, which finds those within a
+    given edit distance of a string.  Each child of a node is at a different
+    distance from it, and by the triangle inequality only the children at a
+    distance within max_distance of the distance from the node to the string
+    searched for need be searched.
+    """
+    def __init__(self):
+        self.root = None
+
+    def add(self, key):
+        """ Adds a string to the tree, unless it is already there """
+        if self.root is None:
+            self.root = (key, {})
+            return
+        node = self.root
+        while True:
+            distance = levenshtein(key, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (key, {})
+                return
+            node = child
+
+    def search(self, key, max_distance):
+        """ Returns a list of the (distance, string) of each string of the tree
+        within max_distance of key, nearest first.
+        """
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node = nodes.pop()
+            distance = levenshtein(key, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[0]))
+            nodes.extend(child for child_distance, child in node[1].items()
+                         if abs(child_distance - distance) <= max_distance)
+        return sorted(found)
+
+class StreetIndex():
+    """ An index of the street names of a city.
+
+    Parameters:
+        names - (in) The street names, which may repeat.
+        table - (in) The abbreviations to expand, by default those of
+            addr_prep.conf (see expansions()).
+    """
+    def __init__(self, names=(), table=None):
+        self.table = expansions() if table is None else table
+        # The key of each name added
+        self.keys = {}
+        # The names of each key, and the number of times each was added, in the
+        # order in which they were first added
+        self.names = {}
+        self.sounds = {}
+        self.tree = BkTree()
+        for name in names:
+            self.add(name)
+
+    def add(self, name, count=1):
+        """ Adds a street name to the index """
+        key = self.keys.get(name)
+        if key is None:
+            key = self.keys[name] = street_key(name, self.table)
+            if key not in self.names:
+                self.names[key] = {}
+                self.sounds.setdefault(phonetic_key(key), []).append(key)
+                self.tree.add(key)
+        names = self.names[key]
+        names[name] = names.get(name, 0) + count
+
+    def key(self, name):
+        """ Returns the key of a street name """
+        key = self.keys.get(name)
+        return street_key(name, self.table) if key is None else key
+
+    def canonical(self, key):
+        """ Returns the name most often added with the given key (the first
+        added, if there is a tie).
+        """
+        names = self.names[key]
+        return max(names, key=names.get)
+
+    def match(self, name, max_distance=0):
+        """ Returns the key of the street of the index which is the same as the
+        given street name, or None if there is none.  Unless max_distance is 0
+        the nearest key within max_distance (by default default_distance()) of
+        that of the name, or, failing that, one which sounds alike and is
+        within one more than that, is taken.
+        """
+        key = self.key(name)
+        if key in self.names:
+            return key
+        if max_distance == 0:
+            return None
+        if max_distance is None:
+            max_distance = default_distance(key)
+        found = self.tree.search(key, max_distance) if max_distance else []
+        if found:
+            return found[0][1]
+        alike = sorted((levenshtein(key, other), other)
+                       for other in self.sounds.get(phonetic_key(key), []))
+        if alike and alike[0][0] <= max_distance + 1:
+            return alike[0][1]
+        return None
+
+    def near_duplicates(self, max_distance=None):
+        """ Returns a list of the groups of street names of the index which are
+        possibly the same street: the names with the same key, and those whose
+        keys are within max_distance (by default default_distance()) of each
+        other, or sound alike and are within one more than that.  Each group is
+        a list of names sorted as addr_qc sorts the streets, and the groups are
+        in the order in which their first name was added.
+        """
+        parent = {key: key for key in self.names}
+        def find(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+        for key in self.names:
+            limit = default_distance(key) if max_distance is None else max_distance
+            near = [other for _, other in self.tree.search(key, limit)]
+            near += [other for other in self.sounds[phonetic_key(key)]
+                     if levenshtein(key, other) <= limit + 1]
+            for other in near:
+                parent[find(other)] = find(key)
+        groups = {}
+        for key, names in self.names.items():
+            groups.setdefault(find(key), []).extend(names)
+        return [sorted(names, key=str.upper) for names in groups.values() if len(names) > 1]
+
+def add_args(parser):
+    """ Adds the --match-streets option to an argparse.ArgumentParser
+    """
+    parser.add_argument('--match-streets', choices=MATCH_MODES, default='exact',
+                        help='how the streets of the addresses are matched with those of the '
+                        'existing addresses: exact names, the names with abbreviations, '
+                        'spaces and punctuation normalized, or also those a letter or two '
+                        'apart (default exact)')
+
+def existing_matcher(existing_addrs, mode='exact'):
+    """ Returns the set of existing addresses, and the function returning the key
+    of a record in that set, for addr_pipeline.existing_filter().  Unless mode
+    (see MATCH_MODES) is 'exact', the street of each address of the set is
+    replaced by its key, with a StreetIndex of the streets of each city, and
+    the street of each record by the key of the street of its city it matches
+    (see StreetIndex.match()).
+    """
+    if mode == 'exact':
+        return existing_addrs, addr_pipeline.existing_addrs_key
+    indexes = {}
+    for city, street, _, _ in existing_addrs:
+        indexes.setdefault(city, StreetIndex()).add(street)
+    keys = {(city, indexes[city].key(street), housenumber, unit)
+            for city, street, housenumber, unit in existing_addrs}
+    max_distance = None if mode == 'fuzzy' else 0
+    matches = {}
+    def record_key(record):
+        city, street, housenumber, unit = addr_pipeline.existing_addrs_key(record)
+        if (city, street) not in matches:
+            index = indexes.get(city)
+            matches[city, street] = index.match(street, max_distance) if index else None
+        return city, matches[city, street], housenumber, unit
+    return keys, record_key
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+"""Unit tests for the addr_streets module.
+
+Usage:
+$ python3 addr_streets_test.py
+
+"""
+import contextlib
+import io
+import random
+import unittest
+import addr_pipeline
+import addr_qc
+import addr_streets
+
+TABLE = {'RD': 'ROAD', 'LN': 'LANE', 'ST': 'STREET', 'N': 'NORTH'}
+
+class StreetIndexTestCase(unittest.TestCase):
+    def test_keys(self):
+        self.assertEqual(addr_streets.street_key('Mc Donald Rd', TABLE), 'MCDONALDROAD')
+        self.assertEqual(addr_streets.street_key("N. O'Brien St", TABLE), 'NORTHOBRIENSTREET')
+        self.assertEqual(addr_streets.phonetic_key('MCDONALDROAD'),
+                         addr_streets.phonetic_key('MACDOWNALDROAD'))
+        self.assertEqual(addr_streets.levenshtein('KITTEN', 'SITTING'), 3)
+        self.assertEqual(addr_streets.levenshtein('', 'OAK'), 3)
+        # The abbreviations of addr_prep.conf
+        table = addr_streets.expansions()
+        self.assertEqual((table['RD'], table['NE']), ('ROAD', 'NORTHEAST'))
+
+    def test_bk_tree(self):
+        rand = random.Random(5)
+        words = {''.join(rand.choice('ABCDE') for _ in range(rand.randint(3, 8)))
+                 for _ in range(300)}
+        tree = addr_streets.BkTree()
+        for word in words:
+            tree.add(word)
+        for query in ['ABCDE', 'AAA', 'EDCBAED']:
+            expected = sorted((addr_streets.levenshtein(query, word), word) for word in words
+                              if addr_streets.levenshtein(query, word) <= 2)
+            self.assertEqual(tree.search(query, 2), expected)
+
+    def test_match(self):
+        index = addr_streets.StreetIndex(['McDonald Road', 'Mc Donald Rd', 'McDonald Road',
+                                          'Shady Oak Lane', 'Elm Street'], TABLE)
+        self.assertEqual(index.match('MCDONALD ROAD'), 'MCDONALDROAD')
+        self.assertEqual(index.canonical('MCDONALDROAD'), 'McDonald Road')
+        self.assertIsNone(index.match('Shady Oaks Ln'))
+        self.assertEqual(index.match('Shady Oaks Ln', None), 'SHADYOAKLANE')
+        # Too short to be a letter apart
+        self.assertIsNone(index.match('Elk St', None))
+        # Sounds alike
+        self.assertEqual(index.match('Macdownald Road', None), 'MCDONALDROAD')
+        self.assertEqual(index.near_duplicates(), [['Mc Donald Rd', 'McDonald Road']])
+        index.add('Shady Oaks Ln')
+        self.assertEqual(index.near_duplicates(), [['Mc Donald Rd', 'McDonald Road'],
+                                                   ['Shady Oak Lane', 'Shady Oaks Ln']])
+
+    def test_existing_filter(self):
+        existing = {('Staunton', 'McDonald Road', '12', ''), ('Staunton', 'Oak Lane', '3', ''),
+                    ('Waynesboro', 'Elm Street', '7', '')}
+        batch = [{'addr:city': 'Staunton', 'addr:street': 'Mc Donald Rd',
+                  'addr:housenumber': '12'},
+                 {'addr:city': 'Staunton', 'addr:street': 'Oaks Lane', 'addr:housenumber': '3'},
+                 {'addr:city': 'Staunton', 'addr:street': 'Elm Street', 'addr:housenumber': '7'},
+                 {'addr:city': 'Staunton', 'addr:street': 'Oak Lane', 'addr:housenumber': '3'}]
+        def kept(mode):
+            addrs, key = addr_streets.existing_matcher(existing, mode)
+            return [record['addr:street'] for batch in
+                    addr_pipeline.existing_filter([batch], addrs, key) for record in batch]
+        self.assertEqual(kept('exact'), ['Mc Donald Rd', 'Oaks Lane', 'Elm Street'])
+        self.assertEqual(kept('normalized'), ['Oaks Lane', 'Elm Street'])
+        # Oak Lane is too short for Oaks Lane to be matched as a letter apart,
+        # but it sounds alike
+        self.assertEqual(kept('fuzzy'), ['Elm Street'])
+
+    def test_qc_report(self):
+        batch = [{'addr:city': 'Staunton', 'addr:street': street, 'addr:housenumber': str(n)}
+                 for n, street in enumerate(['McDonald Road', 'Mc Donald Road', 'Oak Lane'], 1)]
+        batch.append({'addr:city': 'Waynesboro', 'addr:street': 'McDonald Road',
+                      'addr:housenumber': '1'})
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with addr_qc.QcSink({}, near_streets=True) as sink:
+                sink.write(batch)
+        self.assertIn('Possibly the same streets\n'
+                      '    Staunton | Mc Donald Road | McDonald Road\n\n', output.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,12 +16,19 @@ input file and replaced with "prep"
 """
 import argparse
 import re
-from pathlib import Path
-import pathlib
-import xml.etree.ElementTree as ET
-import yaml
-
-from osgeo import ogr
+import sys
+import addr_diag
+import addr_io
+import addr_pipeline
+import addr_record
+import addr_stats
+from addr_diag import DIAG
+from addr_stats import STATS
+
+# The modules used only by some of the options (the boundaries, the store, the
+# matching of the existing streets and addresses, and the reading of .osm.pbf
+# files) are imported where they are used, so that co_addr_prep (and osm-addr
+# prep-co --help) starts quickly.
 
 street_types = {}
 street_prefixes = {}
@@ -29,6 +36,11 @@ street_suffixes = {}
 unit_labels = {}
 unit_labels_stand_alone = {}
 street_name_special_cases = []
+street_name_cache = {}
+# The lookups in street_name_cache not yet added to STATS, as [hits, misses],
+# which are counted here rather than each recorded, as fix_street_name() is
+# called for every address (see add_street_name_stats())
+street_name_lookups = [0, 0]
 
 def get_existing_addrs(existing_fname, target_city):
     """ Read a .osm file of existing OSM data and put the addresses
@@ -36,47 +48,67 @@ def get_existing_addrs(existing_fname, target_city):
 
     Parameters:
         existing_fname = Name of file containing addresses already in OSM. File
-            must be in .osm format.
+            must be in .osm format, and may be compressed (e.g. .osm.gz), or in
+            .osm.pbf format.
         target_city = Name of city for which we are processing addresses.
     """
     if not existing_fname:
         return None
+    if existing_fname.lower().endswith('.pbf'):
+        return get_existing_addrs_pbf(existing_fname, target_city)
+    import xml.etree.ElementTree as ET # pylint: disable=C0415
     addr_housenumber = ''
     addr_street = ''
     addr_city = ''
     addr_unit = ''
-    count = 0
     element_stack = []
     existing_addrs = set()
-    for event, elem in ET.iterparse(existing_fname, events=("start", "end")):
-        count += 1
-        if not count % 100000:
-            print(count)
-        if event == 'start':
-            element_stack.append(elem)
-        elif event == 'end':
-            element_stack.pop()
-            if elem.tag == 'tag':
-                if 'k' in elem.attrib and 'v' in elem.attrib:
-                    key = elem.attrib['k']
-                    value = elem.attrib['v']
-                    if key == 'addr:housenumber':
-                        addr_housenumber = value
-                    elif key == 'addr:street':
-                        addr_street = value
-                    elif key == 'addr:city':
-                        addr_city = value
-                    elif key == 'addr:unit':
-                        addr_unit = value
-            elif elem.tag in ('node', 'way', 'relation'):
-                if not target_city or addr_city.upper() == target_city.upper():
-                    existing_addrs.add((addr_city, addr_street, addr_housenumber, addr_unit))
-                addr_housenumber = ''
-                addr_street = ''
-                addr_city = ''
-                addr_unit = ''
-            if element_stack:
-                element_stack[-1].remove(elem)
+    with addr_io.open_file(existing_fname, 'rb') as existing_in:
+        for event, elem in STATS.timed_iter(ET.iterparse(existing_in, events=("start", "end")),
+                                            'read existing'):
+            if event == 'start':
+                element_stack.append(elem)
+            elif event == 'end':
+                element_stack.pop()
+                if elem.tag == 'tag':
+                    if 'k' in elem.attrib and 'v' in elem.attrib:
+                        key = elem.attrib['k']
+                        value = elem.attrib['v']
+                        if key == 'addr:housenumber':
+                            addr_housenumber = value
+                        elif key == 'addr:street':
+                            addr_street = value
+                        elif key == 'addr:city':
+                            addr_city = value
+                        elif key == 'addr:unit':
+                            addr_unit = value
+                elif elem.tag in ('node', 'way', 'relation'):
+                    if not target_city or addr_city.upper() == target_city.upper():
+                        existing_addrs.add((sys.intern(addr_city), sys.intern(addr_street),
+                                            addr_housenumber, addr_unit))
+                    addr_housenumber = ''
+                    addr_street = ''
+                    addr_city = ''
+                    addr_unit = ''
+                if element_stack:
+                    element_stack[-1].remove(elem)
+    return existing_addrs
+
+EXISTING_KEYS = ['addr:housenumber', 'addr:street', 'addr:city', 'addr:unit']
+
+def get_existing_addrs_pbf(existing_fname, target_city):
+    """ get_existing_addrs() for a .osm.pbf file, which is decoded in parallel by
+    osm_pbf.  Unlike a .osm file, only those nodes, ways and relations with at
+    least one address tag are read.
+    """
+    import osm_pbf # pylint: disable=C0415
+    existing_addrs = set()
+    for tags in STATS.timed_iter(osm_pbf.tagged_elements(existing_fname, EXISTING_KEYS),
+                                 'read existing'):
+        addr_city = tags.get('addr:city', '')
+        if not target_city or addr_city.upper() == target_city.upper():
+            existing_addrs.add((sys.intern(addr_city), sys.intern(tags.get('addr:street', '')),
+                                tags.get('addr:housenumber', ''), tags.get('addr:unit', '')))
     return existing_addrs
 
 def get_conf():
@@ -89,20 +121,15 @@ def get_conf():
     global unit_labels
     global unit_labels_stand_alone
     global street_name_special_cases
-    source_path = Path(__file__).resolve()
-    source_dir = source_path.parent
-    print(source_dir)
-    conf_fname = 'addr_prep.conf'
-    if not Path(conf_fname).exists():
-        pass
-    with open('addr_prep.conf', 'r', encoding='utf-8') as conf_in:
-        conf2 = yaml.load(conf_in, Loader=yaml.SafeLoader)
-        street_types = conf2['street_types']
-        street_prefixes = conf2['street_prefixes']
-        street_suffixes = conf2['street_suffixes']
-        unit_labels = conf2['unit_labels']
-        unit_labels_stand_alone = conf2['unit_labels_stand_alone']
-        street_name_special_cases = conf2['street_name_special_cases']
+    street_name_cache.clear()
+    street_name_lookups[0] = street_name_lookups[1] = 0
+    conf2 = addr_io.read_conf()
+    street_types = conf2['street_types']
+    street_prefixes = conf2['street_prefixes']
+    street_suffixes = conf2['street_suffixes']
+    unit_labels = conf2['unit_labels']
+    unit_labels_stand_alone = conf2['unit_labels_stand_alone']
+    street_name_special_cases = conf2['street_name_special_cases']
 
 def fix_street_name(street_name):
     """ 'Fixes' the street name, including:
@@ -115,11 +142,18 @@ def fix_street_name(street_name):
 
     Returns:
         The "fixed" street name.
+
+    The same street name occurs many times in the input, so the results are cached.
     """
+    if street_name in street_name_cache:
+        street_name_lookups[0] += 1
+        return street_name_cache[street_name]
+    street_name_lookups[1] += 1
     street_name_temp = title_case(street_name)
     for case in street_name_special_cases:
         pat = re.compile(case[0], flags=re.IGNORECASE)
         street_name_temp = apply_case(pat, case[1], street_name_temp)
+    street_name_cache[street_name] = street_name_temp
     return street_name_temp
 
 def apply_case(pat, replacement, string_in):
@@ -136,7 +170,9 @@ def apply_case(pat, replacement, string_in):
 
 def make_addr_unit_and_label_co(building, floor, unit):
     """ Makes the addr:unit tag/field and the addr:unit_label tag/field
-    for a Colorado address
+    for a Colorado address.  If more than one of building, floor and unit is
+    given only the first is used, and the others are reported to the diagnostics
+    summary.
     """
     unitid = ''
     unittype = ''
@@ -145,13 +181,13 @@ def make_addr_unit_and_label_co(building, floor, unit):
         unitid = building
     if floor:
         if unitid:
-            print('multiple units')
+            DIAG.report('multiple units', 'Floor')
         else:
             unittype = 'Floor'
             unitid = floor
     if unit:
         if unitid:
-            print('multiple units')
+            DIAG.report('multiple units', 'Unit')
         else:
             unittype = 'Unit'
             unitid = unit
@@ -300,8 +336,8 @@ def title_case(title):
 
 def expand_street_suffix(street_suffix):
     """ Expands abbreviations in the street suffix field. The field is considered
-    as a whole. If the contents of the street suffix field is not recognized as
-    an abbreviation, a message is printed to stdout.
+    as a whole. If the contents of the street suffix field is not blank, and is
+    not recognized as an abbreviation, it is reported to the diagnostics summary.
 
     Parameters:
         street_suffix - (int) The street suffix whose abbreviation is to be expanded.
@@ -312,40 +348,35 @@ def expand_street_suffix(street_suffix):
     """
     if street_suffix in street_suffixes:
         return street_suffixes[street_suffix]
-    print('unhanded street suffix: ' + street_suffix)
+    if not street_suffix:
+        return ''
+    DIAG.report('unhandled street suffix', street_suffix)
     return None
 
 def expand_street_prefix(street_prefix):
     """ Expands abbreviations in the street prefix field.  The field is considered
     as a whole. if the contents of the street prefix field is not blank, and is
-    not recognized as an abbreviation, a message is printed to stdout.
+    not recognized as an abbreviation, it is reported to the diagnostics summary.
     """
     if street_prefix in street_prefixes:
         return street_prefixes[street_prefix]
-    print('unhanded street prefix: ' + street_prefix)
+    if not street_prefix:
+        return ''
+    DIAG.report('unhandled street prefix', street_prefix)
     return None
 
 def expand_street_type(street_type_abbr):
     """ Expands abbreviations in the street type field.  The field is considered
     as a whole.  If the contents of the street type field is not blank, and is
-    not recognized as an abbreviation, a message is printed to stdout.
+    not recognized as an abbreviation, it is reported to the diagnostics summary.
     """
     if street_type_abbr in street_types:
         return street_types[street_type_abbr]
-    print('unhandled street type abbreviation:' + street_type_abbr)
+    if not street_type_abbr:
+        return ''
+    DIAG.report('unhandled street type abbreviation', street_type_abbr)
     return None
 
-def read_field(feature, field):
-    """ Reads the value of the given field from the given feature.  If it is None,
-    returns and empty string, otherwise returns the value.
-    """
-    value = feature.GetField(field)
-    if not value:
-        value = ''
-    else:
-        value = value.strip()
-    return value
-
 def get_args():
     """ Gets the command line arguments
 
@@ -355,91 +386,154 @@ def get_args():
     Returns:
         an argparse.Namespace object containing the parameters passed on the command line
     """
+    # pylint: disable=C0415
+    import addr_boundary
+    import addr_store
+    import addr_streets
     parser = argparse.ArgumentParser(
         prog='co_addr_prep',
         description='Prepares Colorado addresses for import to OSM.')
     parser.add_argument('input_fgdb_and_layer', help='file geodatabase containing address info, '
                         'including the layer e.g. /path/to/fgdb/layer')
     parser.add_argument('output_file', help='output file to which to write the results'
-                        ' in .osm format')
+                        ' in .osm format (or .csv, .geojson, .parquet or .fgb)')
     parser.add_argument('--city', help='only writes addresses with the '
                         'indicated city to the output')
     parser.add_argument('--existing', help='file of existing OSM addresses which are not to be'
-                        ' placed in the output file.')
+                        ' placed in the output file (.osm, possibly compressed, or .osm.pbf).')
+    addr_streets.add_args(parser)
+    addr_pipeline.add_order_args(parser)
+    addr_pipeline.add_args(parser)
+    addr_stats.add_args(parser)
+    addr_diag.add_args(parser)
+    addr_store.add_args(parser)
+    addr_boundary.add_args(parser)
     args = parser.parse_args()
     if args.city:
         args.city = args.city.upper()
     return args
 
+CO_FIELDS = ['AddrNum', 'St_PreMod', 'PreDir', 'PreType', 'St_PreSep', 'StreetName',
+             'PostType', 'PostDir', 'Building', 'Floor', 'Unit', 'Zipcode']
+
+def describe_feature(feature):
+    """ Returns a short description of an address feature (a record read by
+    co_source()), for use in the diagnostics summary.
+    """
+    addr = ' '.join(' '.join(feature[field] for field in CO_FIELDS[:-1]).split())
+    return f'FID {feature["@fid"]}: {addr}, {feature["PlaceName"]}'
+
+def co_source(fgdb_and_layer, city=None):
+    """ Pipeline source (see addr_pipeline) which reads the address features from
+    the file geodatabase layer, optionally only those in the given city.
+    """
+    batches = addr_pipeline.fgdb_source(fgdb_and_layer, CO_FIELDS, raw_fields=['PlaceName'])
+    if city:
+        batches = addr_pipeline.field_filter(batches, 'PlaceName', city)
+    return batches
+
+class CoRecord(addr_record.AddrRecord):
+    """ An address record whose tags are written in the order used by earlier
+    versions of this program.
+    """
+    __slots__ = ()
+    KEYS = ('@lat', '@lon', 'addr:housenumber', 'addr:street', 'addr:unit', 'addr:unit:label',
+            'addr:city', 'addr:postcode', 'addr:state', 'name', '@id', '@fid')
+
+def normalize_feature(feature):
+    """ Converts an address feature read by co_source() into a record of OSM tags
+    (a CoRecord).
+    """
+    DIAG.set_record(feature)
+    addr_street = make_addr_street_co(feature['St_PreMod'], feature['PreDir'],
+                                      feature['PreType'], feature['St_PreSep'],
+                                      feature['StreetName'], feature['PostType'],
+                                      feature['PostDir'])
+    if not addr_street:
+        DIAG.report('blank street')
+    addr_city = feature['PlaceName'].title()
+    # Reduce multiple spaces between words to single space
+    addr_city = ' '.join(addr_city.split())
+    addr_unit_label, addr_unit = make_addr_unit_and_label_co(feature['Building'],
+                                                             feature['Floor'],
+                                                             feature['Unit'])
+    if not addr_unit:
+        addr_unit = addr_unit_label = None
+    return CoRecord(lat=feature['@lat'],
+                    lon=feature['@lon'],
+                    fid=feature['@fid'],
+                    housenumber=feature['AddrNum'],
+                    street=addr_street,
+                    unit=addr_unit,
+                    unit_label=addr_unit_label or None,
+                    city=addr_city,
+                    postcode=feature['Zipcode'],
+                    state='CO')
+
+def co_normalize(batches):
+    """ Pipeline stage (see addr_pipeline) which converts batches of address
+    features into batches of records of OSM tags.
+    """
+    for batch in batches:
+        with STATS.timer('normalize', len(batch)):
+            batch = [normalize_feature(feature) for feature in batch]
+        add_street_name_stats()
+        yield batch
+
+def add_street_name_stats():
+    """ Adds the lookups in the cache of fix_street_name() since the last call
+    to the statistics of the run.
+    """
+    STATS.add_cache('street name', *street_name_lookups)
+    street_name_lookups[0] = street_name_lookups[1] = 0
+
+def prep_fgdb(args):
+    """ Converts the addresses in the file geodatabase layer to OSM tags and writes
+    them to the output file.
+    """
+    # pylint: disable=C0415
+    import addr_boundary
+    import addr_store
+    import addr_streets
+    get_conf()
+    DIAG.reset(describe_feature)
+    existing_addrs = get_existing_addrs(args.existing, args.city)
+    # OGR releases the GIL while decoding features, so reading in a separate
+    # thread overlaps with the normalizing.
+    batches = addr_pipeline.read_ahead(co_source(args.input_fgdb_and_layer, args.city),
+                                       args.threads)
+    batches = co_normalize(batches)
+    # The city and postcode are filled in before the existing addresses, whose
+    # key includes the city, are filtered out, as addr_pipeline co does
+    batches = addr_boundary.assign_jurisdictions(
+        batches, *addr_boundary.load_indexes(args.city_boundaries, args.postcode_boundaries))
+    if existing_addrs:
+        STATS.count('existing addresses', len(existing_addrs))
+        with STATS.timer('index existing streets'):
+            existing_addrs, key = addr_streets.existing_matcher(existing_addrs,
+                                                                args.match_streets)
+        batches = addr_pipeline.existing_filter(batches, existing_addrs, key)
+    batches = addr_pipeline.spatial_sort(batches, args.order)
+    sinks = [addr_pipeline.open_sink(args.output_file, source=args.input_fgdb_and_layer)]
+    if args.store:
+        # The ids are given before the sinks, so that they agree on them
+        batches = addr_pipeline.assign_ids(batches)
+        sinks.append(addr_store.StoreSink(args.store, addr_store.ADDRESS_LAYER,
+                                          args.input_fgdb_and_layer))
+    sinks = [addr_pipeline.write_behind(sink, args.threads) for sink in sinks]
+    try:
+        addr_pipeline.drain(batches, *sinks)
+    finally:
+        for sink in sinks:
+            sink.close()
+    addr_diag.finish(args.diagnostics_csv)
+
 def main():
     """ Main function, gets the command line argument, and converts the specified
     file to one suitable for import to OSM.
     """
     args = get_args()
-    get_conf()
-    existing_addrs = get_existing_addrs(args.existing, args.city)
-    print(len(existing_addrs))
-    #sys.exit()
-    #source_path = Path(__file__).resolve()
-    #source_dir = source_path.parent
-    #print(source_dir)
-    #sys.exit()
-    driver = ogr.GetDriverByName("OpenFileGDB")
-    path = pathlib.PurePath(args.input_fgdb_and_layer)
-    layer = str(path.name)
-    fgdb = str(path.parents[0])
-    data_source = driver.Open(fgdb, 0)
-    addr_layer = data_source.GetLayer(layer)
-    with open(args.output_file, 'w', newline='', encoding='utf-8') as addr_out:
-        addr_out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        addr_out.write('<osm version="0.6" generator="JOSM">\n')
-        node_id = -1
-        for addr_feature in addr_layer:
-            place_name = addr_feature.GetField('PlaceName')
-            if args.city and place_name.upper() != args.city:
-                continue
-            geom = addr_feature.GetGeometryRef()
-            point = geom.GetPoint(0)
-            lat = point[1]
-            lon = point[0]
-            addr_num = read_field(addr_feature, 'AddrNum')
-            #num_suf = read_field(addr_feature, 'NumSuf')
-            st_pre_mod = read_field(addr_feature, 'St_PreMod')
-            pre_dir = read_field(addr_feature, 'PreDir')
-            pre_type = read_field(addr_feature, 'PreType')
-            st_pre_sep = read_field(addr_feature, 'St_PreSep')
-            street_name = read_field(addr_feature, 'StreetName')
-            post_type = read_field(addr_feature, 'PostType')
-            post_dir = read_field(addr_feature, 'PostDir')
-            #st_pos_mod = read_field(addr_feature, 'St_PosMod')
-            building = read_field(addr_feature, 'Building')
-            floor = read_field(addr_feature, 'Floor')
-            unit = read_field(addr_feature, 'Unit')
-            zip_code = read_field(addr_feature, 'Zipcode')
-            addr_street = make_addr_street_co(st_pre_mod, pre_dir, pre_type, st_pre_sep,
-                                              street_name, post_type, post_dir)
-            if not addr_street:
-                print('BLANK Street')
-            addr_city = place_name.title()
-            # Reduce multiple spaces between words to single space
-            addr_city = ' '.join(addr_city.split())
-            addr_unit_label, addr_unit = make_addr_unit_and_label_co(building, floor, unit)
-            if (addr_city, addr_street, addr_num, addr_unit) in existing_addrs:
-                continue
-            addr_out.write(f'    <node id="{node_id}" action="modify" visible="true" lat="{lat}" '
-                           f'lon="{lon}">\n')
-            addr_out.write(f'        <tag k="addr:housenumber" v="{addr_num}" />\n')
-            addr_out.write(f'        <tag k="addr:street" v="{addr_street}" />\n')
-            if addr_unit:
-                addr_out.write(f'        <tag k="addr:unit" v="{addr_unit}" />\n')
-                if addr_unit_label:
-                    addr_out.write(f'        <tag k="addr:unit:label" v="{addr_unit_label}" />\n')
-            addr_out.write(f'        <tag k="addr:city" v="{addr_city}" />\n')
-            addr_out.write(f'        <tag k="addr:postcode" v="{zip_code}" />\n')
-            addr_out.write('        <tag k="addr:state" v="CO" />\n')
-            addr_out.write('    </node>\n')
-            node_id -= 1
-        addr_out.write('</osm>\n')
+    addr_stats.run(prep_fgdb, args, args)
 
 if __name__ == '__main__':
     main()
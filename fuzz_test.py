@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+"""Fuzz tests for the address normalization functions.
+
+fix_street_name(), make_addr_street_co() and make_addr_unit_and_label() are
+called with randomly generated input, and the results are compared against a
+reference implementation.  The reference implementation is a copy of the
+original, straight forward, implementation of those functions, and must not
+be changed when the functions in addr_prep.py or co_addr_prep.py are
+optimized.
+
+Usage:
+$ python3 fuzz_test.py
+
+The number of random inputs tried for each function can be changed with the
+FUZZ_ITERATIONS environment variable, and the random seed with FUZZ_SEED.
+"""
+import contextlib
+import io
+import os
+import random
+import re
+import unittest
+import yaml
+import addr_prep
+import co_addr_prep
+
+ITERATIONS = int(os.environ.get('FUZZ_ITERATIONS', '3000'))
+SEED = int(os.environ.get('FUZZ_SEED', '26'))
+
+def load_conf():
+    """ Reads the configuration file for use by the reference implementation.
+    """
+    conf_fname = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'addr_prep.conf')
+    with open(conf_fname, 'r', encoding='utf-8') as conf_in:
+        return yaml.load(conf_in, Loader=yaml.SafeLoader)
+
+CONF = load_conf()
+
+# Reference implementation.
+
+def ref_title_case(title):
+    """ Reference implementation of title_case() """
+    title_fixed = ''
+    for word in title.split():
+        word_fixed = word[0:1].upper() + word[1:].lower()
+        if title_fixed:
+            title_fixed += ' '
+        title_fixed += word_fixed
+    return title_fixed
+
+def ref_apply_case(pat, replacement, string_in):
+    """ Reference implementation of apply_case() """
+    string_out = ''
+    start_pos = 0
+    for match in pat.finditer(string_in):
+        string_out += string_in[start_pos:match.start(1)] + replacement
+        start_pos = match.end(1)
+    string_out += string_in[start_pos:]
+    return string_out
+
+def ref_fix_street_name(street_name):
+    """ Reference implementation of fix_street_name() """
+    street_name_temp = ref_title_case(street_name)
+    for case in CONF['street_name_special_cases']:
+        pat = re.compile(case[0], flags=re.IGNORECASE)
+        street_name_temp = ref_apply_case(pat, case[1], street_name_temp)
+    return street_name_temp
+
+def ref_expand(abbrevs, abbr):
+    """ Reference implementation of expand_street_prefix(), expand_street_suffix()
+    and expand_street_type()
+    """
+    if abbr in abbrevs:
+        return abbrevs[abbr]
+    return None
+
+def ref_concat_with_space_if_not_null(list_to_concat):
+    """ Reference implementation of concat_with_space_if_not_null() """
+    out_str = ''
+    for item in list_to_concat:
+        if item is not None and item != '':
+            if out_str != '':
+                out_str = out_str + ' ' + item
+            else:
+                out_str = item
+    return out_str
+
+def ref_make_addr_street_co(st_pre_mod, pre_dir, pre_type,
+                            st_pre_sep, street_name, post_type, post_dir):
+    """ Reference implementation of make_addr_street_co() """
+    addr_street = ref_concat_with_space_if_not_null(
+        [st_pre_mod,
+         ref_expand(CONF['street_prefixes'], pre_dir),
+         pre_type,
+         st_pre_sep,
+         ref_fix_street_name(street_name),
+         ref_expand(CONF['street_types'], post_type),
+         ref_expand(CONF['street_suffixes'], post_dir)])
+    addr_street = ref_fix_street_name(addr_street)
+    addr_street = addr_street[0:1].upper() + addr_street[1:]
+    addr_street = ' '.join(addr_street.split())
+    return addr_street
+
+def ref_get_unit_and_label(unittype, unitid):
+    """ Reference implementation of get_unit_and_label() """
+    unit_labels = CONF['unit_labels']
+    unit_labels_stand_alone = CONF['unit_labels_stand_alone']
+    label = unittype
+    unit = unitid
+    if unittype in unit_labels:
+        label = unit_labels[unittype]
+        if unitid in unit_labels_stand_alone:
+            unit = unit_labels_stand_alone[unitid]
+        else:
+            unit = unitid
+    elif unittype in unit_labels_stand_alone:
+        label = ''
+        unit = unit_labels_stand_alone[unittype]
+    return label, unit
+
+def ref_get_unit_and_label_from_unit(unitid):
+    """ Reference implementation of get_unit_and_label_from_unit() """
+    unit_labels = CONF['unit_labels']
+    unit_labels_stand_alone = CONF['unit_labels_stand_alone']
+    label = ''
+    unit = unitid
+    found = False
+    for unit_label, unit_label_expanded in unit_labels.items():
+        if unit_label in unit:
+            unit = unit.replace(unit_label,'').strip()
+            label = unit_label_expanded.strip()
+            found = True
+            break
+    if found:
+        return label, unit
+    if unit in unit_labels_stand_alone:
+        return '', unit_labels_stand_alone[unit]
+    for unit_label, unit_label_expanded in unit_labels_stand_alone.items():
+        if unit_label in unit:
+            unit = unit.replace(unit_label,'').strip()
+            label = unit_label_expanded.strip()
+            break
+    return label, unit
+
+def ref_make_addr_unit_and_label(unittype, unitid):
+    """ Reference implementation of make_addr_unit_and_label() """
+    if (unittype is None or unittype.strip() == '') and (unitid is None or unitid.strip() == ''):
+        return '', ''
+    if (unittype is None or unittype.strip() == ''):
+        return ref_get_unit_and_label_from_unit(unitid.upper())
+    return ref_get_unit_and_label(unittype.upper(), unitid.upper())
+
+# Random input generation.
+
+class InputGenerator():
+    """ Generates random strings that resemble the fields found in the address
+    data, mixed with abbreviations and special cases from the configuration
+    file, and the occasional bit of garbage.
+    """
+    def __init__(self, seed):
+        self.rnd = random.Random(seed)
+        self.words = ['MAIN', 'OAK', 'MCDONALD', 'MC DONALD', 'THE', 'AND', 'OF', 'ST',
+                      'MT', 'HWY', '2ND', '101', 'W', 'A*', 'C*', 'X*', 'T*', 'W*',
+                      'SAINT', 'ANDERSON', 'SAND', "O'BRIEN", 'DE LA', 'VSDB']
+        for case in CONF['street_name_special_cases']:
+            word = re.sub(r'\\[bZ]|[()]', '', case[0]).replace('\\*', '*').split('|')[0]
+            self.words.append(word.strip())
+        self.prefixes = list(CONF['street_prefixes'])
+        self.suffixes = list(CONF['street_suffixes'])
+        self.types = list(CONF['street_types'])
+        self.unit_labels = list(CONF['unit_labels']) + list(CONF['unit_labels_stand_alone'])
+
+    def garbage(self):
+        """ A short random string of characters """
+        chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789 *-/#.;\t'
+        return ''.join(self.rnd.choice(chars) for _ in range(self.rnd.randint(0, 8)))
+
+    def vary_case(self, string):
+        """ Randomly changes the case of a string """
+        choice = self.rnd.random()
+        if choice < 0.6:
+            return string
+        if choice < 0.8:
+            return string.lower()
+        return ''.join(self.rnd.choice((c.upper(), c.lower())) for c in string)
+
+    def pad(self, string):
+        """ Randomly adds whitespace around a string """
+        if self.rnd.random() < 0.2:
+            return self.rnd.choice([' ', '  ', '\t']) + string + self.rnd.choice(['', ' '])
+        return string
+
+    def pick(self, choices, garbage_rate=0.1):
+        """ Picks one of the choices, or occasionally some garbage """
+        if self.rnd.random() < garbage_rate:
+            return self.garbage()
+        return self.rnd.choice(choices)
+
+    def street_name(self):
+        """ A random street name """
+        words = [self.pick(self.words) for _ in range(self.rnd.randint(0, 4))]
+        return self.pad(self.vary_case(' '.join(words)))
+
+    def street_co(self):
+        """ Random arguments for make_addr_street_co() """
+        return (self.pick(['', '', 'OLD', 'NEW']),
+                self.pick(self.prefixes, 0.05),
+                self.pick(['', '', '', 'COUNTY ROAD', 'HIGHWAY']),
+                self.pick(['', '', '', 'OF THE']),
+                self.street_name(),
+                self.pick(self.types, 0.05),
+                self.pick(self.suffixes, 0.05))
+
+    def unit(self):
+        """ Random arguments for make_addr_unit_and_label() """
+        unittype = self.pick(['', '', '', None] + self.unit_labels, 0.2)
+        unitid = self.pick(['', '1', '5', '12B', 'A', 'REAR'] + self.unit_labels, 0.3)
+        if self.rnd.random() < 0.3:
+            unitid = self.pick(self.unit_labels) + self.rnd.choice(['', ' ']) + unitid
+        if self.rnd.random() < 0.05:
+            unitid = None
+        return self.vary_case(unittype) if unittype else unittype, \
+            self.pad(self.vary_case(unitid)) if unitid else unitid
+
+def outcome(func, *args):
+    """ Calls the function and returns either its result or the type of
+    exception it raised, so that the reference and optimized implementations
+    can be compared even when they fail.
+    """
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args)
+    except Exception as ex: # pylint: disable=W0718
+        return type(ex)
+
+class FuzzTestCase(unittest.TestCase):
+    """ Compares the normalization functions against the reference implementation.
+    """
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            addr_prep.get_conf()
+            co_addr_prep.get_conf()
+        self.gen = InputGenerator(SEED)
+
+    def check(self, func, ref_func, args):
+        """ Checks that func and ref_func produce the same result for args """
+        self.assertEqual(outcome(ref_func, *args), outcome(func, *args),
+                         f'{func.__module__}.{func.__name__}{args!r}')
+
+    def test_fix_street_name(self):
+        for _ in range(ITERATIONS):
+            args = (self.gen.street_name(),)
+            self.check(addr_prep.fix_street_name, ref_fix_street_name, args)
+            self.check(co_addr_prep.fix_street_name, ref_fix_street_name, args)
+
+    def test_make_addr_street_co(self):
+        for _ in range(ITERATIONS):
+            self.check(co_addr_prep.make_addr_street_co, ref_make_addr_street_co,
+                       self.gen.street_co())
+
+    def test_make_addr_unit_and_label(self):
+        for _ in range(ITERATIONS):
+            args = self.gen.unit()
+            self.check(addr_prep.make_addr_unit_and_label, ref_make_addr_unit_and_label, args)
+            self.check(co_addr_prep.make_addr_unit_and_label, ref_make_addr_unit_and_label,
+                       args)
+
+if __name__ == '__main__':
+    unittest.main()
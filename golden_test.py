@@ -0,0 +1,396 @@
+#!/usr/bin/python3
+"""Golden output regression tests for the address programs.
+
+Each case runs one of the programs on a fixture (from test_data/ or the Castle
+Pines data) and compares a canonical form of the output against the stored
+golden output in test_data/golden/.  The canonical form ignores attribute and
+column order as well as whitespace, so only real changes to the output cause
+a failure.  This allows the normalization and QC code to be rewritten for speed
+with some confidence that the results have not changed.
+
+co_addr_prep.py main() is not covered as it requires a file geodatabase; its
+normalization functions are covered by fuzz_test.py instead.
+
+Usage:
+$ python3 golden_test.py
+
+After an intentional change to the output of one of the programs, rewrite the
+golden files with:
+$ python3 golden_test.py --update
+"""
+from xml.etree import ElementTree
+import contextlib
+import csv
+import gzip
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_DATA_DIR = os.path.join(REPO_DIR, 'test_data')
+GOLDEN_DIR = os.path.join(TEST_DATA_DIR, 'golden')
+CASTLE_PINES_OSM = os.path.join(REPO_DIR, 'Castle_Pines_Addr_Update_2024_02_21',
+                                'CastlePines.osm')
+UPDATE = os.environ.get('GOLDEN_UPDATE') == '1'
+
+def canonical_osm(file_name, sort_tags=False):
+    """ Returns a canonical text form of an .osm (or any xml) file. Each element
+    is placed on its own line, indented by its depth, with its attributes sorted
+    by name.  Whitespace between elements is ignored.  With sort_tags, the tags
+    of each node are sorted by key.
+    """
+    lines = []
+    def add_element(element, depth):
+        attrs = ' '.join(f'{k}={v!r}' for k, v in sorted(element.attrib.items()))
+        line = '  ' * depth + element.tag
+        if attrs:
+            line += ' ' + attrs
+        if element.text and element.text.strip():
+            line += ' text=' + repr(element.text.strip())
+        lines.append(line)
+        children = list(element)
+        if sort_tags:
+            children.sort(key=lambda child: (child.tag != 'tag', child.get('k', '')))
+        for child in children:
+            add_element(child, depth + 1)
+    add_element(ElementTree.parse(file_name).getroot(), 0)
+    return '\n'.join(lines) + '\n'
+
+def canonical_csv(file_name):
+    """ Returns a canonical text form of a .csv file.  Each row is placed on its
+    own line as column=value pairs sorted by column name, with leading and
+    trailing whitespace removed from the values.
+    """
+    lines = []
+    with open(file_name, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            lines.append(' | '.join(f'{k}={(v or "").strip()}'
+                                    for k, v in sorted(row.items())))
+    return '\n'.join(lines) + '\n'
+
+def canonical_text(text):
+    """ Returns a canonical form of plain text output, i.e. with trailing
+    whitespace and trailing blank lines removed.
+    """
+    lines = [line.rstrip() for line in text.splitlines()]
+    while lines and not lines[-1]:
+        lines.pop()
+    return '\n'.join(lines) + '\n'
+
+def canonical_osm_dir(dir_name, sort_tags=False):
+    """ Returns a canonical text form of a directory of .osm files.  With
+    sort_tags, the tags of each node are sorted by key.
+    """
+    text = ''
+    for file_name in sorted(os.listdir(dir_name)):
+        text += f'== {file_name} ==\n'
+        text += canonical_osm(os.path.join(dir_name, file_name), sort_tags)
+    return text
+
+def run_program(program, args, cwd):
+    """ Runs one of the programs in the repository as a separate process and
+    returns what it wrote to stdout.
+    """
+    result = subprocess.run([sys.executable, os.path.join(REPO_DIR, program)] + args,
+                            cwd=cwd, capture_output=True, text=True, check=True,
+                            encoding='utf-8')
+    return result.stdout
+
+def copy_fixtures(work_dir, *file_names):
+    """ Copies the given files into the work directory, along with the
+    configuration file.
+    """
+    shutil.copy(os.path.join(REPO_DIR, 'addr_prep.conf'), work_dir)
+    for file_name in file_names:
+        shutil.copy(file_name, work_dir)
+
+def case_split_va(work_dir):
+    """ addr_split.py on the Virginia sample file """
+    copy_fixtures(work_dir, os.path.join(TEST_DATA_DIR, 'va_sample.csv'))
+    run_program('addr_split.py', ['va_sample.csv', 'Augusta County'], work_dir)
+    return canonical_csv(os.path.join(work_dir, 'augusta_raw.csv'))
+
+def case_split_va_threads_store(work_dir):
+    """ addr_split.py with --threads and --store, which must produce the same
+    output as case_split_va
+    """
+    copy_fixtures(work_dir, os.path.join(TEST_DATA_DIR, 'va_sample.csv'))
+    run_program('addr_split.py', ['va_sample.csv', 'Augusta County', '--threads', '--store',
+                                  'work.sqlite'], work_dir)
+    return canonical_csv(os.path.join(work_dir, 'augusta_raw.csv'))
+
+def case_prep_va(work_dir):
+    """ addr_prep.py on the Virginia sample file """
+    copy_fixtures(work_dir)
+    shutil.copy(os.path.join(TEST_DATA_DIR, 'va_sample.csv'),
+                os.path.join(work_dir, 'va_sample_raw.csv'))
+    run_program('addr_prep.py', ['va_sample_raw.csv'], work_dir)
+    return canonical_csv(os.path.join(work_dir, 'va_sample_prep.csv'))
+
+def case_prep_va_threads(work_dir):
+    """ addr_prep.py with --threads, which must produce the same output as
+    case_prep_va
+    """
+    copy_fixtures(work_dir)
+    shutil.copy(os.path.join(TEST_DATA_DIR, 'va_sample.csv'),
+                os.path.join(work_dir, 'va_sample_raw.csv'))
+    run_program('addr_prep.py', ['va_sample_raw.csv', '--threads'], work_dir)
+    return canonical_csv(os.path.join(work_dir, 'va_sample_prep.csv'))
+
+def case_prep_va_threads_store(work_dir):
+    """ addr_prep.py with --threads and --store, which must produce the same
+    output as case_prep_va
+    """
+    copy_fixtures(work_dir)
+    shutil.copy(os.path.join(TEST_DATA_DIR, 'va_sample.csv'),
+                os.path.join(work_dir, 'va_sample_raw.csv'))
+    run_program('addr_prep.py', ['va_sample_raw.csv', '--threads', '--store', 'work.sqlite'],
+                work_dir)
+    return canonical_csv(os.path.join(work_dir, 'va_sample_prep.csv'))
+
+def case_prep_va_gz(work_dir):
+    """ addr_prep.py on a gzip compressed input file, which must produce the same
+    (but compressed) output as case_prep_va
+    """
+    copy_fixtures(work_dir)
+    with open(os.path.join(TEST_DATA_DIR, 'va_sample.csv'), 'rb') as csv_in:
+        with gzip.open(os.path.join(work_dir, 'va_sample_raw.csv.gz'), 'wb') as csv_out:
+            shutil.copyfileobj(csv_in, csv_out)
+    run_program('addr_prep.py', ['va_sample_raw.csv.gz'], work_dir)
+    with gzip.open(os.path.join(work_dir, 'va_sample_prep.csv.gz'), 'rb') as csv_in:
+        with open(os.path.join(work_dir, 'va_sample_prep.csv'), 'wb') as csv_out:
+            shutil.copyfileobj(csv_in, csv_out)
+    return canonical_csv(os.path.join(work_dir, 'va_sample_prep.csv'))
+
+def case_split_prep_va(work_dir):
+    """ addr_split.py followed by addr_prep.py on the Virginia sample file """
+    copy_fixtures(work_dir, os.path.join(TEST_DATA_DIR, 'va_sample.csv'))
+    run_program('addr_split.py', ['va_sample.csv', 'Staunton City'], work_dir)
+    run_program('addr_prep.py', ['staunton city_raw.csv'], work_dir)
+    return canonical_csv(os.path.join(work_dir, 'staunton city_prep.csv'))
+
+def case_pipeline_va(work_dir):
+    """ addr_pipeline.py running addr_split and addr_prep as a single pass, which
+    must produce the same output as case_split_prep_va
+    """
+    copy_fixtures(work_dir, os.path.join(TEST_DATA_DIR, 'va_sample.csv'))
+    run_program('addr_pipeline.py', ['va', 'va_sample.csv', '--county', 'Staunton City',
+                                     '--output', 'staunton_prep.csv'], work_dir)
+    return canonical_csv(os.path.join(work_dir, 'staunton_prep.csv'))
+
+def case_qc_sample(work_dir):
+    """ addr_qc.py on a small file containing many kinds of errors """
+    copy_fixtures(work_dir, os.path.join(TEST_DATA_DIR, 'qc_sample.osm'),
+                  os.path.join(TEST_DATA_DIR, 'zip_code_database.csv'))
+    return canonical_text(run_program('addr_qc.py', ['qc_sample.osm'], work_dir))
+
+def case_qc_sample_bounds(work_dir):
+    """ addr_qc.py on the qc_sample data with a bounding box, and a boundary with
+    a hole, which exclude some of the nodes
+    """
+    copy_fixtures(work_dir, os.path.join(TEST_DATA_DIR, 'qc_sample.osm'),
+                  os.path.join(TEST_DATA_DIR, 'zip_code_database.csv'),
+                  os.path.join(TEST_DATA_DIR, 'qc_boundary.geojson'))
+    return canonical_text(run_program('addr_qc.py', ['qc_sample.osm', '--bbox',
+                                                     '38.0,-79.2,38.3,-78.95', '--boundary',
+                                                     'qc_boundary.geojson'], work_dir))
+
+def case_qc_castle_pines(work_dir):
+    """ addr_qc.py on the Castle Pines data """
+    copy_fixtures(work_dir, CASTLE_PINES_OSM,
+                  os.path.join(TEST_DATA_DIR, 'zip_code_database.csv'))
+    return canonical_text(run_program('addr_qc.py', ['CastlePines.osm'], work_dir))
+
+def case_qc_castle_pines_threads(work_dir):
+    """ addr_qc.py with --threads, which must produce the same output as
+    case_qc_castle_pines
+    """
+    copy_fixtures(work_dir, CASTLE_PINES_OSM,
+                  os.path.join(TEST_DATA_DIR, 'zip_code_database.csv'))
+    return canonical_text(run_program('addr_qc.py', ['CastlePines.osm', '--threads'], work_dir))
+
+def case_qc_castle_pines_max_memory(work_dir):
+    """ addr_qc.py with a memory budget so small that the addresses and
+    locations are spilled to disk, which must produce the same output as
+    case_qc_castle_pines
+    """
+    copy_fixtures(work_dir, CASTLE_PINES_OSM,
+                  os.path.join(TEST_DATA_DIR, 'zip_code_database.csv'))
+    return canonical_text(run_program('addr_qc.py', ['CastlePines.osm', '--max-memory', '0.01'],
+                                      work_dir))
+
+def case_qc_castle_pines_cache(work_dir):
+    """ addr_qc.py with --cache, run twice so that the second run takes the
+    results of every street from the cache, which must produce the same output
+    as case_qc_castle_pines each time.  The output of both runs is returned if
+    they differ.
+    """
+    copy_fixtures(work_dir, CASTLE_PINES_OSM,
+                  os.path.join(TEST_DATA_DIR, 'zip_code_database.csv'))
+    outputs = [canonical_text(run_program('addr_qc.py', ['CastlePines.osm', '--cache',
+                                                         'qc_cache.sqlite'], work_dir))
+               for _ in range(2)]
+    return outputs[0] if outputs[0] == outputs[1] else '\n'.join(outputs)
+
+def osm_to_store(osm_file, store_file):
+    """ Writes the nodes of a .osm file to the addresses layer of a store """
+    # pylint: disable=C0415
+    import addr_pipeline
+    import addr_store
+    with addr_store.StoreSink(store_file) as sink:
+        addr_pipeline.drain(addr_pipeline.osm_source(osm_file), sink)
+
+def case_qc_sample_store(work_dir):
+    """ addr_qc.py on the qc_sample data read from a store, which must produce
+    the same output as case_qc_sample
+    """
+    copy_fixtures(work_dir, os.path.join(TEST_DATA_DIR, 'zip_code_database.csv'))
+    osm_to_store(os.path.join(TEST_DATA_DIR, 'qc_sample.osm'),
+                 os.path.join(work_dir, 'work.sqlite'))
+    return canonical_text(run_program('addr_qc.py', ['work.sqlite'], work_dir))
+
+def case_qc_castle_pines_store(work_dir):
+    """ addr_qc.py on the Castle Pines data read from a store, which must produce
+    the same output as case_qc_castle_pines
+    """
+    copy_fixtures(work_dir, os.path.join(TEST_DATA_DIR, 'zip_code_database.csv'))
+    osm_to_store(CASTLE_PINES_OSM, os.path.join(work_dir, 'work.sqlite'))
+    return canonical_text(run_program('addr_qc.py', ['work.sqlite'], work_dir))
+
+def case_split_street_castle_pines(work_dir):
+    """ split_osm_addr_by_street.py on the Castle Pines data """
+    copy_fixtures(work_dir, CASTLE_PINES_OSM)
+    out_dir = os.path.join(work_dir, 'out')
+    os.mkdir(out_dir)
+    run_program('split_osm_addr_by_street.py', ['CastlePines.osm', out_dir], work_dir)
+    return canonical_osm_dir(out_dir)
+
+def case_split_street_castle_pines_store(work_dir):
+    """ split_osm_addr_by_street.py on the Castle Pines data read from a store.
+    The tags are read from the store in the order of its columns, so those of
+    each node are sorted by key.
+    """
+    osm_to_store(CASTLE_PINES_OSM, os.path.join(work_dir, 'work.sqlite'))
+    out_dir = os.path.join(work_dir, 'out')
+    os.mkdir(out_dir)
+    run_program('split_osm_addr_by_street.py', ['work.sqlite', out_dir], work_dir)
+    return canonical_osm_dir(out_dir, sort_tags=True)
+
+def case_existing_castle_pines(work_dir):
+    """ co_addr_prep.get_existing_addrs() on the Castle Pines data """
+    # pylint: disable=C0415
+    import co_addr_prep
+    copy_fixtures(work_dir, CASTLE_PINES_OSM)
+    with contextlib.redirect_stdout(io.StringIO()):
+        existing = co_addr_prep.get_existing_addrs(
+            os.path.join(work_dir, 'CastlePines.osm'), 'Castle Pines')
+    return ''.join(repr(addr) + '\n' for addr in sorted(existing))
+
+CASES = {
+    'split_va': case_split_va,
+    'split_va_threads_store': case_split_va_threads_store,
+    'prep_va': case_prep_va,
+    'prep_va_threads': case_prep_va_threads,
+    'prep_va_threads_store': case_prep_va_threads_store,
+    'prep_va_gz': case_prep_va_gz,
+    'split_prep_va': case_split_prep_va,
+    'pipeline_va': case_pipeline_va,
+    'qc_sample': case_qc_sample,
+    'qc_sample_bounds': case_qc_sample_bounds,
+    'qc_castle_pines': case_qc_castle_pines,
+    'qc_castle_pines_threads': case_qc_castle_pines_threads,
+    'qc_castle_pines_max_memory': case_qc_castle_pines_max_memory,
+    'qc_castle_pines_cache': case_qc_castle_pines_cache,
+    'qc_sample_store': case_qc_sample_store,
+    'qc_castle_pines_store': case_qc_castle_pines_store,
+    'split_street_castle_pines': case_split_street_castle_pines,
+    'split_street_castle_pines_store': case_split_street_castle_pines_store,
+    'existing_castle_pines': case_existing_castle_pines,
+}
+
+class GoldenTestCase(unittest.TestCase):
+    """ Compares the output of each case against its golden file.
+    """
+    maxDiff = None
+
+    def check_case(self, name, golden_name=None):
+        """ Runs the named case and compares (or with --update, replaces) its
+        golden file.  By default the golden file has the same name as the case.
+        """
+        golden_file = os.path.join(GOLDEN_DIR, (golden_name or name) + '.txt')
+        with tempfile.TemporaryDirectory() as work_dir:
+            actual = CASES[name](work_dir)
+        if UPDATE:
+            with open(golden_file, 'w', encoding='utf-8') as golden_out:
+                golden_out.write(actual)
+            return
+        with open(golden_file, encoding='utf-8') as golden_in:
+            expected = golden_in.read()
+        self.assertEqual(expected, actual, f'output of case {name} differs from {golden_file}')
+
+    def test_split_va(self):
+        self.check_case('split_va')
+
+    def test_split_va_threads_store(self):
+        self.check_case('split_va_threads_store', 'split_va')
+
+    def test_prep_va(self):
+        self.check_case('prep_va')
+
+    def test_prep_va_threads(self):
+        self.check_case('prep_va_threads', 'prep_va')
+
+    def test_prep_va_threads_store(self):
+        self.check_case('prep_va_threads_store', 'prep_va')
+
+    def test_prep_va_gz(self):
+        self.check_case('prep_va_gz', 'prep_va')
+
+    def test_split_prep_va(self):
+        self.check_case('split_prep_va')
+
+    def test_pipeline_va(self):
+        self.check_case('pipeline_va', 'split_prep_va')
+
+    def test_qc_sample(self):
+        self.check_case('qc_sample')
+
+    def test_qc_sample_bounds(self):
+        self.check_case('qc_sample_bounds')
+
+    def test_qc_castle_pines(self):
+        self.check_case('qc_castle_pines')
+
+    def test_qc_castle_pines_threads(self):
+        self.check_case('qc_castle_pines_threads', 'qc_castle_pines')
+
+    def test_qc_castle_pines_max_memory(self):
+        self.check_case('qc_castle_pines_max_memory', 'qc_castle_pines')
+
+    def test_qc_castle_pines_cache(self):
+        self.check_case('qc_castle_pines_cache', 'qc_castle_pines')
+
+    def test_qc_sample_store(self):
+        self.check_case('qc_sample_store', 'qc_sample')
+
+    def test_qc_castle_pines_store(self):
+        self.check_case('qc_castle_pines_store', 'qc_castle_pines')
+
+    def test_split_street_castle_pines(self):
+        self.check_case('split_street_castle_pines')
+
+    def test_split_street_castle_pines_store(self):
+        self.check_case('split_street_castle_pines_store')
+
+    def test_existing_castle_pines(self):
+        self.check_case('existing_castle_pines')
+
+if __name__ == '__main__':
+    if '--update' in sys.argv:
+        sys.argv.remove('--update')
+        UPDATE = True
+    unittest.main()
@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+""" osm_pbf - Reads the tags of the nodes, ways and relations in an OSM PBF
+(.osm.pbf) file, such as the Geofabrik regional extracts.
+
+The file is decoded directly (see https://wiki.openstreetmap.org/wiki/PBF_Format)
+so that no protobuf or osmium package is needed.  A PBF file is a sequence of
+independently compressed blobs of a few thousand elements each, so the blobs
+are decompressed and decoded in parallel, in a pool of worker processes.  Only
+the tags that were asked for are decoded, and only the elements having at
+least one of them are returned to the main process, which keeps the decoding
+of a whole state's extract for its addresses quick.
+
+Usage:
+    for tags in tagged_elements('colorado-latest.osm.pbf', ['addr:street', 'addr:city']):
+        ...
+
+Locations are not decoded, as a way or relation only has a location once the
+locations of all of its nodes (from other blobs) are known.
+"""
+import collections
+import lzma
+import os
+import struct
+import zlib
+
+# The features (from the OSMHeader block) which this module can read
+SUPPORTED_FEATURES = {'OsmSchema-V0.6', 'DenseNodes'}
+
+def _varint(buf, pos):
+    """ Decodes the protobuf varint at pos in buf, returning its value and the
+    position after it.
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def _fields(buf):
+    """ A generator function which yields the (field number, value) of each field
+    in the protobuf message in buf.  The value is an int for varints, and a
+    slice of buf for the other wire types.
+    """
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = _varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f'unsupported protobuf wire type {wire_type}')
+        yield key >> 3, value
+
+def _packed_varints(buf):
+    """ Returns the list of (unsigned) varints in a packed repeated field.
+    """
+    values = []
+    append = values.append
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        byte = buf[pos]
+        pos += 1
+        if byte < 0x80:
+            append(byte)
+            continue
+        result = byte & 0x7f
+        shift = 7
+        while True:
+            byte = buf[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        append(result)
+    return values
+
+def _blobs(file_name):
+    """ A generator function which yields the type ('OSMHeader' or 'OSMData') and
+    the (still compressed) Blob message of each blob in the file.
+    """
+    with open(file_name, 'rb') as pbf_in:
+        while True:
+            size = pbf_in.read(4)
+            if not size:
+                return
+            header = pbf_in.read(struct.unpack('>I', size)[0])
+            blob_type = None
+            data_size = 0
+            for number, value in _fields(header):
+                if number == 1:
+                    blob_type = bytes(value).decode('utf-8')
+                elif number == 3:
+                    data_size = value
+            yield blob_type, pbf_in.read(data_size)
+
+def _blob_data(blob):
+    """ Returns the decompressed contents of a Blob message.
+    """
+    for number, value in _fields(blob):
+        if number == 1:
+            return value
+        if number == 3:
+            return zlib.decompress(value)
+        if number == 4:
+            return lzma.decompress(value)
+        if number == 7:
+            # pylint: disable=C0415
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(value)
+        if number in (5, 6):
+            raise ValueError('bzip2 and lz4 compressed PBF blobs are not supported')
+    return b''
+
+def _check_header(blob):
+    """ Raises ValueError if the OSMHeader blob requires features which this
+    module cannot read (e.g. HistoricalInformation).
+    """
+    for number, value in _fields(_blob_data(blob)):
+        if number == 4:
+            feature = bytes(value).decode('utf-8')
+            if feature not in SUPPORTED_FEATURES:
+                raise ValueError(f'unsupported PBF feature {feature}')
+
+def block_tags(blob, keys):
+    """ Decodes an OSMData blob, returning a list with a dictionary of the tags
+    whose keys are in keys for each node, way and relation having any of them.
+    If a key appears more than once in an element, the first value is used.
+    This is run in the worker processes.
+    """
+    strings = []
+    groups = []
+    for number, value in _fields(memoryview(_blob_data(blob))):
+        if number == 1:
+            strings = [string for string_number, string in _fields(value) if string_number == 1]
+        elif number == 2:
+            groups.append(value)
+    # Only the wanted keys, and the values of the wanted keys, are decoded
+    wanted = {index: bytes(string).decode('utf-8') for index, string in enumerate(strings)
+              if string in keys}
+    if not wanted:
+        return []
+    values = {}
+    def value_of(index):
+        value = values.get(index)
+        if value is None:
+            value = values[index] = bytes(strings[index]).decode('utf-8')
+        return value
+    elements = []
+    for group in groups:
+        for number, value in _fields(group):
+            if number == 2:
+                # DenseNodes: keys_vals holds key, value, key, value, ..., 0 for each node
+                for dense_number, dense_value in _fields(value):
+                    if dense_number != 10:
+                        continue
+                    tags = None
+                    keys_vals = _packed_varints(dense_value)
+                    pos = 0
+                    end = len(keys_vals)
+                    while pos < end:
+                        key = keys_vals[pos]
+                        if key == 0:
+                            if tags:
+                                elements.append(tags)
+                            tags = None
+                            pos += 1
+                            continue
+                        if key in wanted:
+                            if tags is None:
+                                tags = {}
+                            tags.setdefault(wanted[key], value_of(keys_vals[pos + 1]))
+                        pos += 2
+            elif number in (1, 3, 4):
+                # Node, Way or Relation, with packed keys (2) and vals (3)
+                element_keys = element_vals = ()
+                for element_number, element_value in _fields(value):
+                    if element_number == 2:
+                        element_keys = _packed_varints(element_value)
+                    elif element_number == 3:
+                        element_vals = _packed_varints(element_value)
+                tags = {}
+                for key, val in zip(element_keys, element_vals):
+                    if key in wanted:
+                        tags.setdefault(wanted[key], value_of(val))
+                if tags:
+                    elements.append(tags)
+    return elements
+
+def tagged_elements(file_name, keys, workers=None):
+    """ A generator function which reads a .osm.pbf file, yielding a dictionary of
+    the tags whose keys are in keys for each node, way and relation having any
+    of them, in the order in which they appear in the file.
+
+    Parameters:
+        file_name - (in) The .osm.pbf file
+        keys - (in) The keys of the tags wanted, e.g. ['addr:street', 'addr:city']
+        workers - (in) The number of worker processes decoding the blobs.  By
+            default one per CPU.  With 1, the blobs are decoded in this process.
+    """
+    keys = frozenset(key.encode('utf-8') for key in keys)
+    workers = workers or os.cpu_count() or 1
+    def data_blobs():
+        for blob_type, blob in _blobs(file_name):
+            if blob_type == 'OSMHeader':
+                _check_header(blob)
+            elif blob_type == 'OSMData':
+                yield blob
+    if workers == 1:
+        for blob in data_blobs():
+            yield from block_tags(blob, keys)
+        return
+    # Only imported when needed, as multiprocessing is slow to import
+    from concurrent.futures import ProcessPoolExecutor # pylint: disable=C0415
+    with ProcessPoolExecutor(workers) as executor:
+        # Only a few blobs per worker are read ahead, so that the whole file is
+        # never held in memory.
+        pending = collections.deque()
+        for blob in data_blobs():
+            pending.append(executor.submit(block_tags, blob, keys))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
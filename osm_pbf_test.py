@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+"""Unit tests for the osm_pbf module, and the reading of existing addresses from
+.osm.pbf files by co_addr_prep.
+
+The sample .osm.pbf file is written by the test, from the nodes of the Castle
+Pines data plus a way and a relation, using a minimal protobuf encoder.
+
+Usage:
+$ python3 osm_pbf_test.py
+
+"""
+from xml.etree import ElementTree
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+import co_addr_prep
+import osm_pbf
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CASTLE_PINES_OSM = os.path.join(REPO_DIR, 'Castle_Pines_Addr_Update_2024_02_21',
+                                'CastlePines.osm')
+
+def varint(value):
+    """ Encodes a protobuf varint """
+    out = b''
+    while value > 0x7f:
+        out += bytes([value & 0x7f | 0x80])
+        value >>= 7
+    return out + bytes([value])
+
+def zigzag(value):
+    """ Encodes a protobuf sint64 """
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def field(number, value):
+    """ Encodes a field, either a varint (int) or length delimited (bytes) """
+    if isinstance(value, int):
+        return varint(number << 3) + varint(value)
+    return varint(number << 3 | 2) + varint(len(value)) + value
+
+def packed(number, values):
+    """ Encodes a packed repeated field of varints """
+    return field(number, b''.join(varint(value) for value in values))
+
+def blob(blob_type, data):
+    """ Encodes a BlobHeader and zlib compressed Blob """
+    blob_bytes = field(2, len(data)) + field(3, zlib.compress(data))
+    header = field(1, blob_type.encode()) + field(3, len(blob_bytes))
+    return struct.pack('>I', len(header)) + header + blob_bytes
+
+class StringTable():
+    """ Builds the string table of a PrimitiveBlock """
+    def __init__(self):
+        self.strings = ['']
+
+    def index(self, string):
+        if string not in self.strings:
+            self.strings.append(string)
+        return self.strings.index(string)
+
+    def encode(self):
+        return field(1, b''.join(field(1, string.encode()) for string in self.strings))
+
+def data_block(nodes, ways=(), relations=()):
+    """ Encodes a PrimitiveBlock with the nodes (a list of (id, lat, lon, tags))
+    as DenseNodes, and the ways and relations (lists of (id, tags)).
+    """
+    table = StringTable()
+    ids = []
+    lats = []
+    lons = []
+    keys_vals = []
+    last = (0, 0, 0)
+    for node_id, lat, lon, tags in nodes:
+        lat = round(lat * 1e7)
+        lon = round(lon * 1e7)
+        ids.append(zigzag(node_id - last[0]))
+        lats.append(zigzag(lat - last[1]))
+        lons.append(zigzag(lon - last[2]))
+        last = (node_id, lat, lon)
+        for key, value in tags.items():
+            keys_vals += [table.index(key), table.index(value)]
+        keys_vals.append(0)
+    groups = field(2, field(2, packed(1, ids) + packed(8, lats) + packed(9, lons) +
+                            packed(10, keys_vals)))
+    for number, elements in ((3, ways), (4, relations)):
+        for element_id, tags in elements:
+            groups += field(2, field(number, field(1, element_id) +
+                                     packed(2, [table.index(key) for key in tags]) +
+                                     packed(3, [table.index(value) for value in tags.values()])))
+    return table.encode() + groups
+
+def castle_pines_nodes():
+    """ Returns the nodes of the Castle Pines data, as (id, lat, lon, tags) """
+    nodes = []
+    for elem in ElementTree.parse(CASTLE_PINES_OSM).getroot().iter('node'):
+        tags = {tag.attrib['k']: tag.attrib['v'] for tag in elem.iter('tag')}
+        nodes.append((int(elem.attrib['id']), float(elem.attrib['lat']),
+                      float(elem.attrib['lon']), tags))
+    return nodes
+
+WAY_TAGS = {'building': 'yes', 'addr:housenumber': '1', 'addr:street': 'Way Street',
+            'addr:city': 'Castle Pines'}
+RELATION_TAGS = {'type': 'multipolygon', 'addr:housenumber': '2',
+                 'addr:street': 'Relation Road', 'addr:city': 'Elsewhere'}
+
+class PbfTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.TemporaryDirectory() # pylint: disable=R1732
+        cls.pbf_file = os.path.join(cls.work_dir.name, 'sample.osm.pbf')
+        nodes = castle_pines_nodes()
+        # A node without tags, which must be skipped
+        nodes.insert(5, (100, 39.5, -104.9, {}))
+        with open(cls.pbf_file, 'wb') as pbf_out:
+            pbf_out.write(blob('OSMHeader', field(4, b'OsmSchema-V0.6') +
+                               field(4, b'DenseNodes')))
+            for start in range(0, len(nodes), 100):
+                pbf_out.write(blob('OSMData', data_block(nodes[start:start + 100])))
+            pbf_out.write(blob('OSMData', data_block([], [(7, WAY_TAGS)],
+                                                     [(8, RELATION_TAGS)])))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.work_dir.cleanup()
+
+    def test_tagged_elements(self):
+        keys = ['addr:street', 'addr:city']
+        expected = [{key: tags[key] for key in keys if key in tags}
+                    for _, _, _, tags in castle_pines_nodes()]
+        expected += [{'addr:street': 'Way Street', 'addr:city': 'Castle Pines'},
+                     {'addr:street': 'Relation Road', 'addr:city': 'Elsewhere'}]
+        self.assertEqual(list(osm_pbf.tagged_elements(self.pbf_file, keys, workers=1)), expected)
+        self.assertEqual(list(osm_pbf.tagged_elements(self.pbf_file, keys, workers=2)), expected)
+
+    def test_existing_addrs(self):
+        expected = co_addr_prep.get_existing_addrs(CASTLE_PINES_OSM, 'Castle Pines')
+        expected.add(('Castle Pines', 'Way Street', '1', ''))
+        self.assertEqual(co_addr_prep.get_existing_addrs(self.pbf_file, 'castle pines'), expected)
+
+    def test_unsupported_feature(self):
+        file_name = os.path.join(self.work_dir.name, 'history.osm.pbf')
+        with open(file_name, 'wb') as pbf_out:
+            pbf_out.write(blob('OSMHeader', field(4, b'HistoricalInformation')))
+        with self.assertRaises(ValueError):
+            list(osm_pbf.tagged_elements(file_name, ['addr:street']))
+
+if __name__ == '__main__':
+    unittest.main()
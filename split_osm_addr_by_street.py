@@ -1,29 +1,20 @@
 #!/usr/bin/python3
 """ split_osm_addr_by_street - Split a file of OSM addresses into separate file based upon
-street name (addr:street).  Both the input and output files are in the .osm format.
+street name (addr:street).  Both the input and output files are in the .osm format,
+or the input may be an SQLite working store (see addr_store), from which the
+addresses of each street are read in turn with an indexed query.
+Nodes without an addr:city or addr:street are written to files named NoCity__...
+or ...__NoStreet.
+
+With --max-addresses, streets with more addresses than that are cut into
+spatially compact tiles written to numbered files, e.g. City__Street__2.osm, and
+with --tiles the addresses are split into such tiles regardless of street.
 """
-from xml.etree import ElementTree
 import argparse
-import os
-
-def get_value(key, element):
-    """ Given an OSM key and an xml element tree element, return the value of the key.
-
-    Parameters:
-        key - (in) The OSM key.
-        element - (in) an xml ElementTree element.
-
-    Returns:
-        The value of the specified key, or if key isn't found, returns None
-    """
-    for child in element:
-        if child.tag == 'tag':
-            if 'k' in child.attrib:
-                k = child.attrib['k']
-                if k == key:
-                    if 'v' in child.attrib:
-                        return child.attrib['v']
-    return None
+import addr_pipeline
+import addr_stats
+import addr_store
+from addr_stats import STATS
 
 def get_args():
     """ Gets the command line arguments that were present when program was
@@ -41,40 +32,69 @@ def get_args():
         description='Splits a .osm file containing addresses into separate files'
             'based on street name')
     parser.add_argument("in_file",
-                        help="An .osm file containing addresses which is to be split")
+                        help="An .osm file (or .sqlite store) containing addresses which is "
+                        "to be split")
     parser.add_argument("out_dir", help="directory in which to write the output files")
-    return parser.parse_args()
+    parser.add_argument("--max-addresses", type=int, metavar='N',
+                        help="the maximum number of addresses in each output file (default "
+                        f"{addr_pipeline.MAX_TILE_ADDRESSES} with --tiles)")
+    parser.add_argument("--tiles", action='store_true',
+                        help="split into spatially compact tiles rather than by street")
+    addr_pipeline.add_order_args(parser)
+    addr_pipeline.add_args(parser)
+    addr_stats.add_args(parser)
+    args = parser.parse_args()
+    if args.tiles and not args.max_addresses:
+        args.max_addresses = addr_pipeline.MAX_TILE_ADDRESSES
+    return args
+
+def split_file(in_file, out_dir, threads=False, max_size=None, curve=None, tiles=False):
+    """ Splits the given .osm file into separate files, in out_dir, based on
+    street name.
+
+    Parameters:
+        in_file - (in) The .osm file containing the addresses.
+        out_dir - (in) The directory in which to write the output files.
+        threads - (in) If True, reading and writing are done in separate threads.
+        max_size - (in) Optional maximum number of addresses in each file.
+        curve - (in) Optional curve ('hilbert' or 'zorder') along which the
+            addresses of each file are sorted.
+        tiles - (in) If True, the addresses are split into tiles of at most
+            max_size addresses rather than by street.
+    """
+    # pylint: disable=R0913
+    if addr_store.is_store(in_file) and not tiles:
+        split_store(in_file, out_dir, max_size, curve)
+        return
+    if addr_store.is_store(in_file):
+        batches = addr_store.store_source(in_file)
+    else:
+        batches = addr_pipeline.read_ahead(addr_pipeline.osm_source(in_file), threads)
+    if tiles:
+        sink = addr_pipeline.TileSplitSink(out_dir, max_size, curve or 'hilbert')
+    else:
+        sink = addr_pipeline.StreetSplitSink(out_dir, max_size, curve)
+    with addr_pipeline.write_behind(sink, threads) as sink:
+        addr_pipeline.drain(batches, sink)
+
+def split_store(store, out_dir, max_size=None, curve=None):
+    """ Splits the addresses layer of a store into separate files, in out_dir,
+    based on street name, reading one street at a time.  The arguments are as
+    for split_file().
+    """
+    sink = addr_pipeline.StreetSplitSink(out_dir, max_size, curve)
+    files = 0
+    for base_name, records in addr_store.street_groups(store):
+        with STATS.timer('write', len(records)):
+            files += sink.write_street(base_name, records)
+    STATS.count('files written', files)
 
 def main():
     """ The main function.
     """
     args = get_args()
-    tree = ElementTree.parse(args.in_file)
-    root = tree.getroot()
-    out={}
-    for child in root:
-        if child.tag == 'node':
-            city = get_value('addr:city', child).strip().replace(' ','_')
-            street = get_value('addr:street', child).strip().replace(' ', '_')
-            if not street:
-                file_name = 'NoStreet'
-            if not city:
-                city = 'NoCity'
-            file_name = city + '__' + street
-            file_name = os.path.join(args.out_dir, file_name + ".osm")
-            if file_name not in out:
-                # pylint: disable=R1732
-                file_handle = open(file_name, 'w', encoding='utf-8')
-                out[file_name] = file_handle
-                file_handle.write("<?xml version='1.0' encoding='UTF-8'?>\n"
-                    "<osm version='0.6' upload='never' download='never' "
-                    "generator='JOSM'>\n")
-            else:
-                file_handle = out[file_name]
-            file_handle.write(ElementTree.tostring(child).decode())
-    for _, file_handle in out.items():
-        file_handle.write("</osm>")
-        file_handle.close()
+    addr_stats.run(split_file, args, args.in_file, args.out_dir, args.threads,
+                   args.max_addresses, args.order, args.tiles)
 
 if __name__ == '__main__':
     main()